@@ -0,0 +1,409 @@
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import cv2
+import numpy as np
+from pix_code_encoder import Encoder
+from pix_code_decoder import Decoder
+from pix_code_video import BACKEND_OPENCV, BACKENDS, open_reader
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Text repeated to build compressible payloads
+SAMPLE_TEXT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "assets", "lorem.txt"
+)
+
+
+def make_payload(size, kind="random", seed=0):
+    """
+    Build a synthetic payload.
+
+    Parameters:
+    size (int): Number of bytes.
+    kind (str, optional): 'random' for incompressible bytes, or 'text' for the
+                          sample text repeated up to size.
+    seed (int, optional): Seed of the random bytes.
+
+    Returns:
+    bytes: The payload.
+    """
+    if kind == "text":
+        with open(SAMPLE_TEXT, "rb") as file:
+            text = file.read()
+        return (text * (size // len(text) + 1))[:size]
+    return np.random.default_rng(seed).bytes(size)
+
+
+def bit_error_rate(expected, actual):
+    """
+    Fraction of payload bits that were decoded wrong.
+
+    Bytes missing from, or added to, the end of the decoded payload count as
+    8 wrong bits each.
+
+    Parameters:
+    expected (bytes): The payload that was encoded.
+    actual (bytes): The payload that was decoded.
+
+    Returns:
+    float: The bit error rate, 0 for an exact round trip.
+    """
+    length = min(len(expected), len(actual))
+    difference = np.bitwise_xor(
+        np.frombuffer(expected, dtype=np.uint8, count=length),
+        np.frombuffer(actual, dtype=np.uint8, count=length),
+    )
+    errors = int(np.unpackbits(difference).sum()) + 8 * abs(len(expected) - len(actual))
+    return errors / max(8 * len(expected), 1)
+
+
+def run_once(config):
+    """
+    Encode a synthetic payload into a video, decode it and measure both stages.
+
+    Runs in a scratch directory, with the output of the encoder and decoder
+    silenced. Meant to run in a fresh process, so the peak RSS belongs to this
+    run alone.
+
+    Parameters:
+    config (dict): payload_size, payload, block_size, palette, img_width,
+                   img_height, frame_rate and codec, plus optional workers and
+                   backend.
+
+    Returns:
+    dict: The config with the measurements added, including the seconds spent
+          in each encoder and decoder stage (see pix_code_metrics.Metrics).
+    """
+    payload = make_payload(config["payload_size"], config["payload"])
+    workdir = tempfile.mkdtemp(prefix="pix-code-benchmark-")
+    previous_dir = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            encoder = Encoder(
+                data=payload,
+                img_width=config["img_width"],
+                img_height=config["img_height"],
+            )
+            start = time.perf_counter()
+            video_path = encoder.generate_video(
+                output_folder="benchmark",
+                frame_rate=config["frame_rate"],
+                BLOCK_SIZE=config["block_size"],
+                PALETTE=config["palette"],
+                WORKERS=config.get("workers", 1),
+                FOURCC=config["codec"],
+                BACKEND=config.get("backend", BACKEND_OPENCV),
+            )
+            encode_seconds = time.perf_counter() - start
+
+            decoder = Decoder(video_path, backend=config.get("backend"))
+            start = time.perf_counter()
+            decoded = decoder.decode_bytes(
+                config["block_size"], workers=config.get("workers", 1)
+            )
+            decode_seconds = time.perf_counter() - start
+
+        with open_reader(video_path, config.get("backend")) as reader:
+            frames = reader.frame_count
+        video_bytes = os.path.getsize(video_path)
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    megabytes = len(payload) / 1e6
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = None
+    if resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            peak_rss *= 1024
+    return {
+        **config,
+        "frames": frames,
+        "video_bytes": video_bytes,
+        "bytes_per_frame": len(payload) / max(frames, 1),
+        "encode_seconds": encode_seconds,
+        "encode_mb_per_s": megabytes / encode_seconds,
+        "encode_frames_per_s": frames / encode_seconds,
+        "decode_seconds": decode_seconds,
+        "decode_mb_per_s": megabytes / decode_seconds,
+        "decode_frames_per_s": frames / decode_seconds,
+        "peak_rss_bytes": peak_rss,
+        "bit_error_rate": bit_error_rate(payload, decoded),
+        "exact": decoded == payload,
+        "encode_stages": encoder.metrics.summary()["stages"],
+        "decode_stages": decoder.metrics.summary()["stages"],
+    }
+
+
+def sweep(
+    payload_sizes,
+    block_sizes,
+    palettes,
+    resolutions,
+    frame_rates,
+    codecs,
+    payload="random",
+    workers=1,
+    backend=BACKEND_OPENCV,
+):
+    """
+    Every combination of the swept parameters.
+
+    Returns:
+    list: One config dict per run, see run_once.
+    """
+    return [
+        {
+            "payload_size": payload_size,
+            "payload": payload,
+            "block_size": block_size,
+            "palette": palette,
+            "img_width": width,
+            "img_height": height,
+            "frame_rate": frame_rate,
+            "codec": codec,
+            "workers": workers,
+            "backend": backend,
+        }
+        for payload_size, block_size, palette, (width, height), frame_rate, codec in (
+            itertools.product(
+                payload_sizes, block_sizes, palettes, resolutions, frame_rates, codecs
+            )
+        )
+    ]
+
+
+def run_benchmark(configs):
+    """
+    Run every config in its own process, one after the other.
+
+    Parameters:
+    configs (list): Config dicts from sweep.
+
+    Yields:
+    dict: The result of each run, see run_once. A run that fails yields its
+          config with an 'error' message instead of measurements.
+    """
+    for config in configs:
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=get_context("spawn")
+        ) as pool:
+            try:
+                yield pool.submit(run_once, config).result()
+            except Exception as e:
+                yield {**config, "error": f"{type(e).__name__}: {e}"}
+
+
+def run_key(run):
+    # The swept parameters, which identify the same run across result files
+    return tuple(
+        run.get(name)
+        for name in (
+            "payload_size",
+            "payload",
+            "block_size",
+            "palette",
+            "img_width",
+            "img_height",
+            "frame_rate",
+            "codec",
+            "workers",
+            "backend",
+        )
+    )
+
+
+def compare(baseline, runs, tolerance=0.1):
+    """
+    Find the runs that got slower than in a previous result file.
+
+    Parameters:
+    baseline (dict): A previous result file, as loaded from JSON.
+    runs (list): The new results.
+    tolerance (float, optional): Allowed relative drop in MB/s.
+
+    Returns:
+    list: A message for every stage of every run that slowed down by more than
+          the tolerance, or whose round trip stopped being exact.
+    """
+    previous = {run_key(run): run for run in baseline["runs"] if "error" not in run}
+    regressions = []
+    for run in runs:
+        old = previous.get(run_key(run))
+        if old is None or "error" in run:
+            continue
+        for stage in ("encode", "decode"):
+            before, after = old[f"{stage}_mb_per_s"], run[f"{stage}_mb_per_s"]
+            if after < before * (1 - tolerance):
+                regressions.append(
+                    f"{describe(run)}: {stage} {before:.2f} -> {after:.2f} MB/s"
+                )
+        if old["exact"] and not run["exact"]:
+            regressions.append(f"{describe(run)}: round trip is no longer exact")
+    return regressions
+
+
+def describe(run):
+    return (
+        f"{run['payload_size']}B {run['payload']} {run['img_width']}x{run['img_height']}"
+        + f" block {run['block_size']} {run['palette']} {run['frame_rate']}fps"
+        + f" {run['codec']} {run.get('backend', BACKEND_OPENCV)}"
+    )
+
+
+def _parse_list(value, convert=str):
+    return [convert(item) for item in value.split(",") if item]
+
+
+def _parse_resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the encode -> video -> decode round trip over a sweep"
+        + " of parameters and save the results as JSON."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=lambda v: _parse_list(v, int),
+        default=[1_000_000],
+        help="Payload sizes in bytes, comma separated (default: 1000000).",
+    )
+    parser.add_argument(
+        "--payload",
+        choices=("random", "text"),
+        default="random",
+        help="Random bytes or repeated sample text (default: random).",
+    )
+    parser.add_argument(
+        "--block-sizes",
+        type=lambda v: _parse_list(v, int),
+        default=[5],
+        help="Block sizes in pixels, comma separated (default: 5).",
+    )
+    parser.add_argument(
+        "--palettes",
+        type=_parse_list,
+        default=["rgb"],
+        help="Palettes (bw, grey, rgb, rgb16, rgb64), comma separated (default: rgb).",
+    )
+    parser.add_argument(
+        "--resolutions",
+        type=lambda v: _parse_list(v, _parse_resolution),
+        default=[(1920, 1080)],
+        help="Frame sizes as WIDTHxHEIGHT, comma separated (default: 1920x1080).",
+    )
+    parser.add_argument(
+        "--frame-rates",
+        type=lambda v: _parse_list(v, float),
+        default=[30.0],
+        help="Frame rates, comma separated (default: 30).",
+    )
+    parser.add_argument(
+        "--codecs",
+        type=_parse_list,
+        default=[None],
+        help="Video codecs, comma separated: fourccs such as mp4v,MJPG,FFV1,HFYU for"
+        + " OpenCV or encoders such as ffv1,libx264rgb for ffmpeg (default: the"
+        + " backend's default, mp4v or ffv1).",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=BACKEND_OPENCV,
+        help="Write the videos with OpenCV or a local ffmpeg (default: opencv).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes for encoding and decoding (default: 1).",
+    )
+    parser.add_argument(
+        "--output",
+        default="results/benchmark.json",
+        help="Where to write the results (default: results/benchmark.json).",
+    )
+    parser.add_argument(
+        "--compare",
+        metavar="BASELINE",
+        help="A previous result file. Exit with status 1 if a run got slower.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Allowed relative drop in MB/s when comparing (default: 0.1).",
+    )
+    args = parser.parse_args(argv)
+
+    configs = sweep(
+        args.sizes,
+        args.block_sizes,
+        args.palettes,
+        args.resolutions,
+        args.frame_rates,
+        args.codecs,
+        payload=args.payload,
+        workers=args.workers,
+        backend=args.backend,
+    )
+    runs = []
+    for index, run in enumerate(run_benchmark(configs), start=1):
+        runs.append(run)
+        if "error" in run:
+            print(f"[{index}/{len(configs)}] {describe(run)}: {run['error']}")
+            continue
+        print(
+            f"[{index}/{len(configs)}] {describe(run)}:"
+            + f" encode {run['encode_mb_per_s']:.2f} MB/s"
+            + f" ({run['encode_frames_per_s']:.1f} frames/s),"
+            + f" decode {run['decode_mb_per_s']:.2f} MB/s"
+            + f" ({run['decode_frames_per_s']:.1f} frames/s),"
+            + f" {run['frames']} frames, {run['video_bytes']} bytes,"
+            + f" peak RSS {(run['peak_rss_bytes'] or 0) / 1e6:.0f} MB,"
+            + f" BER {run['bit_error_rate']:.2e}"
+        )
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "cpu_count": os.cpu_count(),
+        "runs": runs,
+    }
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file), runs, args.tolerance)
+        for message in regressions:
+            print(f"Regression: {message}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
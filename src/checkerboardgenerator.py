@@ -1,27 +1,37 @@
 from PIL import Image
 import numpy as np
 
-# Dimensions of the final image
-width, height = 1920, 1080
 
-# Size of each square in the checkerboard pattern
-pix_size = 5
+def checkerboard(width, height, pix_size):
+    """
+    Create a black and white checkerboard pattern.
 
-# Create an empty array for the image data
-# numpy.zeros() creates an array filled with zeros (black squares)
-checkerboard = np.zeros((height, width), dtype=np.uint8)
+    Parameters:
+    width (int): Width of the pattern in pixels.
+    height (int): Height of the pattern in pixels.
+    pix_size (int): Size of each square in pixels. The top left square is white.
 
-# Fill the array to create the checkerboard pattern
-for y in range(0, height, pix_size):
-    for x in range(0, width, pix_size):
-        if (x // pix_size + y // pix_size) % 2 == 0:
-            checkerboard[y:y+pix_size, x:x+pix_size] = 255  # Fill with 255 (white squares)
+    Returns:
+    np.ndarray: A (height, width) uint8 array of 0s (black) and 255s (white).
+    """
+    y, x = np.indices((height, width))
+    return np.where((x // pix_size + y // pix_size) % 2 == 0, 255, 0).astype(np.uint8)
 
-# Create an image from the array
-image = Image.fromarray(checkerboard, 'L')  # 'L' mode for grayscale
 
-# Save the image to a PNG file
-image_path = f"assets/checkerboard_1920x1080_{pix_size}x{pix_size}.png"
-image.save(image_path)
+if __name__ == "__main__":
+    # Dimensions of the final image
+    width, height = 1920, 1080
 
-image_path
\ No newline at end of file
+    # Size of each square in the checkerboard pattern
+    pix_size = 5
+
+    checkerboard_image = checkerboard(width, height, pix_size)
+
+    # Create an image from the array
+    image = Image.fromarray(checkerboard_image, "L")  # 'L' mode for grayscale
+
+    # Save the image to a PNG file
+    image_path = f"assets/checkerboard_1920x1080_{pix_size}x{pix_size}.png"
+    image.save(image_path)
+
+    print(image_path)
@@ -1,139 +1,826 @@
+import argparse
+import contextlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pix_code_cache import DEFAULT_MAX_BYTES, FrameCache
 from pix_code_encoder import Encoder
 from pix_code_decoder import Decoder
-from video_pipeline import *
-from time import sleep
+from pix_code_metrics import Metrics
+from pix_code_shard import decode_sharded, encode_sharded, is_manifest
+from pix_code_stream import IDLE_TIMEOUT, decode_stream
+from pix_code_video import BACKEND_OPENCV, BACKENDS
 
 PRINT_LINE_WIDTH = 40
-print("Select Next Actions: ")
-print("1. Encode/Generate Video")
-print("2. Decode Video")
-print("3. Quit")
-print("-" * PRINT_LINE_WIDTH)
-encoded_text = input()
-
-match encoded_text:
-    case "1":
-        print("-" * PRINT_LINE_WIDTH)
-        print("Enter a text-file to encode: ")
-        filename = input()
-        encoder_instance = Encoder(f"assets/{filename}.txt")
-        print("-" * PRINT_LINE_WIDTH)
-        print("Enter frame rate & pixel size \nEx. 1,5")
-        print("-" * PRINT_LINE_WIDTH)
-        frame_rate, block_size = input().split(",")
-        encoder_instance.generate_video(
-            output_folder=filename,
-            frame_rate=int(frame_rate),
-            BLOCK_SIZE=int(block_size),
+
+# Files taken from the directories given to verify
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv")
+
+
+def encode_file(
+    input_path,
+    output_folder=None,
+    results_directory="results",
+    frame_rate=30,
+    block_size=5,
+    img_width=1920,
+    img_height=1080,
+    stats=False,
+    cache=None,
+    cache_size=DEFAULT_MAX_BYTES,
+    shards=None,
+    shard_bytes=None,
+    shard_workers=1,
+    **options,
+):
+    """
+    Encode a file into a video.
+
+    Parameters:
+    input_path (str): The file to encode. Any file can be encoded.
+    output_folder (str, optional): What the video will be named. Defaults to the
+                                   input file name without its extension.
+    results_directory (str, optional): Where the 'vids' folder is. Defaults to
+                                       'results'.
+    frame_rate (float, optional): Frames per second of the video. Defaults to 30.
+    block_size (int, optional): The nxn size of each block in pixels. Defaults to 5.
+    img_width (int, optional): Width of the frames. Defaults to 1920.
+    img_height (int, optional): Height of the frames. Defaults to 1080.
+    stats (bool, optional): Print the time spent in each stage at the end.
+    cache (str, optional): Directory of a FrameCache that skips files encoded
+                           before. Defaults to None (no cache). Pass
+                           CACHE_FRAMES=True to reuse unchanged frames as well.
+    cache_size (int, optional): Bytes the cached frames are kept under.
+    shards (int, optional): Split the file into this many videos and write a
+                            manifest of them, see pix_code_shard.encode_sharded.
+    shard_bytes (int, optional): Split the file into videos of at most this many
+                            bytes instead.
+    shard_workers (int, optional): Shards encoded at once. Defaults to 1.
+    **options: Further keyword arguments of Encoder.generate_video, such as
+               PALETTE, FEC, COMPRESSION, CALIBRATION, FOURCC or BACKEND.
+
+    Returns:
+    dict: The input, the path of the video (or manifest when sharded), the
+          payload size and the seconds it took.
+    """
+    if output_folder is None:
+        output_folder = os.path.splitext(os.path.basename(input_path))[0]
+    start = time.perf_counter()
+    cache = FrameCache(cache, cache_size) if cache else None
+    if shards or shard_bytes:
+        manifest = encode_sharded(
+            input_path,
+            output_folder,
+            results_directory,
+            frame_rate,
+            block_size,
+            img_width,
+            img_height,
+            shards=shards,
+            shard_bytes=shard_bytes,
+            workers=shard_workers,
+            stats=stats,
+            CACHE=cache,
+            **options,
         )
-        print("-" * PRINT_LINE_WIDTH)
-    case "2":
-        print("-" * PRINT_LINE_WIDTH)
-        print("Enter video title & pixel size: ")
-        print("Ex. bee,5")
-        print("-" * PRINT_LINE_WIDTH)
-        filename, block_size = input().split(",")
-        decoder = Decoder(video_filepath=f"results/vids/{filename}.mp4")
-        text = decoder.binary_to_text(int(block_size))
-        print("Output: ")
-        print(text)
-        quit()
-    case "3":
-        print("-" * PRINT_LINE_WIDTH)
-        print("Quitting...")
-        quit()
-    case _:
-        print("Invalid input")
-        quit()
-
-print("Would you like to upload the video to YouTube? (Y/N): ")
-upload = input()
-YOUTUBE = True
-
-match upload:
-    case "Y":
-        print("-" * PRINT_LINE_WIDTH)
-        print("Uploading video to YouTube...")
-        try:
-            youtube = get_authenticated_service()
-        except Exception as e:
-            # Handle any other exceptions
-            print("An error occurred:", e)
-            print(
-                "YouTube upload unsuccessful. Please add your credentials"
-                + " file into the pix-code directory, as outlined in the README"
+        return {
+            "input": input_path,
+            "video": manifest,
+            "bytes": os.path.getsize(input_path),
+            "seconds": time.perf_counter() - start,
+        }
+
+    encoder = Encoder(
+        input_path,
+        img_width=img_width,
+        img_height=img_height,
+        metrics=Metrics(verbose=stats),
+    )
+    video_path = encoder.generate_video(
+        output_folder=output_folder,
+        frame_rate=frame_rate,
+        BLOCK_SIZE=block_size,
+        RESULTS_DIRECTORY=results_directory,
+        CACHE=cache,
+        **options,
+    )
+    return {
+        "input": input_path,
+        "video": video_path,
+        "bytes": encoder.payload.size,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def decode_file(
+    video_path,
+    output_path=None,
+    pixel_size=None,
+    workers=1,
+    stats=False,
+    backend=None,
+    skip_duplicates=None,
+    follow=False,
+    raw_size=None,
+    idle_timeout=IDLE_TIMEOUT,
+):
+    """
+    Decode a video back into the bytes that were encoded.
+
+    Parameters:
+    video_path (str): The video to decode, or the manifest of a sharded encode,
+                      whose shards are decoded by workers processes at once.
+    output_path (str, optional): Where to write the bytes. Defaults to None,
+                                 returning them instead.
+    pixel_size (int, optional): The size of the block representing a pixel. Only
+                                needed for videos without a calibration frame.
+    workers (int, optional): Number of decoding processes. Defaults to 1.
+    stats (bool, optional): Print the time spent in each stage at the end.
+    backend (str, optional): Read with 'opencv' or 'ffmpeg'. Defaults to None,
+                             see pix_code_video.open_reader.
+    skip_duplicates (bool, optional): Skip frames repeating the previous one.
+                             Defaults to None, which only does so for videos
+                             with frame headers. See Decoder.unique_frames.
+    follow (bool, optional): Decode the video while it is still being written,
+                             such as during a download, until it has not grown
+                             for idle_timeout seconds. mp4 files with their
+                             index at the end are only decoded once complete.
+                             See pix_code_stream.
+    raw_size (tuple, optional): (width, height) of raw BGR frames. The video is
+                             then a stream of raw frames, decoded as they arrive,
+                             with '-' for standard input.
+    idle_timeout (float, optional): Seconds a followed video may stay the same
+                             size before it is taken to be complete.
+
+    Returns:
+    bytes or int: The decoded bytes, or the number of bytes written to output_path.
+    """
+    if follow or raw_size is not None:
+        decoder = Decoder(
+            video_path,
+            metrics=Metrics(verbose=stats),
+            skip_duplicates=skip_duplicates,
+        )
+        with contextlib.ExitStack() as stack:
+            source = video_path
+            if raw_size is not None:
+                source = (
+                    sys.stdin.buffer
+                    if video_path == "-"
+                    else stack.enter_context(open(video_path, "rb"))
+                )
+            result = decode_stream(
+                source, output_path, pixel_size, raw_size, idle_timeout, decoder
             )
-            YOUTUBE = False
+        print(f"First bytes after {result['first_byte_seconds'] or 0:.2f}s.")
+        return result["data"] if output_path is None else result["bytes"]
+
+    if is_manifest(video_path):
+        return decode_sharded(video_path, output_path, pixel_size, workers, backend)
+    decoder = Decoder(
+        video_path,
+        metrics=Metrics(verbose=stats),
+        backend=backend,
+        skip_duplicates=skip_duplicates,
+    )
+    if output_path is None:
+        return decoder.decode_bytes(pixel_size, workers=workers)
+    return decoder.decode_to_file(output_path, pixel_size, workers=workers)
+
+
+def verify_file(
+    video_path,
+    pixel_size=None,
+    workers=1,
+    stats=False,
+    backend=None,
+    skip_duplicates=None,
+):
+    """
+    Check the integrity of a video with frame headers.
+
+    Parameters:
+    video_path (str): The video to check.
+    pixel_size (int, optional): The size of the block representing a pixel.
+    workers (int, optional): Number of decoding processes. Defaults to 1.
+    stats (bool, optional): Print the time spent in each stage at the end.
+    backend (str, optional): Read with 'opencv' or 'ffmpeg'. See decode_file.
+    skip_duplicates (bool, optional): Skip frames repeating the previous one. See
+                             decode_file.
 
-        if YOUTUBE:
-            print(YOUTUBE)
-            file_path = f"results/vids/{filename}.mp4"
-            title = f"pix-code-color-{filename}"
-            description = "Testing for pix-code color video upload"
-            category_id = "22"
-            keywords = ["storage", "encryption"]
-            privacy_status = "unlisted"
-
-            upload_response = upload_video(
-                youtube,
-                file_path,
-                title,
-                description,
-                category_id,
-                keywords,
-                privacy_status,
+    Returns:
+    dict: The video, whether it passed, and the integrity report of the decoder.
+    """
+    decoder = Decoder(
+        video_path,
+        metrics=Metrics(verbose=stats),
+        backend=backend,
+        skip_duplicates=skip_duplicates,
+    )
+    ok = decoder.verify(pixel_size, workers=workers)
+    return {
+        "video": video_path,
+        "ok": ok,
+        "complete": decoder.complete,
+        "missing_frames": decoder.missing_frames,
+        "corrupt_frames": decoder.corrupt_frames,
+        "unreadable_frames": decoder.unreadable_frames,
+        "duplicate_frames": decoder.duplicate_frames,
+        "skipped_frames": decoder.skipped_frames,
+    }
+
+
+def expand_inputs(paths, recursive=False, extensions=None):
+    """
+    Turn a list of files and directories into a sorted list of files.
+
+    Parameters:
+    paths (list): Files, and directories whose files are all taken.
+    recursive (bool, optional): Also take the files of subdirectories.
+    extensions (tuple, optional): Only take the files of directories that end
+                                  with one of these, such as ('.mp4',).
+
+    Returns:
+    list: The file paths.
+
+    Raises:
+    FileNotFoundError: If a path does not exist.
+    """
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+        elif os.path.isdir(path):
+            if recursive:
+                found = [
+                    os.path.join(root, name)
+                    for root, _, names in os.walk(path)
+                    for name in names
+                ]
+            else:
+                found = [
+                    os.path.join(path, name)
+                    for name in os.listdir(path)
+                    if os.path.isfile(os.path.join(path, name))
+                ]
+            files.extend(
+                sorted(
+                    name
+                    for name in found
+                    if extensions is None or name.endswith(extensions)
+                )
             )
-            print("Uploaded video with ID:", upload_response["id"])
-    case "N":
-        YOUTUBE = False
-    case _:
-        print("Invalid input")
-        quit()
-
-if YOUTUBE:
+        else:
+            raise FileNotFoundError(f"No such file or directory: {path}")
+    return files
+
+
+def run_batch(function, jobs, workers=1, quiet=False):
+    """
+    Run a function over many inputs, spread across a process pool.
+
+    A job that fails does not stop the others.
+
+    Parameters:
+    function (callable): A module level function such as encode_file or
+                         verify_file.
+    jobs (list): The keyword arguments of each call.
+    workers (int, optional): Number of jobs run at once. Defaults to 1 (run in
+                             this process). None uses every core.
+    quiet (bool, optional): Silence what the jobs print.
+
+    Yields:
+    tuple: The keyword arguments of each job and its result, as the jobs finish.
+           The result of a job that failed is a dict with an 'error' message.
+    """
+    if workers == 1:
+        for job in jobs:
+            yield _run_job(function, job, quiet)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run_job, function, job, quiet) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _run_job(function, job, quiet):
+    try:
+        with contextlib.ExitStack() as stack:
+            if quiet:
+                devnull = stack.enter_context(open(os.devnull, "w"))
+                stack.enter_context(contextlib.redirect_stdout(devnull))
+            return job, function(**job)
+    except Exception as e:
+        return job, {"error": f"{type(e).__name__}: {e}"}
+
+
+def _parse_size(size, parser):
+    try:
+        width, height = (int(value) for value in size.lower().split("x"))
+    except ValueError:
+        parser.error(f"Expected WIDTHxHEIGHT, got {size!r}.")
+    return width, height
+
+
+def _encode_jobs(args, parser):
+    inputs = expand_inputs(args.inputs, args.recursive)
+    if args.name and len(inputs) > 1:
+        raise ValueError("--name can only be used with a single input file.")
+    names = [
+        args.name or os.path.splitext(os.path.basename(path))[0] for path in inputs
+    ]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(
+            "Several inputs would be written to the same video: "
+            + ", ".join(duplicates)
+        )
+    width, height = _parse_size(args.resolution, parser)
+    return [
+        {
+            "input_path": path,
+            "output_folder": name,
+            "results_directory": args.results,
+            "frame_rate": args.frame_rate,
+            "block_size": args.block_size,
+            "img_width": width,
+            "img_height": height,
+            "stats": args.stats,
+            "PALETTE": args.palette,
+            "HEADERS": not args.no_headers,
+            "FEC": args.fec,
+            "COMPRESSION": args.compression,
+            "COMPRESSION_LEVEL": args.compression_level,
+            "CALIBRATION": not args.no_calibration and not args.no_headers,
+            "FOURCC": args.codec,
+            "BACKEND": args.backend,
+            "WORKERS": args.workers,
+            "SAVE_PNGS": args.save_pngs,
+            "cache": args.cache,
+            "CACHE_FRAMES": args.cache_frames,
+            "cache_size": int(args.cache_size * 2**20),
+            "shards": args.shards,
+            "shard_bytes": args.shard_size and int(args.shard_size * 2**20),
+            "shard_workers": args.jobs or None,
+        }
+        for path, name in zip(inputs, names)
+    ]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Store files in videos of colored blocks, and get them back."
+        + " Run without arguments for the interactive menu."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    encode = commands.add_parser(
+        "encode",
+        help="Encode files into videos.",
+        description="Encode each input file into results/vids/<name>.mp4. With"
+        + " several inputs or a directory, the files are encoded by --jobs"
+        + " processes at once.",
+    )
+    encode.add_argument("inputs", nargs="+", help="Files, or directories of files.")
+    encode.add_argument(
+        "--recursive", action="store_true", help="Include files in subdirectories."
+    )
+    encode.add_argument(
+        "--name",
+        help="Name of the video (single input only). Defaults to the file name.",
+    )
+    encode.add_argument(
+        "--results",
+        default="results",
+        help="Folder the videos are saved under (default: results).",
+    )
+    encode.add_argument("--frame-rate", type=float, default=30.0)
+    encode.add_argument("--block-size", type=int, default=5)
+    encode.add_argument(
+        "--resolution", default="1920x1080", help="WIDTHxHEIGHT (default: 1920x1080)."
+    )
+    encode.add_argument(
+        "--palette",
+        default="rgb",
+        help="bw, grey, rgb, rgb16 or rgb64 (default: rgb).",
+    )
+    encode.add_argument(
+        "--fec", type=int, default=0, help="Reed-Solomon parity bytes per codeword."
+    )
+    encode.add_argument("--compression", choices=("zlib", "bz2", "lzma"))
+    encode.add_argument("--compression-level", type=int)
+    encode.add_argument(
+        "--codec",
+        help="Video codec: a fourcc for OpenCV such as mp4v (default), MJPG,"
+        + " FFV1 or HFYU, or an ffmpeg encoder such as ffv1 (default) or libx264rgb."
+        + " FFV1, HFYU and ffv1 are lossless.",
+    )
+    encode.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=BACKEND_OPENCV,
+        help="Write with OpenCV or pipe frames into a local ffmpeg (default: opencv).",
+    )
+    encode.add_argument(
+        "--no-headers",
+        action="store_true",
+        help="Use the original frame format without header bands (rgb palette only)."
+        + " Leaves out the calibration frame, which needs headers.",
+    )
+    encode.add_argument(
+        "--no-calibration",
+        action="store_true",
+        help="Leave out the calibration frame.",
+    )
+    encode.add_argument(
+        "--save-pngs", action="store_true", help="Also save every frame as a PNG."
+    )
+    encode.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes computing the frames of each file (default: 1). Writing the"
+        + " video takes most of the encode time and stays in one process, so this"
+        + " only pays off on a machine with cores to spare, mostly with --fec and"
+        + " small blocks. Use --jobs to encode several files at once instead.",
+    )
+    shards = encode.add_mutually_exclusive_group()
+    shards.add_argument(
+        "--shards",
+        type=int,
+        help="Split each file into this many videos, encoded by --jobs processes"
+        + " at once, and write <name>.manifest.json listing them.",
+    )
+    shards.add_argument(
+        "--shard-size",
+        type=float,
+        metavar="MB",
+        help="Split each file into videos of at most this many MiB instead.",
+    )
+    encode.add_argument(
+        "--cache",
+        metavar="DIR",
+        help="Skip files whose video is already up to date, recording encoded"
+        + " files in this directory.",
+    )
+    encode.add_argument(
+        "--cache-frames",
+        action="store_true",
+        help="Also keep the rendered frames in the --cache directory and reuse the"
+        + " unchanged ones. Writing the video takes most of the time and is not"
+        + " saved, so this only cuts a few percent off re-encoding a changed file.",
+    )
+    encode.add_argument(
+        "--cache-size",
+        type=float,
+        default=DEFAULT_MAX_BYTES / 2**20,
+        metavar="MB",
+        help="Size the cached frames are kept under, in MiB (default: %(default)g).",
+    )
+
+    decode = commands.add_parser("decode", help="Decode a video back into a file.")
+    decode.add_argument("video", help="The video, or the manifest of a sharded encode.")
+    decode.add_argument(
+        "-o", "--output", help="Where to write the bytes (default: standard output)."
+    )
+    decode.add_argument(
+        "--pixel-size",
+        type=int,
+        help="Block size, for videos without a calibration frame.",
+    )
+    decode.add_argument(
+        "--workers", type=int, default=1, help="Decoding processes (default: 1)."
+    )
+    decode.add_argument(
+        "--follow",
+        action="store_true",
+        help="Decode the video while it is still being written, such as during a"
+        + " download (needs ffmpeg). mkv files, such as those of the ffmpeg"
+        + " backend, are decoded as they grow. The mp4 files of OpenCV are only"
+        + " decoded once they are complete.",
+    )
+    decode.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=IDLE_TIMEOUT,
+        metavar="SECONDS",
+        help="With --follow, take the video to be complete once it has not grown"
+        + " for this long (default: %(default)g).",
+    )
+    decode.add_argument(
+        "--raw",
+        metavar="WIDTHxHEIGHT",
+        help="The video is a stream of raw BGR frames of this size ('-' for"
+        + " standard input), such as the output of"
+        + " 'ffmpeg -i video -f rawvideo -pix_fmt bgr24 -'.",
+    )
+
+    verify = commands.add_parser(
+        "verify",
+        help="Check the integrity of videos with frame headers.",
+        description="Exits with status 1 if any video is incomplete or damaged.",
+    )
+    verify.add_argument("videos", nargs="+", help="Videos, or directories of videos.")
+    verify.add_argument("--pixel-size", type=int)
+    verify.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Decoding processes per video (default: 1).",
+    )
+
+    for command in (decode, verify):
+        command.add_argument(
+            "--backend",
+            choices=BACKENDS,
+            help="Read with OpenCV or a local ffmpeg (default: OpenCV, falling back"
+            + " to ffmpeg for videos it cannot open).",
+        )
+        duplicates = command.add_mutually_exclusive_group()
+        duplicates.add_argument(
+            "--skip-duplicates",
+            action="store_const",
+            const=True,
+            dest="skip_duplicates",
+            help="Skip frames repeating the previous one even without frame headers"
+            + " (by default only videos with frame headers skip them).",
+        )
+        duplicates.add_argument(
+            "--keep-duplicates",
+            action="store_const",
+            const=False,
+            dest="skip_duplicates",
+            help="Decode every frame, even repeated ones.",
+        )
+
+    for command in (encode, decode, verify):
+        if command is not decode:
+            command.add_argument(
+                "-j",
+                "--jobs",
+                type=int,
+                default=1,
+                help="Files processed at once (default: 1, 0 for every core).",
+            )
+            command.add_argument(
+                "-q",
+                "--quiet",
+                action="store_true",
+                help="Only print one line per file.",
+            )
+        command.add_argument(
+            "--stats",
+            action="store_true",
+            help="Print the time spent in each stage.",
+        )
+    return parser
+
+
+def main(argv=None):
+    """
+    Run the command line interface.
+
+    Parameters:
+    argv (list, optional): The arguments. Defaults to sys.argv[1:]. Without any,
+                           the interactive menu is shown.
+
+    Returns:
+    int: The exit status, 0 on success.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        interactive()
+        return 0
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.command == "decode":
+        # Messages go to stderr, so the decoded bytes can be piped from stdout
+        output = sys.stdout.buffer
+        with contextlib.redirect_stdout(sys.stderr):
+            result = decode_file(
+                args.video,
+                args.output,
+                args.pixel_size,
+                args.workers,
+                args.stats,
+                args.backend,
+                args.skip_duplicates,
+                args.follow,
+                args.raw and _parse_size(args.raw, parser),
+                args.idle_timeout,
+            )
+            if args.output is not None:
+                print(f"Wrote {result} bytes to {args.output}")
+        if args.output is None:
+            output.write(result)
+            output.flush()
+        return 0
+
+    try:
+        if args.command == "encode":
+            jobs = _encode_jobs(args, parser)
+            function = encode_file
+        else:
+            jobs = [
+                {
+                    "video_path": path,
+                    "pixel_size": args.pixel_size,
+                    "workers": args.workers,
+                    "stats": args.stats,
+                    "backend": args.backend,
+                    "skip_duplicates": args.skip_duplicates,
+                }
+                for path in expand_inputs(args.videos, extensions=VIDEO_EXTENSIONS)
+            ]
+            function = verify_file
+    except (ValueError, FileNotFoundError) as e:
+        parser.error(str(e))
+
+    failures = 0
+    workers = args.jobs or None
+    if args.command == "encode" and (args.shards or args.shard_size):
+        # The processes encode the shards of one file at a time instead
+        workers = 1
+    batch = run_batch(function, jobs, workers, args.quiet)
+    for index, (job, result) in enumerate(batch, start=1):
+        name = job.get("input_path") or job["video_path"]
+        if "error" in result:
+            failures += 1
+            print(f"[{index}/{len(jobs)}] {name}: failed, {result['error']}")
+        elif args.command == "encode":
+            print(
+                f"[{index}/{len(jobs)}] {name} -> {result['video']}"
+                + f" ({result['bytes']} bytes in {result['seconds']:.1f}s)"
+            )
+        else:
+            failures += not result["ok"]
+            print(f"[{index}/{len(jobs)}] {name}: {'ok' if result['ok'] else 'FAILED'}")
+    return 1 if failures else 0
+
+
+def interactive():
+    """
+    The original menu: encode a text file from the assets folder or decode a
+    video from results/vids, then optionally upload it to YouTube.
+    """
+    print("Select Next Actions: ")
+    print("1. Encode/Generate Video")
+    print("2. Decode Video")
+    print("3. Quit")
     print("-" * PRINT_LINE_WIDTH)
-    print("Please provide a link to the video: ")
-    link = input()
-    print("Downloading video from YouTube...")
-    sleep(5)
-    download_video(f"{link}")
-
-print("-" * PRINT_LINE_WIDTH)
-print(
-    "Would you like to decode the video to text? (Y/N)"
-    + " (This may take a while if your file is long): "
-)
-decoding = input()
-
-match decoding:
-    case "Y":
-        print("-" * PRINT_LINE_WIDTH)
-        decoder = Decoder(video_filepath=f"results/vids/{filename}.mp4")
-        text = decoder.binary_to_text(int(block_size))
-        print("\n")
-        print("Output:\n", text)
-    case "N":
+    encoded_text = input()
+
+    match encoded_text:
+        case "1":
+            print("-" * PRINT_LINE_WIDTH)
+            print("Enter a text-file to encode: ")
+            filename = input()
+            encoder_instance = Encoder(f"assets/{filename}.txt")
+            print("-" * PRINT_LINE_WIDTH)
+            print("Enter frame rate & pixel size \nEx. 1,5")
+            print("-" * PRINT_LINE_WIDTH)
+            frame_rate, block_size = input().split(",")
+            encoder_instance.generate_video(
+                output_folder=filename,
+                frame_rate=int(frame_rate),
+                BLOCK_SIZE=int(block_size),
+                CALIBRATION=True,
+            )
+            print("-" * PRINT_LINE_WIDTH)
+        case "2":
+            print("-" * PRINT_LINE_WIDTH)
+            print("Enter video title & pixel size: ")
+            print("Ex. bee,5")
+            print(
+                "(The pixel size can be left out for videos with a calibration frame)"
+            )
+            print("-" * PRINT_LINE_WIDTH)
+            filename, *block_size = input().split(",")
+            decoder = Decoder(video_filepath=f"results/vids/{filename}.mp4")
+            text = decoder.binary_to_text(
+                int(block_size[0]) if block_size and block_size[0].strip() else None
+            )
+            print("Output: ")
+            print(text)
+            return
+        case "3":
+            print("-" * PRINT_LINE_WIDTH)
+            print("Quitting...")
+            return
+        case _:
+            print("Invalid input")
+            return
+
+    print("Would you like to upload the video to YouTube? (Y/N): ")
+    upload = input()
+    YOUTUBE = True
+
+    match upload:
+        case "Y":
+            print("-" * PRINT_LINE_WIDTH)
+            print("Uploading video to YouTube...")
+            try:
+                # Only needed here, so the rest works without the Google API libraries
+                from video_pipeline import get_credentials, upload_video
+
+                credentials = get_credentials()
+            except Exception as e:
+                # Handle any other exceptions
+                print("An error occurred:", e)
+                print(
+                    "YouTube upload unsuccessful. Please add your credentials"
+                    + " file into the pix-code directory, as outlined in the README"
+                )
+                YOUTUBE = False
+
+            if YOUTUBE:
+                print(YOUTUBE)
+                file_path = f"results/vids/{filename}.mp4"
+                title = f"pix-code-color-{filename}"
+                description = "Testing for pix-code color video upload"
+                category_id = "22"
+                keywords = ["storage", "encryption"]
+                privacy_status = "unlisted"
+
+                upload_response = upload_video(
+                    credentials,
+                    file_path,
+                    title,
+                    description,
+                    category_id,
+                    keywords,
+                    privacy_status,
+                    progress=lambda upload: print(f"{upload.progress:.0%} uploaded"),
+                )
+                print("Uploaded video with ID:", upload_response["id"])
+        case "N":
+            YOUTUBE = False
+        case _:
+            print("Invalid input")
+            return
+
+    if YOUTUBE:
         print("-" * PRINT_LINE_WIDTH)
-        print("Quitting...")
-        quit()
-    case _:
-        print("Invalid input")
-        quit()
+        print("Please provide a link to the video: ")
+        link = input()
 
-if encoded_text == "2":
     print("-" * PRINT_LINE_WIDTH)
-    print("Do you want to save this all to a text file? (Y/N)")
-    save_text = input()
-    match save_text:
+    print(
+        "Would you like to decode the video to text? (Y/N)"
+        + " (This may take a while if your file is long): "
+    )
+    decoding = input()
+
+    match decoding:
         case "Y":
-            print("What do you want the text file to be named?")
-            filename = input()
-            text_file = open(f"{filename}.txt", "w")
-            text_file.write(text)
-            text_file.close()
+            print("-" * PRINT_LINE_WIDTH)
+            if YOUTUBE:
+                from video_pipeline import fetch_and_decode
+
+                # Frames are decoded as they download
+                print("Downloading and decoding video from YouTube...")
+                result = fetch_and_decode(f"{link}", pixel_size=int(block_size))
+                text = result["data"].decode("utf-8", errors="replace")
+            else:
+                decoder = Decoder(video_filepath=f"results/vids/{filename}.mp4")
+                text = decoder.binary_to_text(int(block_size))
+            print("\n")
+            print("Output:\n", text)
         case "N":
+            if YOUTUBE:
+                from video_pipeline import download_video
+
+                print("Downloading video from YouTube...")
+                download_video(f"{link}")
+            print("-" * PRINT_LINE_WIDTH)
             print("Quitting...")
-            quit()
+            return
         case _:
             print("Invalid input")
-            quit()
+            return
+
+    if encoded_text == "2":
+        print("-" * PRINT_LINE_WIDTH)
+        print("Do you want to save this all to a text file? (Y/N)")
+        save_text = input()
+        match save_text:
+            case "Y":
+                print("What do you want the text file to be named?")
+                filename = input()
+                text_file = open(f"{filename}.txt", "w")
+                text_file.write(text)
+                text_file.close()
+            case "N":
+                print("Quitting...")
+                return
+            case _:
+                print("Invalid input")
+                return
+
+
+if __name__ == "__main__":
+    sys.exit(main())
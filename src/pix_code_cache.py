@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+# Where FrameCache keeps its files unless told otherwise
+DEFAULT_CACHE_DIRECTORY = "results/cache"
+
+# Size the frame entries are kept under, in bytes
+DEFAULT_MAX_BYTES = 2 << 30
+
+# Eviction removes the least recently used frames until the cache is this much
+# of its maximum size, so it does not run again on the next put
+EVICT_TO = 0.9
+
+
+def content_key(*parts):
+    """
+    Hash some content into a cache key.
+
+    Parameters:
+    *parts: Bytes-like objects, hashed as they are, or anything JSON can encode
+            (such as a dict of parameters), hashed by its sorted JSON text.
+
+    Returns:
+    str: The SHA-256 hex digest of the parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, (bytes, bytearray, memoryview, np.ndarray)):
+            part = json.dumps(part, sort_keys=True).encode()
+        digest.update(memoryview(part).cast("B"))
+        # Separate the parts so that moving bytes between them changes the key
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class FrameCache:
+    """
+    A content-addressed cache of rendered frames and encoded files on disk.
+
+    Frames are stored by a key hashing their payload bytes and every parameter
+    that changes how they look (see content_key), as the (num_blocks_y,
+    num_blocks_x, 3) array of block colors. That is all a frame holds, and far
+    smaller than its pixels. The frame entries are kept under max_bytes by
+    deleting the least recently used ones, going by their modification times,
+    which a hit refreshes.
+
+    Encoded files are recorded by a key hashing the whole payload and the encode
+    parameters, so a file encoded before with the same parameters can be
+    skipped while its video is still there.
+
+    Several processes can share a cache: every entry is written to a temporary
+    file and renamed into place.
+
+    Attributes:
+    directory (str): Where the cache keeps its files.
+    max_bytes (int): Size the frame entries are kept under.
+    hits (int): Frames found in the cache.
+    misses (int): Frames that were not.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None  # Bytes of the frame entries, counted on the first put
+
+    def _frame_path(self, key):
+        return os.path.join(self.directory, "frames", key[:2], f"{key}.npy")
+
+    def _output_path(self, key):
+        return os.path.join(self.directory, "outputs", f"{key}.json")
+
+    def get(self, key):
+        """
+        Look up a frame.
+
+        Parameters:
+        key (str): The frame's key, see content_key.
+
+        Returns:
+        np.ndarray: The block colors of the frame, or None if it is not cached.
+        """
+        path = self._frame_path(key)
+        try:
+            blocks = np.load(path)
+            os.utime(path)  # Mark it as recently used
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return blocks
+
+    def put(self, key, blocks):
+        """
+        Store a frame, evicting the least recently used frames if the cache grows
+        past max_bytes.
+
+        Parameters:
+        key (str): The frame's key, see content_key.
+        blocks (np.ndarray): The block colors of the frame.
+        """
+        path = self._frame_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            np.save(file, np.ascontiguousarray(blocks))
+        os.replace(temporary, path)
+
+        if self._size is None:
+            self._size = sum(size for _, _, size in self._frame_entries())
+        else:
+            self._size += os.path.getsize(path)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _frame_entries(self):
+        # (last used, path, size) of every frame entry
+        entries = []
+        for root, _, names in os.walk(os.path.join(self.directory, "frames")):
+            for name in names:
+                if name.endswith(".npy"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:  # Evicted by another process
+                        continue
+                    entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def evict(self, max_bytes=None):
+        """
+        Delete the least recently used frames until the frame entries take up
+        EVICT_TO of max_bytes.
+
+        Parameters:
+        max_bytes (int, optional): Size to evict down from. Defaults to
+                                   self.max_bytes.
+
+        Returns:
+        int: The number of frames deleted.
+        """
+        target = (self.max_bytes if max_bytes is None else max_bytes) * EVICT_TO
+        entries = sorted(self._frame_entries())
+        size = sum(entry[2] for entry in entries)
+        deleted = 0
+        for _, path, entry_size in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+            deleted += 1
+        self._size = size
+        return deleted
+
+    def get_output(self, key):
+        """
+        Look up the video a payload was encoded into with the same parameters.
+
+        Parameters:
+        key (str): The key of the payload and parameters, see content_key.
+
+        Returns:
+        str: The path of the video, or None if there is none or the video has
+             changed since it was recorded.
+        """
+        try:
+            with open(self._output_path(key)) as file:
+                record = json.load(file)
+            stat = os.stat(record["video_path"])
+        except (OSError, ValueError, KeyError):
+            return None
+        if stat.st_size != record["size"] or stat.st_mtime != record["mtime"]:
+            return None
+        return record["video_path"]
+
+    def put_output(self, key, video_path):
+        """
+        Record the video a payload was encoded into.
+
+        Parameters:
+        key (str): The key of the payload and parameters, see content_key.
+        video_path (str): The video.
+        """
+        path = self._output_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        stat = os.stat(video_path)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(
+                {
+                    "video_path": video_path,
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                },
+                file,
+            )
+        os.replace(temporary, path)
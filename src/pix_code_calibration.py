@@ -0,0 +1,278 @@
+import numpy as np
+from checkerboardgenerator import checkerboard
+from pix_code_palette import PALETTES, Palette
+
+# Layout of the calibration frame, in blocks: a checkerboard over the whole grid,
+# with a square swatch of every palette color drawn inside a checkerboard border
+CALIBRATION_BORDER = 2
+SWATCH_BLOCKS = 4
+MAX_SWATCHES = max(len(palette.colors) for palette in PALETTES.values())
+
+# Pixels in the bottom and top quarter of the gray levels along a line count as
+# black and white squares, as long as the line spans at least MIN_CONTRAST levels
+MIN_CONTRAST = 64
+
+# Fewest square edges along a line for it to be taken as a checkerboard
+MIN_EDGES = 8
+
+
+class Grid:
+    """
+    Where the blocks of a frame are, in pixels.
+
+    Block (row, column) covers the pixels from offset + index * pitch along each
+    axis. The pitch and offset are not whole numbers once a video has been scaled.
+
+    Attributes:
+    num_blocks_x (int): Number of blocks in each row.
+    num_blocks_y (int): Number of rows of blocks.
+    pitch_x, pitch_y (float): Width and height of a block in pixels.
+    offset_x, offset_y (float): Position of the top left corner of the first block.
+    """
+
+    def __init__(
+        self, num_blocks_x, num_blocks_y, pitch_x, pitch_y, offset_x=0.0, offset_y=0.0
+    ):
+        self.num_blocks_x = num_blocks_x
+        self.num_blocks_y = num_blocks_y
+        self.pitch_x = pitch_x
+        self.pitch_y = pitch_y
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+
+    @classmethod
+    def for_block_size(cls, frame_shape, block_size):
+        """
+        The grid the encoder draws for a frame size and block size.
+
+        Parameters:
+        frame_shape (tuple): The (height, width, ...) shape of the frame.
+        block_size (int): The nxn size of each block in pixels.
+
+        Returns:
+        Grid: Whole blocks from the top left corner of the frame.
+        """
+        return cls(
+            frame_shape[1] // block_size,
+            frame_shape[0] // block_size,
+            block_size,
+            block_size,
+        )
+
+    def _pixels(self, index, offset, pitch, size):
+        # The interior of each block, leaving out a quarter of a block on each side
+        # where neighboring colors bleed in after compression
+        count = max(1, int(pitch - 2 * (pitch // 4)))
+        start = np.floor(offset + index * pitch + (pitch - count) / 2 + 0.5)
+        pixels = start.astype(np.intp)[:, np.newaxis] + np.arange(count)
+        return np.clip(pixels, 0, size - 1)
+
+    def sample(self, frame, rows, columns):
+        """
+        Average the interior of some blocks.
+
+        Parameters:
+        frame (np.array): The frame to sample.
+        rows (np.ndarray): The row of each block.
+        columns (np.ndarray): The column of each block.
+
+        Returns:
+        np.ndarray: An (n, 3) int32 array of the mean color of each block.
+        """
+        ys = self._pixels(rows, self.offset_y, self.pitch_y, frame.shape[0])
+        xs = self._pixels(columns, self.offset_x, self.pitch_x, frame.shape[1])
+        pixels = frame[ys[:, :, np.newaxis], xs[:, np.newaxis, :]]
+        count = ys.shape[1] * xs.shape[1]
+        return (pixels.sum(axis=(1, 2), dtype=np.int32) + count // 2) // count
+
+    def sample_all(self, frame):
+        """
+        Average the interior of every block.
+
+        Parameters:
+        frame (np.array): The frame to sample.
+
+        Returns:
+        np.ndarray: A (num_blocks_y, num_blocks_x, 3) int32 array of mean colors.
+        """
+        ys = self._pixels(
+            np.arange(self.num_blocks_y), self.offset_y, self.pitch_y, frame.shape[0]
+        )
+        xs = self._pixels(
+            np.arange(self.num_blocks_x), self.offset_x, self.pitch_x, frame.shape[1]
+        )
+        pixels = frame[ys[:, :, np.newaxis, np.newaxis], xs[np.newaxis, np.newaxis]]
+        count = ys.shape[1] * xs.shape[1]
+        return (pixels.sum(axis=(1, 3), dtype=np.int32) + count // 2) // count
+
+
+class Calibration:
+    """
+    What the decoder learned from a calibration frame.
+
+    Attributes:
+    grid (Grid): Where the blocks are.
+    swatches (np.ndarray): A (n, 3) array of the received BGR color of each swatch.
+    black (np.ndarray): The received BGR color of the black squares.
+    white (np.ndarray): The received BGR color of the white squares.
+    """
+
+    def __init__(self, grid, swatches, black, white):
+        self.grid = grid
+        self.swatches = swatches
+        self.black = black
+        self.white = white
+        self._palettes = {}
+
+    def palette(self, palette_id):
+        """
+        The palette as it was received, with the measured swatch colors.
+
+        Parameters:
+        palette_id (int): Which palette of PALETTES the blocks use.
+
+        Returns:
+        Palette: The palette with its colors replaced by the received colors, or
+                 the palette itself if the frame had too few swatches.
+        """
+        if palette_id not in self._palettes:
+            palette = PALETTES[palette_id]
+            count = len(palette.colors)
+            if count <= len(self.swatches):
+                colors = np.clip(np.rint(self.swatches[:count, ::-1]), 0, 255)
+                palette = Palette(palette_id, palette.name, colors)
+            self._palettes[palette_id] = palette
+        return self._palettes[palette_id]
+
+    def __repr__(self):
+        grid = self.grid
+        return (
+            f"Calibration({grid.num_blocks_x}x{grid.num_blocks_y} blocks of"
+            + f" {grid.pitch_x:.2f}x{grid.pitch_y:.2f}px"
+            + f" at ({grid.offset_x:.2f}, {grid.offset_y:.2f}))"
+        )
+
+
+def _swatch_layout(num_blocks_x, num_blocks_y):
+    # Swatches per row and rows of swatches that fit inside the border
+    per_row = (num_blocks_x - 2 * CALIBRATION_BORDER) // SWATCH_BLOCKS
+    rows = (num_blocks_y - 2 * CALIBRATION_BORDER) // SWATCH_BLOCKS
+    return max(per_row, 0), max(rows, 0)
+
+
+def render_calibration(img_width, img_height, block_size, palette):
+    """
+    Draw the calibration frame for a frame size, block size and palette.
+
+    Parameters:
+    img_width (int): Width of the frame in pixels.
+    img_height (int): Height of the frame in pixels.
+    block_size (int): The nxn size of each block in pixels.
+    palette (Palette): The palette of the payload frames.
+
+    Returns:
+    np.ndarray: A (img_height, img_width, 3) uint8 array in RGB order.
+
+    Raises:
+    ValueError: If the frame is too small to hold a swatch of every color.
+    """
+    num_blocks_x = img_width // block_size
+    num_blocks_y = img_height // block_size
+    per_row, rows = _swatch_layout(num_blocks_x, num_blocks_y)
+    if per_row * rows < len(palette.colors):
+        raise ValueError(
+            f"A {img_width}x{img_height} frame with {block_size}px blocks is too"
+            + f" small for a calibration frame with {len(palette.colors)} colors."
+        )
+
+    blocks = np.repeat(checkerboard(num_blocks_x, num_blocks_y, 1)[..., None], 3, 2)
+    for symbol, color in enumerate(palette.colors):
+        top = CALIBRATION_BORDER + symbol // per_row * SWATCH_BLOCKS
+        left = CALIBRATION_BORDER + symbol % per_row * SWATCH_BLOCKS
+        blocks[top : top + SWATCH_BLOCKS, left : left + SWATCH_BLOCKS] = color
+
+    frame = np.full((img_height, img_width, 3), 127, dtype=np.uint8)
+    frame[: num_blocks_y * block_size, : num_blocks_x * block_size] = np.repeat(
+        np.repeat(blocks, block_size, axis=0), block_size, axis=1
+    )
+    return frame
+
+
+def _edges(line):
+    """
+    Find the boundaries between black and white squares along a line of pixels.
+
+    Returns:
+    np.ndarray: The position of each boundary in pixels.
+    """
+    low, high = np.percentile(line, (5, 95))
+    if high - low < MIN_CONTRAST:
+        return np.empty(0)
+    dark = line < low + (high - low) / 4
+    light = line > high - (high - low) / 4
+    positions = np.flatnonzero(dark | light)
+    classes = light[positions]
+    change = np.flatnonzero(classes[1:] != classes[:-1])
+    return (positions[change] + 1 + positions[change + 1]) / 2
+
+
+def _detect_axis(lines):
+    """
+    Measure the checkerboard along one axis.
+
+    Parameters:
+    lines (np.ndarray): Gray levels of lines of pixels across the top (or left)
+                        border of the frame.
+
+    Returns:
+    tuple: The pitch, the offset of the first block and the number of blocks, or
+           None if no line looks like a checkerboard.
+    """
+    edges = max((_edges(line) for line in lines), key=len)
+    if len(edges) < MIN_EDGES:
+        return None
+    pitch = (edges[-1] - edges[0]) / (len(edges) - 1)
+    if np.abs(np.diff(edges) - pitch).max() > max(1.5, pitch / 4):
+        return None
+    return pitch, edges[0] - pitch, len(edges) + 1
+
+
+def detect_calibration(frame):
+    """
+    Recognize a calibration frame and measure the grid and colors it shows.
+
+    The grid comes from the black and white squares of the border, the received
+    palette from the interior of the swatches.
+
+    Parameters:
+    frame (np.array): A BGR frame, as read by OpenCV.
+
+    Returns:
+    Calibration: The measurements, or None if the frame is not a calibration frame.
+    """
+    gray = frame.mean(axis=-1)
+    height, width = gray.shape
+    # Lines through the top and left quarters, where the border is
+    x_axis = _detect_axis(gray[: max(height // 4, 1)])
+    y_axis = _detect_axis(gray[:, : max(width // 4, 1)].T)
+    if x_axis is None or y_axis is None:
+        return None
+
+    pitch_x, offset_x, num_blocks_x = x_axis
+    pitch_y, offset_y, num_blocks_y = y_axis
+    grid = Grid(num_blocks_x, num_blocks_y, pitch_x, pitch_y, offset_x, offset_y)
+    blocks = grid.sample_all(frame)
+
+    # The top row of the border alternates white and black from the left
+    squares = blocks[0, : num_blocks_x - num_blocks_x % 2].reshape(-1, 2, 3)
+    white = squares[:, 0].mean(axis=0)
+    black = squares[:, 1].mean(axis=0)
+
+    per_row, rows = _swatch_layout(num_blocks_x, num_blocks_y)
+    area = blocks[
+        CALIBRATION_BORDER : CALIBRATION_BORDER + rows * SWATCH_BLOCKS,
+        CALIBRATION_BORDER : CALIBRATION_BORDER + per_row * SWATCH_BLOCKS,
+    ].reshape(rows, SWATCH_BLOCKS, per_row, SWATCH_BLOCKS, 3)
+    # Only the blocks in the middle of each swatch
+    swatches = area[:, 1:-1, :, 1:-1].mean(axis=(1, 3)).reshape(-1, 3)
+    return Calibration(grid, swatches[:MAX_SWATCHES], black, white)
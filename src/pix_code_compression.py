@@ -0,0 +1,100 @@
+import bz2
+import lzma
+import zlib
+
+# Ids stored in the frame header flags to say how the payload was compressed
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_BZ2 = 2
+COMPRESSION_LZMA = 3
+
+COMPRESSION_NAMES = {
+    COMPRESSION_NONE: None,
+    COMPRESSION_ZLIB: "zlib",
+    COMPRESSION_BZ2: "bz2",
+    COMPRESSION_LZMA: "lzma",
+}
+
+# Errors raised by the decompressors on damaged data
+DecompressionError = (zlib.error, lzma.LZMAError, OSError, EOFError)
+
+# Bytes of payload handed to the compressor at a time
+CHUNK_SIZE = 1 << 20
+
+
+def compression_id(compression):
+    """
+    Look up a compression method.
+
+    Parameters:
+    compression (int, str or None): A compression id, 'zlib', 'bz2', 'lzma' or None.
+
+    Returns:
+    int: The compression id.
+
+    Raises:
+    ValueError: If there is no such compression method.
+    """
+    for candidate, name in COMPRESSION_NAMES.items():
+        if compression is name or compression == candidate or compression == name:
+            return candidate
+    raise ValueError(
+        f"Unknown compression {compression!r}. Choose 'zlib', 'bz2', 'lzma' or None."
+    )
+
+
+def compressor(compression, level=None):
+    """
+    Create a streaming compressor.
+
+    Parameters:
+    compression (int): A compression id other than COMPRESSION_NONE.
+    level (int, optional): The compression level (zlib 0-9, bz2 1-9, lzma preset
+                           0-9). Defaults to each library's default.
+
+    Returns:
+    object: A compressor with compress(data) and flush() methods.
+    """
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level)
+    if compression == COMPRESSION_BZ2:
+        return bz2.BZ2Compressor(9 if level is None else level)
+    return lzma.LZMACompressor(preset=level)
+
+
+def decompressor(compression):
+    """
+    Create a streaming decompressor.
+
+    Parameters:
+    compression (int): A compression id other than COMPRESSION_NONE.
+
+    Returns:
+    object: A decompressor with a decompress(data) method.
+    """
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompressobj()
+    if compression == COMPRESSION_BZ2:
+        return bz2.BZ2Decompressor()
+    return lzma.LZMADecompressor()
+
+
+def compress_chunks(chunks, compression, level=None):
+    """
+    Compress a stream of byte chunks.
+
+    Parameters:
+    chunks (iterable): The bytes to compress, as bytes-like pieces such as the
+                       CHUNK_SIZE pieces of Encoder.payload_chunks.
+    compression (int): A compression id other than COMPRESSION_NONE.
+    level (int, optional): The compression level.
+
+    Yields:
+    bytes: The compressed stream, in pieces of varying size.
+    """
+    stream = compressor(compression, level)
+    for chunk in chunks:
+        compressed = stream.compress(chunk)
+        if compressed:
+            yield compressed
+    yield stream.flush()
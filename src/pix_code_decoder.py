@@ -1,118 +1,1074 @@
-import cv2
+import itertools
+import math
+import os
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import pix_code_fec
+from pix_code_calibration import Grid, detect_calibration
+from pix_code_compression import DecompressionError, decompressor
+from pix_code_metrics import Metrics
+from pix_code_video import open_reader
+from pix_code_format import (
+    FrameHeader,
+    HEADER_BITS,
+    PALETTE_BITS,
+    frame_bytes,
+    header_rows,
+    index_path,
+    locate,
+    read_index,
+)
+from pix_code_palette import DEFAULT_LUT_BITS, PALETTES, PALETTE_RGB
+
+# Upper bound on the frames handed to one worker by the parallel decoder
+MAX_SEGMENT_FRAMES = 256
+
+# Gray that fills the blocks past the end of the data
+FILL_COLOR = (127, 127, 127)
+
+# Blocks sampled for a frame's fingerprint, besides the header band
+FINGERPRINT_BLOCKS = 1024
 
 
 class Decoder:
-    def __init__(self, video_filepath):
+    def __init__(
+        self,
+        video_filepath,
+        lut_bits=DEFAULT_LUT_BITS,
+        metrics=None,
+        backend=None,
+        skip_duplicates=None,
+    ):
         self.video_filepath = video_filepath
+        self.lut_bits = lut_bits  # Resolution of the palette lookup tables
+        # How frames are read, see pix_code_video.open_reader
+        self.backend = backend
+        # Skip repeated frames (see unique_frames): True always, False never, or
+        # None only for videos with frame headers
+        self.skip_duplicates = skip_duplicates
+        # Per-stage timers and counters, see pix_code_metrics.Metrics
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.calibration = None  # Set when the video starts with a calibration frame
         self.frames_converted = []
 
-    def process_video(self, pixel_size):
+        # Integrity report of the last decode of a video with frame headers
+        self.has_frame_headers = False
+        self.complete = False  # Whether the frame flagged as last was reached
+        self.duplicate_frames = 0
+        self.unreadable_frames = 0
+        self.missing_frames = []
+        # Sequence numbers that failed the CRC check, after FEC if it was used
+        self.corrupt_frames = []
+        self.skipped_frames = 0  # Repeated frames skipped before decoding
+        self._first_frame = 0  # Index of the first data frame, see has_headers
+
+        # Videos without headers are classified against the 3 bit RGB palette
+        # (BGR, as read by OpenCV) plus the gray fill, which reads as 000
+        rgb = PALETTES[PALETTE_RGB]
+        self.palette = np.vstack((rgb.colors[:, ::-1], FILL_COLOR)).astype(np.int32)
+        self.none_index = len(rgb.colors)
+        self.palette_bits = np.vstack(
+            (rgb.symbol_bits, np.zeros(rgb.bits_per_block, dtype=np.uint8))
+        )
+
+    def iter_video_frames(self, start_frame=0, num_frames=None, report=True):
         """
-        Process the video by extracting each frame and selectively converting pixel colors
-        to binary data based on their black or white status.
+        Read the video one frame at a time.
+
+        Only the current frame is held in memory. The decoding throughput is
+        printed once the video has been read.
+
+        Parameters:
+        start_frame (int, optional): Index of the first frame to read. Defaults to 0.
+        num_frames (int, optional): Maximum number of frames to read. Defaults to
+                                    None, reading until the end of the video.
+        report (bool, optional): Print the number of frames and frames/s at the end.
+
+        Yields:
+        np.ndarray: Each BGR frame of the video.
+
+        Raises:
+        ValueError: If the video file cannot be opened.
         """
         # Open the video file
-        cap = cv2.VideoCapture(self.video_filepath)
-        if not cap.isOpened():
-            raise ValueError("Error opening video file.")
+        reader = open_reader(self.video_filepath, self.backend)
+        if start_frame:
+            reader.seek(start_frame)
 
         frame_count = 0
+        start_time = time.perf_counter()
         try:
-            while True:
-                ret, frame = cap.read()
-                if not ret:
+            while num_frames is None or frame_count < num_frames:
+                with self.metrics.stage("read"):
+                    frame = reader.read()
+                if frame is None:
                     break
-                self.frames_converted.append(self.convert_to_color(frame, pixel_size))
+                if report:
+                    self.metrics.frame_done()
+                yield frame
                 frame_count += 1
         finally:
-            cap.release()
+            reader.close()
+            if report:
+                _report_throughput(frame_count, time.perf_counter() - start_time)
+
+    def iter_binary_frames(self, pixel_size):
+        """
+        Read the video one frame at a time and yield the bits of each frame.
+
+        With skip_duplicates set to True, frames repeating the previous one are
+        skipped, see unique_frames.
+
+        Parameters:
+        pixel_size (int): The size of the block representing a pixel.
+
+        Yields:
+        np.ndarray: The (num_blocks_y, num_blocks_x, 3) bit array of each frame.
+        """
+        frames = self.unique_frames(self.iter_video_frames(), pixel_size, False)
+        for frame in frames:
+            yield self.convert_to_color(frame, pixel_size)
+
+    def process_video(self, pixel_size):
+        """
+        Process the video by extracting each frame and selectively converting pixel colors
+        to binary data based on their black or white status.
+
+        Every converted frame is kept in self.frames_converted. Use iter_bytes or
+        decode_to_file to decode long videos with flat memory usage.
+        """
+        for binary_frame in self.iter_binary_frames(pixel_size):
+            self.frames_converted.append(binary_frame)
+
+    def iter_bytes(self, pixel_size=None, workers=1):
+        """
+        Decode the video into bytes, streaming one frame at a time.
+
+        Videos whose frames start with a header band are decoded using the
+        headers: each frame contributes exactly its payload length, duplicated
+        frames are skipped, missing frames and CRC failures are reported (see
+        the integrity attributes set in __init__), and reading stops at the
+        frame flagged as last. Compressed payloads are decompressed as each frame
+        arrives.
+
+        When the video starts with a calibration frame, the block grid and the
+        received palette colors are measured from it (see read_calibration) and
+        pixel_size is not needed.
+
+        Videos without headers are decoded in the original format. The bits of
+        each frame are packed with np.packbits, bits that do not fill a whole
+        byte are carried over into the next frame, and the gray blocks padding
+        out the last frame are dropped.
+
+        With more than one worker, the video is split into frame ranges that are
+        decoded by separate processes, each with its own capture, and the packed
+        bytes are stitched back together in order.
+
+        Frames repeating the previous one, as in a video re-encoded at a higher
+        frame rate, are recognized by a cheap fingerprint and skipped before
+        they are decoded (see unique_frames), and counted in
+        self.skipped_frames. Repeats of the calibration frame are always
+        skipped.
+
+        Stage times and counters are collected in self.metrics, whose finish
+        method runs once the video has been decoded (see pix_code_metrics.Metrics).
+
+        Parameters:
+        pixel_size (int, optional): The size of the block representing a pixel.
+                                Only needed without a calibration frame.
+        workers (int, optional): Number of decoding processes. Defaults to 1
+                                (decode in this process). None uses every core.
+
+        Yields:
+        bytes: The decoded bytes of each frame (or frame range).
+        """
+        self.metrics.start()
+        try:
+            for chunk in self._iter_bytes(pixel_size, workers):
+                self.metrics.count("bytes", len(chunk))
+                yield chunk
+        finally:
+            self.metrics.finish()
+
+    def _iter_bytes(self, pixel_size, workers):
+        if workers != 1:
+            self._reset_report()
+            self.calibration = None
+            yield from self._iter_bytes_parallel(pixel_size, workers or os.cpu_count())
+            return
+
+        video = self.iter_video_frames()
+        try:
+            yield from self.iter_frame_bytes(video, pixel_size)
+        finally:
+            video.close()
+
+    def iter_frame_bytes(self, frames, pixel_size=None):
+        """
+        Decode frames from any source into bytes, one frame at a time.
+
+        This is the single process decoder of iter_bytes, for frames that do not
+        come from self.video_filepath, such as a pipe of raw frames or a video
+        that is still being downloaded (see pix_code_stream). The integrity
+        report is reset first. Unlike iter_bytes, self.metrics is not started or
+        finished.
+
+        Parameters:
+        frames (iterable): The BGR frames of the video, in order.
+        pixel_size (int, optional): The size of the block representing a pixel.
+                                Only needed without a calibration frame.
+
+        Yields:
+        bytes: The decoded bytes of each frame.
+        """
+        self._reset_report()
+        self.calibration = None
+        frames = iter(frames)
+        first = self._first_data_frame(frames, pixel_size)
+        if first is None:
+            return
+        frames = itertools.chain([first], frames)
+
+        if self.read_header(first, pixel_size) is not None:
+            self.has_frame_headers = True
+            frames = self.unique_frames(frames, pixel_size, True)
+            records = (self.decode_frame(frame, pixel_size) for frame in frames)
+            yield from self._assemble(records)
+            return
+
+        frames = self.unique_frames(frames, pixel_size, False)
+
+        leftover = np.empty(0, dtype=np.uint8)
+        previous = None  # Held back one frame so the last one can be trimmed
+        for frame in frames:
+            if previous is not None:
+                with self.metrics.stage("pack"):
+                    bits = self.frame_bits(previous)
+                    chunk, leftover = _pack_bits(leftover, bits)
+                yield chunk
+            with self.metrics.stage("classify"):
+                previous = self.classify_frame(frame, pixel_size)
+            self.metrics.count("blocks", previous.size)
+        if previous is not None:
+            with self.metrics.stage("pack"):
+                last_bits = self.frame_bits(previous, last=True)
+                chunk, leftover = _pack_bits(leftover, last_bits)
+            yield chunk
+
+    def verify(self, pixel_size=None, workers=1):
+        """
+        Check the integrity of a video with frame headers in a single pass.
+
+        Parameters:
+        pixel_size (int, optional): The size of the block representing a pixel.
+        workers (int, optional): Number of decoding processes. See iter_bytes.
+
+        Returns:
+        bool: True if every frame was present, passed its CRC check and the last
+              frame was reached. False otherwise, including for videos without
+              frame headers.
+        """
+        for _ in self.iter_bytes(pixel_size, workers=workers):
+            pass
+        if not self.has_frame_headers:
+            print("The video has no frame headers to verify against.")
+            return False
+        return self.complete and not self.missing_frames and not self.corrupt_frames
+
+    def _reset_report(self):
+        self.has_frame_headers = False
+        self.complete = False
+        self.duplicate_frames = 0
+        self.unreadable_frames = 0
+        self.missing_frames = []
+        self.corrupt_frames = []
+        self.skipped_frames = 0
+
+    def frame_fingerprint(self, frame, pixel_size):
+        """
+        A cheap signature of the data a frame holds.
+
+        The blocks of the header band and FINGERPRINT_BLOCKS blocks spread over
+        the rest of the frame are sampled and matched to their closest 3 bit
+        RGB or gray color. Copies of a frame that went through lossy compression
+        again still match, while frames with headers always differ in their
+        sequence number and CRC.
 
-        print(
-            f"Processed {frame_count} frames. Binary data captured selectively for each pixel."
+        Parameters:
+        frame (np.array): The BGR frame.
+        pixel_size (int): The size of the block representing a pixel.
+
+        Returns:
+        bytes: The fingerprint. Equal fingerprints mean the same data frame.
+        """
+        with self.metrics.stage("fingerprint"):
+            grid = self.grid(frame, pixel_size)
+            num_blocks = grid.num_blocks_x * grid.num_blocks_y
+            blocks = np.union1d(
+                np.arange(min(HEADER_BITS, num_blocks)),
+                np.linspace(0, num_blocks - 1, FINGERPRINT_BLOCKS).astype(np.int64),
+            )
+            colors = grid.sample(
+                frame, blocks // grid.num_blocks_x, blocks % grid.num_blocks_x
+            )
+            return self.closest_colors(colors).astype(np.uint8).tobytes()
+
+    def unique_frames(self, frames, pixel_size, headers):
+        """
+        Skip frames with the same fingerprint as the frame before them.
+
+        In videos with frame headers, only repeated copies of a data frame share
+        a fingerprint, so they are skipped unless skip_duplicates is False.
+        Without headers, two consecutive frames can legitimately hold the same
+        data, so frames are only skipped when skip_duplicates is True.
+
+        Parameters:
+        frames (iterable): BGR frames.
+        pixel_size (int): The size of the block representing a pixel.
+        headers (bool): Whether the frames have headers.
+
+        Yields:
+        np.ndarray: The frames that differ from the frame before them.
+        """
+        if not self._skips(headers):
+            yield from frames
+            return
+        previous = None
+        for frame in frames:
+            fingerprint = self.frame_fingerprint(frame, pixel_size)
+            if fingerprint == previous:
+                self.skipped_frames += 1
+                self.metrics.count("skipped_frames")
+                continue
+            previous = fingerprint
+            yield frame
+
+    def _skips(self, headers):
+        # Whether unique_frames skips repeated frames
+        return self.skip_duplicates if self.skip_duplicates is not None else headers
+
+    def _segment_frames(self, pixel_size, start_frame, num_frames, headers):
+        # The frames of a segment with repeats skipped, including repeats of the
+        # frame before the segment, which the previous segment decoded
+        seed = start_frame > 0 and self._skips(headers)
+        if seed:
+            start_frame -= 1
+            num_frames = None if num_frames is None else num_frames + 1
+        frames = self.unique_frames(
+            self.iter_video_frames(start_frame, num_frames, report=False),
+            pixel_size,
+            headers,
+        )
+        if seed:
+            next(frames, None)
+        return frames
+
+    def _first_data_frame(self, frames, pixel_size):
+        # Read the calibration frame and any copies of it, returning the first
+        # frame after them (or None) and leaving its index in self._first_frame
+        first = next(frames, None)
+        self._first_frame = 0
+        if first is None or not self.read_calibration(first):
+            return first
+        calibration = self.frame_fingerprint(first, pixel_size)
+        while True:
+            first = next(frames, None)
+            self._first_frame += 1
+            if (
+                first is None
+                or self.frame_fingerprint(first, pixel_size) != calibration
+            ):
+                return first
+            self.skipped_frames += 1
+            self.metrics.count("skipped_frames")
+
+    def _assemble(self, records):
+        """
+        Put the payloads of frames with headers back together in sequence order.
+
+        Parameters:
+        records (iterable): (header, payload) pairs from decode_frame.
+
+        Yields:
+        bytes: The payload of each frame, decompressed if the headers say so,
+               skipping duplicates and stopping after the frame flagged as last
+               or a frame that cannot be decompressed.
+        """
+        expected = 0
+        stream = None  # Decompressor of a compressed payload
+        for header, payload in records:
+            if header is None:
+                print("Warning: skipped a frame whose header could not be read.")
+                self.unreadable_frames += 1
+                continue
+            if header.sequence < expected:
+                self.duplicate_frames += 1
+                continue
+            if header.sequence > expected:
+                print(
+                    f"Warning: frame {expected} is missing."
+                    if header.sequence == expected + 1
+                    else f"Warning: frames {expected} to {header.sequence - 1} are missing."
+                )
+                self.missing_frames.extend(range(expected, header.sequence))
+            if zlib.crc32(payload) != header.payload_crc:
+                print(
+                    f"Warning: frame {header.sequence} failed its CRC check"
+                    + (", FEC could not correct it." if header.fec_symbols else ".")
+                )
+                self.corrupt_frames.append(header.sequence)
+            expected = header.sequence + 1
+            if header.compression:
+                stream = stream or decompressor(header.compression)
+                try:
+                    with self.metrics.stage("decompress"):
+                        payload = stream.decompress(payload)
+                except DecompressionError as e:
+                    print(
+                        f"Warning: could not decompress frame {header.sequence}"
+                        + f" ({e}). Stopping."
+                    )
+                    return
+            yield payload
+            if header.last:
+                self.complete = True
+                return
+
+    def decode_segment(self, pixel_size, start_frame, num_frames=None):
+        """
+        Decode a range of frames without headers into packed bytes.
+
+        The last frame of the range is returned classified but not packed: only
+        the caller knows whether a later range holds any new frames, or whether
+        it is the last frame of the video, whose gray padding is dropped.
+
+        Parameters:
+        pixel_size (int): The size of the block representing a pixel.
+        start_frame (int): Index of the first frame to decode.
+        num_frames (int, optional): Number of frames to decode. Defaults to None,
+                                    decoding to the end of the video.
+
+        Returns:
+        tuple: The packed bytes of every frame but the last, a uint8 array of the
+               trailing bits that did not fill a whole byte, and the palette
+               indices of the last frame (see classify_frame), or None if the
+               range holds no frames.
+        """
+        leftover = np.empty(0, dtype=np.uint8)
+        chunks = []
+        previous = None
+        for frame in self._segment_frames(pixel_size, start_frame, num_frames, False):
+            if previous is not None:
+                chunk, leftover = _pack_bits(leftover, self.frame_bits(previous))
+                chunks.append(chunk)
+            previous = self.classify_frame(frame, pixel_size)
+        return b"".join(chunks), leftover, previous
+
+    def decode_frames(self, pixel_size, start_frame, num_frames=None):
+        """
+        Decode a range of frames with headers.
+
+        Decoding stops early after the frame flagged as last.
+
+        Parameters:
+        pixel_size (int): The size of the block representing a pixel.
+        start_frame (int): Index of the first frame to decode.
+        num_frames (int, optional): Number of frames to decode. Defaults to None,
+                                    decoding to the end of the video.
+
+        Returns:
+        list: The (header, payload) pair of each frame, see decode_frame.
+        """
+        records = []
+        for frame in self._segment_frames(pixel_size, start_frame, num_frames, True):
+            records.append(self.decode_frame(frame, pixel_size))
+            if records[-1][0] is not None and records[-1][0].last:
+                break
+        return records
+
+    def _iter_segments(self, job, pixel_size, workers):
+        """
+        Run a decoding job over consecutive frame ranges in a process pool.
+
+        Yields:
+        tuple: The total frame count reported by the video once, then the
+               result of the job for each frame range, in order.
+        """
+        with open_reader(self.video_filepath, self.backend) as reader:
+            total_frames = reader.frame_count
+        yield total_frames
+
+        # The calibration frame was already read by has_headers
+        first_frame = self._first_frame
+        segment_frames = max(
+            1,
+            min(
+                MAX_SEGMENT_FRAMES,
+                math.ceil((total_frames - first_frame) / (4 * workers)),
+            ),
+        )
+        segment_starts = list(
+            range(first_frame, max(total_frames, first_frame + 1), segment_frames)
         )
 
+        pool = ProcessPoolExecutor(max_workers=workers)
+        try:
+            pending = deque()  # Futures in frame order
+            for index, start in enumerate(segment_starts):
+                if len(pending) >= 2 * workers:
+                    yield self._segment_result(pending.popleft())
+                # The last segment reads to the end, whatever the reported frame count
+                last = index == len(segment_starts) - 1
+                pending.append(
+                    pool.submit(
+                        job,
+                        self.video_filepath,
+                        self.lut_bits,
+                        self.backend,
+                        self.skip_duplicates,
+                        self.calibration,
+                        pixel_size,
+                        start,
+                        None if last else segment_frames,
+                    )
+                )
+            while pending:
+                yield self._segment_result(pending.popleft())
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+    def _segment_result(self, future):
+        # With a pool, 'workers' is the time spent waiting for the segments
+        with self.metrics.stage("workers"):
+            result, skipped = future.result()
+        self.skipped_frames += skipped
+        self.metrics.count("skipped_frames", skipped)
+        return result
+
+    def _iter_bytes_parallel(self, pixel_size, workers):
+        start_time = time.perf_counter()
+
+        if self.has_headers(pixel_size):
+            self.has_frame_headers = True
+            segments = self._iter_segments(_decode_frames_job, pixel_size, workers)
+            next(segments)
+            frame_count = 0
+
+            def records():
+                nonlocal frame_count
+                for segment in segments:
+                    frame_count += len(segment)
+                    self.metrics.frame_done(len(segment))
+                    yield from segment
+
+            try:
+                yield from self._assemble(records())
+            finally:
+                segments.close()
+                _report_throughput(frame_count, time.perf_counter() - start_time)
+            return
+
+        segments = self._iter_segments(_decode_segment_job, pixel_size, workers)
+        total_frames = next(segments)
+        leftover = np.empty(0, dtype=np.uint8)
+        held = None  # Last frame so far, packed once the next segment has frames
+        for chunk, segment_leftover, last_frame in segments:
+            if last_frame is None:
+                continue
+            if held is not None:
+                held_chunk, leftover = _pack_bits(leftover, self.frame_bits(held))
+                yield held_chunk
+            held = last_frame
+            if leftover.size:
+                # Realign a segment that does not start on a byte boundary
+                bits = np.concatenate(
+                    (
+                        np.unpackbits(np.frombuffer(chunk, dtype=np.uint8)),
+                        segment_leftover,
+                    )
+                )
+                chunk, leftover = _pack_bits(leftover, bits)
+            else:
+                leftover = segment_leftover
+            yield chunk
+        if held is not None:
+            chunk, leftover = _pack_bits(leftover, self.frame_bits(held, last=True))
+            yield chunk
+
+        self.metrics.frame_done(total_frames)
+        _report_throughput(total_frames, time.perf_counter() - start_time)
+
+    def decode_to_file(self, sink, pixel_size=None, workers=1):
+        """
+        Decode the video and write the bytes incrementally to a file.
+
+        Parameters:
+        sink (str or file-like): A path to write to, or a binary file-like object
+                                with a write method.
+        pixel_size (int, optional): The size of the block representing a pixel.
+        workers (int, optional): Number of decoding processes. See iter_bytes.
+
+        Returns:
+        int: The number of bytes written.
+        """
+        if isinstance(sink, str):
+            with open(sink, "wb") as file:
+                return self.decode_to_file(file, pixel_size, workers)
+
+        num_bytes = 0
+        for chunk in self.iter_bytes(pixel_size, workers=workers):
+            sink.write(chunk)
+            num_bytes += len(chunk)
+        return num_bytes
+
+    def frame_bits(self, closest_color, last=False):
+        """
+        Turn the classified blocks of a frame into a flat array of bits.
+
+        Parameters:
+        closest_color (np.ndarray): The palette indices from classify_frame.
+        last (bool, optional): Whether this is the last frame of the video, in
+                               which case the trailing gray padding is dropped.
+
+        Returns:
+        np.ndarray: A uint8 array of 0s and 1s.
+        """
+        closest_color = closest_color.reshape(-1)
+        if last:
+            used = np.flatnonzero(closest_color != self.none_index)
+            closest_color = closest_color[: used[-1] + 1 if used.size else 0]
+        return self.palette_bits[closest_color].reshape(-1)
+
+    def grid(self, frame, pixel_size):
+        """
+        Where the blocks of a frame are.
+
+        Parameters:
+        frame (np.array): The BGR frame.
+        pixel_size (int): The size of the block representing a pixel. Ignored when
+                          the video had a calibration frame.
+
+        Returns:
+        Grid: The grid measured from the calibration frame, or whole pixel_size
+              blocks from the top left corner of the frame.
+
+        Raises:
+        ValueError: If there was no calibration frame and no pixel_size.
+        """
+        if self.calibration is not None:
+            return self.calibration.grid
+        if not pixel_size:
+            raise ValueError("The video has no calibration frame, give a pixel size.")
+        return Grid.for_block_size(frame.shape, pixel_size)
+
+    def read_calibration(self, frame):
+        """
+        Measure the block grid and received palette from a calibration frame.
+
+        Parameters:
+        frame (np.array): The BGR frame to read.
+
+        Returns:
+        bool: Whether the frame was a calibration frame. If so, self.calibration
+              is set and used to decode the following frames.
+        """
+        with self.metrics.stage("calibrate"):
+            calibration = detect_calibration(frame)
+        if calibration is not None:
+            self.calibration = calibration
+        return calibration is not None
+
+    def block_colors(self, frame, pixel_size):
+        """
+        Average the interior of every block, vectorized over the whole frame.
+
+        Parameters:
+        frame (np.array): The BGR frame to sample.
+        pixel_size (int): The size of the block representing a pixel.
+
+        Returns:
+        np.ndarray: A (num_blocks_y, num_blocks_x, 3) int32 array of BGR colors.
+        """
+        return self.grid(frame, pixel_size).sample_all(frame)
+
+    def closest_colors(self, colors):
+        """
+        Find the closest palette color of each sampled block color.
+
+        Parameters:
+        colors (np.ndarray): An (..., 3) array of BGR colors.
+
+        Returns:
+        np.ndarray: An array of indices into self.palette, with the
+                    shape of colors minus its last axis.
+        """
+        # Squared distance to every palette color, then the closest one per block
+        distances = ((colors[..., np.newaxis, :] - self.palette) ** 2).sum(axis=-1)
+        return distances.argmin(axis=-1)
+
+    def classify_frame(self, frame, pixel_size):
+        """
+        Find the closest palette color of every block in a frame.
+
+        Parameters:
+        frame (np.array): The BGR frame to classify.
+        pixel_size (int): The size of the block representing a pixel.
+
+        Returns:
+        np.ndarray: A (num_blocks_y, num_blocks_x) array of indices into
+                    self.palette.
+        """
+        return self.closest_colors(self.block_colors(frame, pixel_size))
+
+    def read_header(self, frame, pixel_size):
+        """
+        Read the header band at the top of a frame.
+
+        Parameters:
+        frame (np.array): The BGR frame to read.
+        pixel_size (int): The size of the block representing a pixel.
+
+        Returns:
+        FrameHeader: The frame's header, or None if the frame has no valid header.
+        """
+        grid = self.grid(frame, pixel_size)
+        if grid.num_blocks_x * grid.num_blocks_y < HEADER_BITS:
+            return None
+        blocks = np.arange(HEADER_BITS)
+        colors = grid.sample(
+            frame, blocks // grid.num_blocks_x, blocks % grid.num_blocks_x
+        )
+        # Header blocks are black or white
+        threshold = 3 * 255 // 2
+        if self.calibration is not None:
+            threshold = (self.calibration.black + self.calibration.white).sum() / 2
+        bits = colors.sum(axis=-1) > threshold
+        return FrameHeader.unpack(np.packbits(bits).tobytes())
+
+    def has_headers(self, pixel_size):
+        """
+        Check whether the first frame of the video starts with a header band.
+
+        A calibration frame before it, and any copies of it, are read with
+        read_calibration.
+
+        Parameters:
+        pixel_size (int): The size of the block representing a pixel.
+
+        Returns:
+        bool: True if the video was encoded with frame headers.
+        """
+        frames = self.iter_video_frames(report=False)
+        first = self._first_data_frame(frames, pixel_size)
+        frames.close()
+        return first is not None and self.read_header(first, pixel_size) is not None
+
+    def decode_frame(self, frame, pixel_size):
+        """
+        Decode the payload of a frame with a header.
+
+        Only the blocks holding the payload length given by the header are
+        classified. With forward error correction, unclear blocks are passed to
+        the Reed-Solomon decoder as erasures.
+
+        Parameters:
+        frame (np.array): The BGR frame to decode.
+        pixel_size (int): The size of the block representing a pixel.
+
+        Returns:
+        tuple: The FrameHeader and the payload bytes, or (None, b"") if the frame
+               has no valid header.
+        """
+        with self.metrics.stage("header"):
+            header = self.read_header(frame, pixel_size)
+        if header is None:
+            return None, b""
+
+        if not header.fec_symbols:
+            payload = self.decode_blocks(
+                frame, pixel_size, header.palette_id, 0, header.payload_length
+            )
+            return header, payload
+
+        grid = self.grid(frame, pixel_size)
+        capacity = frame_bytes(
+            grid.num_blocks_x, grid.num_blocks_y, 1, header.palette_id
+        )
+        stored_length = pix_code_fec.coded_length(
+            header.payload_length, capacity, header.fec_symbols
+        )
+        stored, erasures = self.decode_blocks(
+            frame, pixel_size, header.palette_id, 0, stored_length, erasures=True
+        )
+        with self.metrics.stage("fec"):
+            payload, _ = pix_code_fec.decode_frame(
+                np.frombuffer(stored, dtype=np.uint8),
+                header.payload_length,
+                capacity,
+                header.fec_symbols,
+                erasures,
+            )
+        return header, payload
+
+    def classify_blocks(self, colors, palette_id):
+        """
+        Classify sampled block colors against the palette of a frame with a header.
+
+        Each color is looked up in the palette's precomputed lookup table (see
+        pix_code_palette.Palette.lookup_table) at self.lut_bits per channel. After
+        a calibration frame, the palette colors are the ones that were received.
+
+        Parameters:
+        colors (np.ndarray): An (n, 3) int32 array of BGR block colors.
+        palette_id (int): Which palette the blocks use.
+
+        Returns:
+        tuple: A flat uint8 array of the bits of every block, and a boolean array
+               marking the blocks whose color was unclear.
+        """
+        if self.calibration is not None:
+            palette = self.calibration.palette(palette_id)
+        else:
+            palette = PALETTES[palette_id]
+        symbols, unclear = palette.classify(colors, self.lut_bits)
+        return palette.symbol_bits[symbols].reshape(-1), unclear
+
+    def decode_blocks(self, frame, pixel_size, palette_id, start, end, erasures=False):
+        """
+        Decode a byte range of the payload stored in a frame with a header.
+
+        Only the blocks covering bytes start to end are sampled, by the mean of
+        their interior, and classified.
+
+        Parameters:
+        frame (np.array): The BGR frame to decode.
+        pixel_size (int): The size of the block representing a pixel.
+        palette_id (int): Which palette the payload blocks use.
+        start (int): Offset of the first byte within the frame's payload.
+        end (int): Offset one past the last byte within the frame's payload.
+        erasures (bool, optional): Also return which bytes came from unclear blocks.
+
+        Returns:
+        bytes: The decoded bytes, or a tuple of the bytes and a boolean array
+               marking the unclear bytes when erasures is True.
+        """
+        grid = self.grid(frame, pixel_size)
+        num_blocks_x = grid.num_blocks_x
+        first_block = header_rows(num_blocks_x) * num_blocks_x
+        bits_per_block = PALETTE_BITS[palette_id]
+        first_bit, end_bit = start * 8, end * 8
+        block_start = first_bit // bits_per_block
+        block_end = math.ceil(end_bit / bits_per_block)
+
+        # Sample just the blocks that are needed
+        with self.metrics.stage("classify"):
+            blocks = np.arange(first_block + block_start, first_block + block_end)
+            colors = grid.sample(frame, blocks // num_blocks_x, blocks % num_blocks_x)
+            bits, unclear = self.classify_blocks(colors, palette_id)
+        self.metrics.count("blocks", blocks.size)
+        skip = first_bit - block_start * bits_per_block
+        data = np.packbits(bits[skip : skip + end_bit - first_bit]).tobytes()
+        if not erasures:
+            return data
+
+        unclear_bits = np.repeat(unclear, bits_per_block)[
+            skip : skip + end_bit - first_bit
+        ]
+        return data, unclear_bits.reshape(-1, 8).any(axis=1)
+
+    def read_range(self, start, end, index_filepath=None):
+        """
+        Fetch payload bytes start to end without decoding the whole video.
+
+        The sidecar index written by the encoder tells which frames hold the
+        range. Only those frames are read, seeking directly to them, and only the
+        blocks covering the range are classified. With forward error correction
+        the codewords are interleaved across the whole frame, so each of those
+        frames is decoded in full. A compressed payload can only be decompressed
+        from its start, so the video is decoded from the first frame up to end.
+
+        Parameters:
+        start (int): Offset of the first byte to fetch.
+        end (int): Offset one past the last byte to fetch.
+        index_filepath (str, optional): The sidecar index of the video. Defaults to
+                                        the '.index.json' file next to the video.
+
+        Returns:
+        bytes: The requested bytes, cut short at the end of the payload.
+
+        Raises:
+        ValueError: If the video cannot be opened, or a frame does not have the
+                    header the index expects.
+        """
+        index = read_index(index_filepath or index_path(self.video_filepath))
+        pixel_size = index["block_size"]
+        calibration_frame = index.get("calibration_frame")
+        if index.get("compression"):
+            end = min(end, index["data_length"])
+            data = bytearray()
+            chunks = self.iter_bytes(pixel_size)
+            try:
+                for chunk in chunks:
+                    if len(data) >= end:
+                        break
+                    data += chunk
+            finally:
+                chunks.close()
+            return bytes(data[start:end])
+
+        end = min(end, index["payload_length"])
+        if start >= end:
+            return b""
+
+        sequence = locate(index, start)
+        reader = open_reader(self.video_filepath, self.backend)
+
+        chunks = []
+        position = start
+        next_frame = None  # Frame the capture will read next without seeking
+        try:
+            if calibration_frame is not None and self.calibration is None:
+                reader.seek(calibration_frame)
+                frame = reader.read()
+                if frame is not None:
+                    self.read_calibration(frame)
+                next_frame = calibration_frame + 1
+            while position < end:
+                frame_number, frame_offset, frame_length = index["frames"][sequence]
+                if frame_number != next_frame:
+                    reader.seek(frame_number)
+                frame = reader.read()
+                next_frame = frame_number + 1
+                header = None if frame is None else self.read_header(frame, pixel_size)
+                if header is None or header.sequence != sequence:
+                    raise ValueError(
+                        f"Frame {frame_number} does not hold payload frame {sequence}."
+                    )
+
+                frame_end = min(end, frame_offset + frame_length)
+                if header.fec_symbols:
+                    _, payload = self.decode_frame(frame, pixel_size)
+                    if zlib.crc32(payload) != header.payload_crc:
+                        print(
+                            f"Warning: frame {sequence} failed its CRC check,"
+                            + " FEC could not correct it."
+                        )
+                    chunks.append(
+                        payload[position - frame_offset : frame_end - frame_offset]
+                    )
+                else:
+                    chunks.append(
+                        self.decode_blocks(
+                            frame,
+                            pixel_size,
+                            header.palette_id,
+                            position - frame_offset,
+                            frame_end - frame_offset,
+                        )
+                    )
+                position = frame_end
+                sequence += 1
+        finally:
+            reader.close()
+        return b"".join(chunks)
+
     def convert_to_color(self, frame, pixel_size):
         """
         Convert a frame to a 3-bit representation where:
         - White: 111
         - Black: 000
-        - Red : 001
+        - Red : 100
         - Green : 010
-        - Blue : 100
+        - Blue : 001
         - Yellow : 110
-        - Cyan : 101
-        - Magenta : 011
+        - Cyan : 011
+        - Magenta : 101
 
         Parameters:
         frame (np.array): The frame to convert.
         pixel_size (int): The size of the block representing a pixel.
-        ignore_threshold (int): The threshold for ignoring colors that are too close to the 'none' color.
-
-        Returns:
-        binary_frame: A 3-bit array representing the processed pixel values.
-        """
-        num_blocks_y = frame.shape[0] // pixel_size
-        num_blocks_x = frame.shape[1] // pixel_size
-
-        binary_frame = np.full((num_blocks_y, num_blocks_x, 3), -1, dtype=int)
-        offset = pixel_size // 2
-
-        # Color thresholds
-        color_thresholds = {
-            "black": np.array([0, 0, 0]),
-            "white": np.array([255, 255, 255]),
-            "red": np.array([0, 0, 255]),
-            "green": np.array([0, 255, 0]),
-            "blue": np.array([255, 0, 0]),
-            "yellow": np.array([0, 255, 255]),
-            "cyan": np.array([255, 255, 0]),
-            "magenta": np.array([255, 0, 255]),
-            "none": np.array([127, 127, 127]),
-        }
-
-        # 3-bit representations
-        color_representations = {
-            "black": [0, 0, 0],
-            "white": [1, 1, 1],
-            "red": [1, 0, 0],
-            "green": [0, 1, 0],
-            "blue": [0, 0, 1],
-            "yellow": [1, 1, 0],
-            "cyan": [0, 1, 1],
-            "magenta": [1, 0, 1],
-        }
-        for idx1 in range(num_blocks_y):
-            for idx2 in range(num_blocks_x):
-                center_pixel = frame[idx1 * pixel_size + offset][
-                    idx2 * pixel_size + offset
-                ]
-                closest_color = min(
-                    color_thresholds,
-                    key=lambda x: np.linalg.norm(center_pixel - color_thresholds[x]),
-                )
-                if closest_color == "none":
-                    closest_color = "black"
-                binary_frame[idx1, idx2] = color_representations[closest_color]
-        return binary_frame
-
-    def binary_to_text(self, pixel_size):
-        """
-        Convert the stored binary data from all frames back into text.
-        Assumes each 8 bits (a row from the binary matrix) represents one ASCII character.
-        """
-        self.process_video(pixel_size)
-        text_output = ""
-        binary_chunk = ""
-        for frame in self.frames_converted:
-            for row in frame:
-                filtered_row = row.flatten()
-                binary_string = "".join(str(bit) for bit in filtered_row if bit != -1)
-                binary_chunk += binary_string
-
-        # Convert each 8 bits to an ASCII character
-        text_chars = [binary_chunk[i : i + 8] for i in range(0, len(binary_chunk), 8)]
-        for char in text_chars:
-            if len(char) == 8:
-                text_output += chr(int(char, 2))
-        return text_output
+
+        Returns:
+        binary_frame: A (num_blocks_y, num_blocks_x, 3) uint8 array of the bits of
+                      each block. Blocks closest to the 'none' gray read as black.
+        """
+        return self.palette_bits[self.classify_frame(frame, pixel_size)]
+
+    def decode_bytes(self, pixel_size=None, workers=1):
+        """
+        Decode the whole video back into the exact bytes that were encoded.
+
+        Parameters:
+        pixel_size (int, optional): The size of the block representing a pixel.
+        workers (int, optional): Number of decoding processes. See iter_bytes.
+
+        Returns:
+        bytes: The decoded payload.
+        """
+        return b"".join(self.iter_bytes(pixel_size, workers=workers))
+
+    def binary_to_text(self, pixel_size=None):
+        """
+        Convert the binary data of all frames back into text.
+        Assumes the payload is UTF-8 text; undecodable bytes are replaced.
+        """
+        return self.decode_bytes(pixel_size).decode("utf-8", errors="replace")
+
+
+def _pack_bits(leftover, bits):
+    """
+    Pack bits into bytes after the leftover bits of a previous call.
+
+    Returns:
+    tuple: The packed bytes, and the trailing bits that did not fill a byte.
+    """
+    bits = np.concatenate((leftover, bits))
+    usable = len(bits) - len(bits) % 8
+    return np.packbits(bits[:usable]).tobytes(), bits[usable:]
+
+
+def _report_throughput(frame_count, elapsed):
+    print(
+        f"Processed {frame_count} frames in {elapsed:.2f}s"
+        + f" ({frame_count / elapsed if elapsed else 0:.2f} frames/s)."
+        + " Binary data captured selectively for each pixel."
+    )
+
+
+def _decode_segment_job(
+    video_filepath,
+    lut_bits,
+    backend,
+    skip_duplicates,
+    calibration,
+    pixel_size,
+    start_frame,
+    num_frames,
+):
+    decoder = Decoder(
+        video_filepath, lut_bits, backend=backend, skip_duplicates=skip_duplicates
+    )
+    decoder.calibration = calibration
+    result = decoder.decode_segment(pixel_size, start_frame, num_frames)
+    return result, decoder.skipped_frames
+
+
+def _decode_frames_job(
+    video_filepath,
+    lut_bits,
+    backend,
+    skip_duplicates,
+    calibration,
+    pixel_size,
+    start_frame,
+    num_frames,
+):
+    decoder = Decoder(
+        video_filepath, lut_bits, backend=backend, skip_duplicates=skip_duplicates
+    )
+    decoder.calibration = calibration
+    result = decoder.decode_frames(pixel_size, start_frame, num_frames)
+    return result, decoder.skipped_frames
@@ -0,0 +1,463 @@
+import functools
+import math
+import numpy as np
+
+# Reed-Solomon forward error correction over GF(2^8), generator 2 and primitive
+# polynomial 0x11d. Encoding and error detection run on every codeword of a frame
+# at once; only codewords with errors go through the per-codeword corrector.
+# Both the parity and the syndromes are linear in the bytes of a codeword, so
+# they are computed as a GF(2^8) matrix product over the whole frame, with no
+# loop per byte: every (position, byte value) pair looks up its contribution,
+# packed into 64 bit words, and the contributions are XORed together.
+
+MAX_CODEWORD = 255  # Longest codeword (data + parity bytes) in GF(2^8)
+
+GF_EXP = np.zeros(512, dtype=np.int32)
+GF_LOG = np.zeros(256, dtype=np.int32)
+_x = 1
+for _i in range(255):
+    GF_EXP[_i] = _x
+    GF_LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11D
+GF_EXP[255:510] = GF_EXP[:255]
+del _x, _i
+
+# Full multiplication table, so vectorized products are a single lookup
+_log_sum = GF_LOG[:, np.newaxis] + GF_LOG[np.newaxis, :]
+GF_MUL = GF_EXP[_log_sum].astype(np.uint8)
+GF_MUL[0, :] = 0
+GF_MUL[:, 0] = 0
+del _log_sum
+
+# Plain lists for the scalar corrector, which is faster on Python ints
+_EXP = GF_EXP.tolist()
+_LOG = GF_LOG.tolist()
+
+
+class ReedSolomonError(Exception):
+    pass
+
+
+def frame_layout(capacity, fec_symbols):
+    """
+    Split the bytes of a frame into interleaved Reed-Solomon codewords.
+
+    Parameters:
+    capacity (int): Number of bytes the frame can hold.
+    fec_symbols (int): Number of parity bytes in each codeword.
+
+    Returns:
+    tuple: (num_codewords, codeword_length, data_length), where data_length is the
+           number of payload bytes carried by each codeword.
+
+    Raises:
+    ValueError: If a codeword would have no room for data.
+    """
+    num_codewords = math.ceil(capacity / MAX_CODEWORD)
+    codeword_length = capacity // num_codewords
+    data_length = codeword_length - fec_symbols
+    if data_length <= 0:
+        raise ValueError(
+            f"{fec_symbols} parity bytes leave no room for data in"
+            + f" {codeword_length} byte codewords."
+        )
+    return num_codewords, codeword_length, data_length
+
+
+def generator_poly(fec_symbols):
+    """
+    The generator polynomial with roots 2^0 ... 2^(fec_symbols - 1).
+
+    Returns:
+    np.ndarray: The coefficients, highest degree first.
+    """
+    generator = [1]
+    for i in range(fec_symbols):
+        root = _EXP[i]
+        product = generator + [0]
+        for j, coefficient in enumerate(generator):
+            product[j + 1] ^= _mul(coefficient, root)
+        generator = product
+    return np.array(generator, dtype=np.uint8)
+
+
+@functools.lru_cache(maxsize=None)
+def parity_matrix(data_length, fec_symbols):
+    """
+    The parity of every message with a single 1 byte.
+
+    Parity is linear in the message, so the parity of any message is the XOR of
+    the rows of this matrix scaled by its bytes (see encode).
+
+    Parameters:
+    data_length (int): Number of bytes in each message.
+    fec_symbols (int): Number of parity bytes.
+
+    Returns:
+    np.ndarray: A read-only (data_length, fec_symbols) uint8 array whose row j
+                is the parity of the message with a 1 at position j.
+    """
+    generator = generator_poly(fec_symbols)[1:]
+    remainder = np.zeros((data_length, fec_symbols), dtype=np.uint8)
+    # Polynomial division of the unit messages by the generator, one message
+    # column at a time
+    for column in range(data_length):
+        feedback = remainder[:, 0].copy()
+        feedback[column] ^= 1
+        remainder[:, :-1] = remainder[:, 1:]
+        remainder[:, -1] = 0
+        remainder ^= GF_MUL[feedback[:, np.newaxis], generator[np.newaxis, :]]
+    remainder.flags.writeable = False
+    return remainder
+
+
+@functools.lru_cache(maxsize=None)
+def syndrome_matrix(codeword_length, fec_symbols):
+    """
+    The powers of the generator roots that syndromes weight each byte by.
+
+    Parameters:
+    codeword_length (int): Number of bytes in each codeword.
+    fec_symbols (int): Number of parity bytes.
+
+    Returns:
+    np.ndarray: A read-only (codeword_length, fec_symbols) uint8 array holding
+                2^(i * (codeword_length - 1 - j)) at [j, i].
+    """
+    degrees = codeword_length - 1 - np.arange(codeword_length)
+    matrix = GF_EXP[(degrees[:, np.newaxis] * np.arange(fec_symbols)) % 255]
+    matrix = matrix.astype(np.uint8)
+    matrix.flags.writeable = False
+    return matrix
+
+
+@functools.lru_cache(maxsize=None)
+def _product_table(kind, length, fec_symbols):
+    # The rows of parity_matrix or syndrome_matrix multiplied by every byte
+    # value, packed into 64 bit words: row position * 256 + value holds the
+    # contribution of that value at that position
+    matrix = (parity_matrix if kind == "parity" else syndrome_matrix)(
+        length, fec_symbols
+    )
+    words = -(-fec_symbols // 8)
+    table = np.zeros((length, 256, words * 8), dtype=np.uint8)
+    table[:, :, :fec_symbols] = GF_MUL[
+        np.arange(256)[np.newaxis, :, np.newaxis], matrix[:, np.newaxis, :]
+    ]
+    table = table.view(np.uint64).reshape(length * 256, words)
+    table.flags.writeable = False
+    return table
+
+
+def _gf_matmul(rows, kind, fec_symbols):
+    # GF(2^8) product of a (n, length) uint8 array and a (length, fec_symbols)
+    # matrix, see _product_table
+    length = rows.shape[1]
+    table = _product_table(kind, length, fec_symbols)
+    index = rows.astype(np.intp) + 256 * np.arange(length)
+    words = np.bitwise_xor.reduce(np.take(table, index, axis=0), axis=1)
+    return words.view(np.uint8).reshape(rows.shape[0], -1)[:, :fec_symbols]
+
+
+def encode(data, fec_symbols):
+    """
+    Append Reed-Solomon parity to many messages at once.
+
+    Parameters:
+    data (np.ndarray): A (num_codewords, data_length) uint8 array of messages.
+    fec_symbols (int): Number of parity bytes to add to each message.
+
+    Returns:
+    np.ndarray: A (num_codewords, data_length + fec_symbols) uint8 array of
+                systematic codewords (the message followed by its parity).
+    """
+    parity = _gf_matmul(data, "parity", fec_symbols)
+    return np.concatenate((data, parity), axis=1)
+
+
+def syndromes(codewords, fec_symbols):
+    """
+    Evaluate many codewords at the roots of the generator polynomial.
+
+    Parameters:
+    codewords (np.ndarray): A (num_codewords, codeword_length) uint8 array.
+    fec_symbols (int): Number of parity bytes in each codeword.
+
+    Returns:
+    np.ndarray: A (num_codewords, fec_symbols) uint8 array, all zero for the
+                codewords without errors.
+    """
+    return _gf_matmul(codewords, "syndrome", fec_symbols)
+
+
+def encode_frame(data, capacity, fec_symbols):
+    """
+    Protect the payload bytes of one frame and interleave the codewords.
+
+    Byte j of codeword i is stored at position j * num_codewords + i, so a run
+    of damaged blocks is spread over many codewords instead of exhausting one.
+
+    Parameters:
+    data (bytes-like): The payload bytes of the frame, at most
+                       num_codewords * data_length bytes (see frame_layout).
+    capacity (int): Number of bytes the frame can hold.
+    fec_symbols (int): Number of parity bytes in each codeword.
+
+    Returns:
+    np.ndarray: The uint8 bytes to store in the frame.
+    """
+    _, codeword_length, data_length = frame_layout(capacity, fec_symbols)
+    data = np.frombuffer(data, dtype=np.uint8)
+    used_codewords = max(math.ceil(data.size / data_length), 1)
+    messages = np.zeros(used_codewords * data_length, dtype=np.uint8)
+    messages[: data.size] = data
+    codewords = encode(messages.reshape(used_codewords, data_length), fec_symbols)
+    return codewords.T.reshape(-1)
+
+
+def coded_length(payload_length, capacity, fec_symbols):
+    """
+    Number of stored bytes used by a frame holding payload_length bytes.
+
+    Returns:
+    int: The length of the output of encode_frame.
+    """
+    _, codeword_length, data_length = frame_layout(capacity, fec_symbols)
+    return max(math.ceil(payload_length / data_length), 1) * codeword_length
+
+
+def decode_frame(stored, payload_length, capacity, fec_symbols, erasures=None):
+    """
+    Undo encode_frame, correcting errors where possible.
+
+    Codewords that cannot be corrected are returned as received, so the frame
+    CRC reports them.
+
+    Parameters:
+    stored (np.ndarray): The uint8 bytes read from the frame, coded_length long.
+    payload_length (int): Number of payload bytes in the frame.
+    capacity (int): Number of bytes the frame can hold.
+    fec_symbols (int): Number of parity bytes in each codeword.
+    erasures (np.ndarray, optional): A boolean array marking the stored bytes
+                                     that were read with low confidence.
+
+    Returns:
+    tuple: The payload bytes, and the number of codewords that could not be
+           corrected.
+    """
+    _, codeword_length, data_length = frame_layout(capacity, fec_symbols)
+    used_codewords = max(math.ceil(payload_length / data_length), 1)
+    codewords = stored.reshape(codeword_length, used_codewords).T.copy()
+    if erasures is not None:
+        erasures = erasures.reshape(codeword_length, used_codewords).T
+
+    failed = 0
+    damaged = np.flatnonzero(syndromes(codewords, fec_symbols).any(axis=1))
+    for row in damaged:
+        erase_pos = [] if erasures is None else np.flatnonzero(erasures[row]).tolist()
+        try:
+            codewords[row] = correct(codewords[row].tolist(), fec_symbols, erase_pos)
+        except ReedSolomonError:
+            failed += 1
+
+    payload = codewords[:, :data_length].reshape(-1)[:payload_length]
+    return payload.tobytes(), failed
+
+
+def correct(codeword, fec_symbols, erase_pos=()):
+    """
+    Correct the errors and erasures of a single codeword.
+
+    Up to fec_symbols erasures, or half as many errors at unknown positions, can
+    be corrected (2 * errors + erasures <= fec_symbols). The codeword is first
+    corrected with every position treated as unknown, and only if that fails
+    with the erasures. Lossy codecs flag many more unclear blocks than they
+    damage, and with the erasures using up most of the parity a wrong codeword
+    can pass as corrected. Too many erasures are not used at all.
+
+    Parameters:
+    codeword (list): The received codeword as a list of ints.
+    fec_symbols (int): Number of parity bytes in the codeword.
+    erase_pos (sequence, optional): Positions known to be unreliable.
+
+    Returns:
+    list: The corrected codeword.
+
+    Raises:
+    ReedSolomonError: If the codeword cannot be corrected.
+    """
+    erase_pos = list(erase_pos)
+    try:
+        return _correct(codeword, fec_symbols, [])
+    except ReedSolomonError:
+        if not erase_pos or len(erase_pos) > fec_symbols:
+            raise
+    return _correct(codeword, fec_symbols, erase_pos)
+
+
+def _correct(codeword, fec_symbols, erase_pos):
+    message = list(codeword)
+    for position in erase_pos:
+        message[position] = 0
+
+    synd = _calc_syndromes(message, fec_symbols)
+    if max(synd) == 0:
+        return message
+    forney = _forney_syndromes(synd, erase_pos, len(message))
+    error_locator = _find_error_locator(forney, fec_symbols, len(erase_pos))
+    error_pos = _find_errors(error_locator[::-1], len(message))
+    message = _correct_errata(message, synd, erase_pos + error_pos)
+    if max(_calc_syndromes(message, fec_symbols)) > 0:
+        raise ReedSolomonError("Could not correct the codeword.")
+    return message
+
+
+def _mul(x, y):
+    if x == 0 or y == 0:
+        return 0
+    return _EXP[_LOG[x] + _LOG[y]]
+
+
+def _div(x, y):
+    if y == 0:
+        raise ZeroDivisionError()
+    if x == 0:
+        return 0
+    return _EXP[(_LOG[x] + 255 - _LOG[y]) % 255]
+
+
+def _pow(x, power):
+    return _EXP[(_LOG[x] * power) % 255]
+
+
+def _inverse(x):
+    return _EXP[255 - _LOG[x]]
+
+
+def _poly_scale(p, x):
+    return [_mul(coefficient, x) for coefficient in p]
+
+
+def _poly_add(p, q):
+    result = [0] * max(len(p), len(q))
+    for i, coefficient in enumerate(p):
+        result[i + len(result) - len(p)] = coefficient
+    for i, coefficient in enumerate(q):
+        result[i + len(result) - len(q)] ^= coefficient
+    return result
+
+
+def _poly_mul(p, q):
+    result = [0] * (len(p) + len(q) - 1)
+    for j, q_coefficient in enumerate(q):
+        for i, p_coefficient in enumerate(p):
+            result[i + j] ^= _mul(p_coefficient, q_coefficient)
+    return result
+
+
+def _poly_eval(poly, x):
+    y = poly[0]
+    for coefficient in poly[1:]:
+        y = _mul(y, x) ^ coefficient
+    return y
+
+
+def _poly_div(dividend, divisor):
+    result = list(dividend)
+    for i in range(len(dividend) - (len(divisor) - 1)):
+        coefficient = result[i]
+        if coefficient != 0:
+            for j in range(1, len(divisor)):
+                if divisor[j] != 0:
+                    result[i + j] ^= _mul(divisor[j], coefficient)
+    separator = -(len(divisor) - 1)
+    return result[:separator], result[separator:]
+
+
+def _calc_syndromes(message, fec_symbols):
+    # Padded with a leading 0 so syndrome i sits at index i + 1
+    return [0] + [_poly_eval(message, _pow(2, i)) for i in range(fec_symbols)]
+
+
+def _find_errata_locator(positions):
+    locator = [1]
+    for position in positions:
+        locator = _poly_mul(locator, _poly_add([1], [_pow(2, position), 0]))
+    return locator
+
+
+def _find_error_evaluator(synd, locator, fec_symbols):
+    _, remainder = _poly_div(_poly_mul(synd, locator), [1] + [0] * (fec_symbols + 1))
+    return remainder
+
+
+def _correct_errata(message, synd, positions):
+    # Forney algorithm
+    coefficient_pos = [len(message) - 1 - p for p in positions]
+    locator = _find_errata_locator(coefficient_pos)
+    evaluator = _find_error_evaluator(synd[::-1], locator, len(locator) - 1)[::-1]
+
+    roots = [_pow(2, -(255 - p)) for p in coefficient_pos]
+    magnitudes = [0] * len(message)
+    for i, root in enumerate(roots):
+        root_inverse = _inverse(root)
+        locator_prime = 1
+        for j, other in enumerate(roots):
+            if j != i:
+                locator_prime = _mul(locator_prime, 1 ^ _mul(root_inverse, other))
+        if locator_prime == 0:
+            raise ReedSolomonError("Could not find the error magnitude.")
+        y = _mul(root, _poly_eval(evaluator[::-1], root_inverse))
+        magnitudes[positions[i]] = _div(y, locator_prime)
+    return _poly_add(message, magnitudes)
+
+
+def _find_error_locator(synd, fec_symbols, erase_count=0):
+    # Berlekamp-Massey algorithm
+    locator = [1]
+    old_locator = [1]
+    synd_shift = len(synd) - fec_symbols if len(synd) > fec_symbols else 0
+    for i in range(fec_symbols - erase_count):
+        k = i + synd_shift
+        delta = synd[k]
+        for j in range(1, len(locator)):
+            delta ^= _mul(locator[-(j + 1)], synd[k - j])
+        old_locator = old_locator + [0]
+        if delta != 0:
+            if len(old_locator) > len(locator):
+                new_locator = _poly_scale(old_locator, delta)
+                old_locator = _poly_scale(locator, _inverse(delta))
+                locator = new_locator
+            locator = _poly_add(locator, _poly_scale(old_locator, delta))
+
+    while len(locator) and locator[0] == 0:
+        del locator[0]
+    # The syndromes are the Forney syndromes, so the locator only holds the
+    # errors at unknown positions
+    errors = len(locator) - 1
+    if errors * 2 + erase_count > fec_symbols:
+        raise ReedSolomonError("Too many errors to correct.")
+    return locator
+
+
+def _find_errors(locator, length):
+    # Chien search
+    errors = len(locator) - 1
+    positions = [
+        length - 1 - i for i in range(length) if _poly_eval(locator, _pow(2, i)) == 0
+    ]
+    if len(positions) != errors:
+        raise ReedSolomonError("Could not locate the errors.")
+    return positions
+
+
+def _forney_syndromes(synd, positions, length):
+    reversed_pos = [length - 1 - p for p in positions]
+    forney = list(synd[1:])
+    for position in reversed_pos:
+        x = _pow(2, position)
+        for j in range(len(forney) - 1):
+            forney[j] = _mul(forney[j], x) ^ forney[j + 1]
+    return forney
@@ -0,0 +1,373 @@
+import bisect
+import json
+import math
+import os
+import struct
+import zlib
+import pix_code_fec
+from pix_code_palette import PALETTES
+
+# Every frame starts with a header band: the first rows of blocks hold a fixed-size
+# header, one bit per block in black and white so it survives lossy compression
+# better than the payload colors.
+MAGIC = b"PX"
+VERSION = 1
+
+FLAG_LAST = 0x01  # No frames with payload follow this one
+# Bits 1 and 2 of the flags hold the compression id, see pix_code_compression
+COMPRESSION_SHIFT = 1
+COMPRESSION_MASK = 0x06
+
+# Bits per block of every palette id, see pix_code_palette
+PALETTE_BITS = {
+    palette_id: palette.bits_per_block for palette_id, palette in PALETTES.items()
+}
+
+# magic, version, flags, sequence, payload length, block size, palette id,
+# Reed-Solomon parity bytes per codeword (0 without FEC), payload CRC32
+_HEADER_STRUCT = struct.Struct(">2sBBIIHBBI")
+_HEADER_CRC_STRUCT = struct.Struct(">H")
+
+HEADER_SIZE = _HEADER_STRUCT.size + _HEADER_CRC_STRUCT.size
+HEADER_BITS = HEADER_SIZE * 8
+
+# Version of the sidecar index written next to each video
+INDEX_VERSION = 1
+
+
+class FrameHeader:
+    """
+    The self-describing header stored at the top of every frame.
+
+    Attributes:
+    sequence (int): Index of the frame within the payload, starting at 0.
+    payload_length (int): Number of payload bytes stored in the frame.
+    block_size (int): The nxn size of each block in pixels.
+    palette_id (int): Which palette of pix_code_palette.PALETTES the payload blocks use.
+    payload_crc (int): CRC32 of the payload bytes stored in the frame.
+    fec_symbols (int): Reed-Solomon parity bytes per codeword, 0 without FEC.
+    flags (int): Bit flags, such as FLAG_LAST, and the compression id.
+    version (int): The header format version.
+    """
+
+    def __init__(
+        self,
+        sequence,
+        payload_length,
+        block_size,
+        palette_id,
+        payload_crc,
+        fec_symbols=0,
+        flags=0,
+        version=VERSION,
+    ):
+        self.sequence = sequence
+        self.payload_length = payload_length
+        self.block_size = block_size
+        self.palette_id = palette_id
+        self.payload_crc = payload_crc
+        self.fec_symbols = fec_symbols
+        self.flags = flags
+        self.version = version
+
+    @classmethod
+    def for_payload(
+        cls,
+        sequence,
+        payload,
+        block_size,
+        palette_id,
+        fec_symbols=0,
+        compression=0,
+        last=False,
+    ):
+        """
+        Build the header describing one frame's payload bytes.
+
+        Parameters:
+        sequence (int): Index of the frame within the payload.
+        payload (bytes-like): The payload bytes stored in the frame.
+        block_size (int): The nxn size of each block in pixels.
+        palette_id (int): Which palette the payload blocks use.
+        fec_symbols (int, optional): Reed-Solomon parity bytes per codeword.
+        compression (int, optional): How the whole payload stream was compressed.
+        last (bool, optional): Whether this is the final frame.
+
+        Returns:
+        FrameHeader: The header for the frame.
+        """
+        return cls(
+            sequence,
+            len(payload),
+            block_size,
+            palette_id,
+            zlib.crc32(payload),
+            fec_symbols=fec_symbols,
+            flags=(FLAG_LAST if last else 0) | compression << COMPRESSION_SHIFT,
+        )
+
+    @property
+    def last(self):
+        return bool(self.flags & FLAG_LAST)
+
+    @property
+    def compression(self):
+        return (self.flags & COMPRESSION_MASK) >> COMPRESSION_SHIFT
+
+    def pack(self):
+        """
+        Serialize the header, followed by a 16-bit check of the header itself.
+
+        Returns:
+        bytes: HEADER_SIZE bytes.
+        """
+        data = _HEADER_STRUCT.pack(
+            MAGIC,
+            self.version,
+            self.flags,
+            self.sequence,
+            self.payload_length,
+            self.block_size,
+            self.palette_id,
+            self.fec_symbols,
+            self.payload_crc,
+        )
+        return data + _HEADER_CRC_STRUCT.pack(zlib.crc32(data) & 0xFFFF)
+
+    @classmethod
+    def unpack(cls, data):
+        """
+        Parse a header written by pack.
+
+        Parameters:
+        data (bytes-like): At least HEADER_SIZE bytes.
+
+        Returns:
+        FrameHeader: The parsed header, or None if the data is not a valid header
+                     (wrong magic, unknown version or failed header check).
+        """
+        data = bytes(data[:HEADER_SIZE])
+        if len(data) < HEADER_SIZE:
+            return None
+        fields = data[: _HEADER_STRUCT.size]
+        (check,) = _HEADER_CRC_STRUCT.unpack(data[_HEADER_STRUCT.size :])
+        if zlib.crc32(fields) & 0xFFFF != check:
+            return None
+        (
+            magic,
+            version,
+            flags,
+            sequence,
+            payload_length,
+            block_size,
+            palette_id,
+            fec_symbols,
+            payload_crc,
+        ) = _HEADER_STRUCT.unpack(fields)
+        if magic != MAGIC or version != VERSION or palette_id not in PALETTE_BITS:
+            return None
+        return cls(
+            sequence,
+            payload_length,
+            block_size,
+            palette_id,
+            payload_crc,
+            fec_symbols=fec_symbols,
+            flags=flags,
+            version=version,
+        )
+
+    def __repr__(self):
+        return (
+            f"FrameHeader(sequence={self.sequence}, payload_length={self.payload_length},"
+            + f" block_size={self.block_size}, palette_id={self.palette_id},"
+            + f" payload_crc={self.payload_crc:#010x}, fec_symbols={self.fec_symbols},"
+            + f" flags={self.flags})"
+        )
+
+
+def header_rows(img_bit_width):
+    """
+    Number of block rows taken by the header band.
+
+    Parameters:
+    img_bit_width (int): Number of blocks in each row of the frame.
+
+    Returns:
+    int: The height of the header band in blocks.
+    """
+    return math.ceil(HEADER_BITS / img_bit_width)
+
+
+def frame_bytes(img_width, img_height, block_size, palette_id):
+    """
+    Number of whole bytes the blocks of one frame can store after the header band.
+
+    Parameters:
+    img_width (int): Width of the frame in pixels.
+    img_height (int): Height of the frame in pixels.
+    block_size (int): The nxn size of each block in pixels.
+    palette_id (int): Which palette the payload blocks use.
+
+    Returns:
+    int: The number of bytes stored in a full frame.
+
+    Raises:
+    ValueError: If the frame is too small to hold the header and any payload.
+    """
+    img_bit_width = img_width // block_size
+    img_bit_height = img_height // block_size
+    payload_rows = img_bit_height - header_rows(max(img_bit_width, 1))
+    capacity = payload_rows * img_bit_width * PALETTE_BITS[palette_id] // 8
+    if img_bit_width == 0 or capacity <= 0:
+        raise ValueError(
+            f"A {img_width}x{img_height} frame with {block_size}px blocks"
+            + " is too small to hold a frame header and payload."
+        )
+    return capacity
+
+
+def frame_capacity(img_width, img_height, block_size, palette_id, fec_symbols=0):
+    """
+    Number of payload bytes that fit in one frame.
+
+    Parameters:
+    img_width (int): Width of the frame in pixels.
+    img_height (int): Height of the frame in pixels.
+    block_size (int): The nxn size of each block in pixels.
+    palette_id (int): Which palette the payload blocks use.
+    fec_symbols (int, optional): Reed-Solomon parity bytes per codeword.
+
+    Returns:
+    int: The payload capacity of a frame in bytes.
+
+    Raises:
+    ValueError: If the frame is too small to hold the header and any payload.
+    """
+    capacity = frame_bytes(img_width, img_height, block_size, palette_id)
+    if fec_symbols:
+        num_codewords, _, data_length = pix_code_fec.frame_layout(capacity, fec_symbols)
+        capacity = num_codewords * data_length
+    return capacity
+
+
+def index_path(video_path):
+    """
+    Path of the sidecar index belonging to a video.
+
+    Parameters:
+    video_path (str): Path of the video file.
+
+    Returns:
+    str: The video path with its extension replaced by '.index.json'.
+    """
+    return os.path.splitext(video_path)[0] + ".index.json"
+
+
+def build_index(
+    payload_length,
+    img_width,
+    img_height,
+    block_size,
+    palette_id,
+    fec_symbols=0,
+    first_frame=0,
+    compression=0,
+    data_length=None,
+    calibration_frame=None,
+):
+    """
+    Describe where every payload byte of a video is stored.
+
+    Each entry of 'frames' is [frame_number, payload_offset, payload_length]: the
+    frame of the video holding the bytes, the offset of its first byte in the
+    payload and the number of bytes it holds. Inside a frame, byte k starts at
+    bit 8 * k of the blocks following the header band.
+
+    Parameters:
+    payload_length (int): Total number of payload bytes.
+    img_width (int): Width of the frames in pixels.
+    img_height (int): Height of the frames in pixels.
+    block_size (int): The nxn size of each block in pixels.
+    palette_id (int): Which palette the payload blocks use.
+    fec_symbols (int, optional): Reed-Solomon parity bytes per codeword. With FEC
+                                 the bytes are interleaved across the frame, so
+                                 whole frames are decoded.
+    first_frame (int, optional): Frame number of the first payload frame.
+    compression (int, optional): How the payload stream was compressed. Offsets
+                                 and lengths then refer to the compressed stream.
+    data_length (int, optional): Length of the data before compression.
+    calibration_frame (int, optional): Frame number of the calibration frame.
+
+    Returns:
+    dict: The index, ready to be saved with write_index.
+    """
+    capacity = frame_capacity(
+        img_width, img_height, block_size, palette_id, fec_symbols
+    )
+    frames = [
+        [first_frame + sequence, start, min(capacity, payload_length - start)]
+        for sequence, start in enumerate(range(0, max(payload_length, 1), capacity))
+    ]
+    return {
+        "version": INDEX_VERSION,
+        "payload_length": payload_length,
+        "img_width": img_width,
+        "img_height": img_height,
+        "block_size": block_size,
+        "palette_id": palette_id,
+        "fec_symbols": fec_symbols,
+        "compression": compression,
+        "data_length": payload_length if data_length is None else data_length,
+        "calibration_frame": calibration_frame,
+        "frame_capacity": capacity,
+        "frames": frames,
+    }
+
+
+def write_index(path, index):
+    """
+    Save an index built by build_index as JSON.
+
+    Parameters:
+    path (str): Where to write the index.
+    index (dict): The index to save.
+    """
+    with open(path, "w") as file:
+        json.dump(index, file, separators=(",", ":"))
+
+
+def read_index(path):
+    """
+    Load an index saved by write_index.
+
+    Parameters:
+    path (str): The index file to read.
+
+    Returns:
+    dict: The index.
+
+    Raises:
+    FileNotFoundError: If the index does not exist.
+    ValueError: If the index was written by an unsupported version.
+    """
+    with open(path) as file:
+        index = json.load(file)
+    if index.get("version") != INDEX_VERSION:
+        raise ValueError(f"Unsupported index version: {index.get('version')}")
+    return index
+
+
+def locate(index, offset):
+    """
+    Find the frame holding a payload byte.
+
+    Parameters:
+    index (dict): The index of the video.
+    offset (int): Offset of the byte in the payload.
+
+    Returns:
+    int: Position of the frame in index['frames'], which is also its sequence number.
+    """
+    offsets = [entry[1] for entry in index["frames"]]
+    return max(bisect.bisect_right(offsets, offset) - 1, 0)
@@ -0,0 +1,177 @@
+import cProfile
+import contextlib
+import time
+
+
+class Metrics:
+    """
+    Per-stage timers and counters for an Encoder or Decoder.
+
+    Stages are timed with stage(), and counters (frames, blocks, bytes) are added
+    to with count(). Timers cost a couple of microseconds per call and are always
+    on. Profiling with cProfile is opt-in.
+
+    Attributes:
+    seconds (dict): Total seconds spent in each stage.
+    calls (dict): Number of times each stage ran.
+    counters (dict): Totals such as 'frames', 'blocks' and 'bytes'.
+    progress (callable): Called with this object after every frame, or None.
+    profile (str): Where start/finish dump cProfile stats, or None.
+    verbose (bool): Whether finish prints the summary.
+    """
+
+    def __init__(self, progress=None, profile=None, verbose=False):
+        self.progress = progress
+        self.profile = profile
+        self.verbose = verbose
+        self._profiler = None
+        self.reset()
+
+    def reset(self):
+        """
+        Clear every timer and counter.
+        """
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+        self.wall_seconds = 0.0
+        self._started = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Time the code run inside the with block as part of a stage.
+
+        Parameters:
+        name (str): The stage, such as 'read' or 'classify'.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + (
+                time.perf_counter() - start
+            )
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def timed(self, iterable, name):
+        """
+        Iterate while timing how long each item takes to produce.
+
+        Parameters:
+        iterable (iterable): The items.
+        name (str): The stage the time is added to.
+
+        Yields:
+        object: Each item of the iterable.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+
+    def count(self, name, amount=1):
+        """
+        Add to a counter.
+
+        Parameters:
+        name (str): The counter, such as 'blocks' or 'bytes'.
+        amount (int, optional): How much to add. Defaults to 1.
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def frame_done(self, count=1):
+        """
+        Count processed frames and call the progress hook.
+
+        Parameters:
+        count (int, optional): Number of frames. Defaults to 1.
+        """
+        self.count("frames", count)
+        if self.progress is not None:
+            self.progress(self)
+
+    def start(self):
+        """
+        Start the wall clock, and cProfile if a profile path was given.
+        """
+        self._started = time.perf_counter()
+        if self.profile and self._profiler is None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def finish(self):
+        """
+        Stop the wall clock and profiler, dump the profile, and print the summary
+        if verbose.
+
+        Returns:
+        dict: The summary, see summary.
+        """
+        if self._started is not None:
+            self.wall_seconds += time.perf_counter() - self._started
+            self._started = None
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.profile)
+            self._profiler = None
+        if self.verbose:
+            print(self.format_summary())
+        return self.summary()
+
+    def summary(self):
+        """
+        Collect the timers and counters.
+
+        Returns:
+        dict: 'wall_seconds', 'stages' (seconds, calls and share of the wall time
+              of each stage), 'counters', and 'frames_per_s' and 'bytes_per_s'
+              over the wall time.
+        """
+        wall = self.wall_seconds or sum(self.seconds.values())
+        return {
+            "wall_seconds": wall,
+            "stages": {
+                name: {
+                    "seconds": seconds,
+                    "calls": self.calls[name],
+                    "share": seconds / wall if wall else 0.0,
+                }
+                for name, seconds in self.seconds.items()
+            },
+            "counters": dict(self.counters),
+            "frames_per_s": self.counters.get("frames", 0) / wall if wall else 0.0,
+            "bytes_per_s": self.counters.get("bytes", 0) / wall if wall else 0.0,
+        }
+
+    def format_summary(self):
+        """
+        Format the summary as a small table.
+
+        Returns:
+        str: One line per stage, then the counters and throughput.
+        """
+        summary = self.summary()
+        lines = [f"{'Stage':<14}{'Seconds':>10}{'Calls':>9}{'Share':>8}"]
+        for name, stage in sorted(
+            summary["stages"].items(), key=lambda item: -item[1]["seconds"]
+        ):
+            lines.append(
+                f"{name:<14}{stage['seconds']:>10.3f}{stage['calls']:>9}"
+                + f"{stage['share']:>8.1%}"
+            )
+        lines.append(
+            ", ".join(f"{name}: {value}" for name, value in summary["counters"].items())
+        )
+        lines.append(
+            f"{summary['wall_seconds']:.2f}s, {summary['frames_per_s']:.2f} frames/s,"
+            + f" {summary['bytes_per_s'] / 1e6:.2f} MB/s"
+        )
+        return "\n".join(lines)
+
+
+# Marks the end of an iterator in Metrics.timed
+_DONE = object()
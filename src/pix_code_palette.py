@@ -0,0 +1,185 @@
+import itertools
+import numpy as np
+
+# Ids stored in the frame header to say which palette the payload blocks use
+PALETTE_BW = 0
+PALETTE_RGB = 1
+PALETTE_GREY = 2
+PALETTE_16 = 3
+PALETTE_64 = 4
+
+# Resolution of the color lookup tables, in bits per channel. 6 bits gives a
+# 64x64x64 table (256 KB) that is quick to build, 8 bits a full 256x256x256 one.
+DEFAULT_LUT_BITS = 6
+
+# A block is unclear, and its bytes are passed to the error correction as
+# erasures, when its second closest color is less than this many times as far
+# away as its closest color
+UNCLEAR_DISTANCE_RATIO = 2
+
+
+class Palette:
+    """
+    A set of block colors, each standing for a fixed number of bits.
+
+    Symbol s (the integer value of a block's bits, most significant bit first) is
+    drawn with colors[s]. The encoder and decoder both use the palettes in
+    PALETTES, so they always agree on the bit order.
+
+    Attributes:
+    palette_id (int): The id stored in frame headers.
+    name (str): A short name, usable wherever a palette is accepted.
+    bits_per_block (int): Number of bits stored in each block.
+    colors (np.ndarray): A (2 ** bits_per_block, 3) uint8 array of RGB colors.
+    symbol_bits (np.ndarray): A (2 ** bits_per_block, bits_per_block) uint8 array
+                              of the bits of each symbol.
+    """
+
+    def __init__(self, palette_id, name, colors):
+        self.palette_id = palette_id
+        self.name = name
+        self.colors = np.array(colors, dtype=np.uint8)
+        self.bits_per_block = len(self.colors).bit_length() - 1
+        if len(self.colors) != 1 << self.bits_per_block:
+            raise ValueError("A palette needs a power of two number of colors.")
+        symbols = np.arange(len(self.colors), dtype=np.uint8)[:, np.newaxis]
+        shifts = np.arange(self.bits_per_block - 1, -1, -1, dtype=np.uint8)
+        self.symbol_bits = (symbols >> shifts) & 1
+        self._lookup_tables = {}
+
+    @classmethod
+    def from_levels(cls, palette_id, name, red, green, blue):
+        """
+        Build a palette from the levels each channel can take.
+
+        The red bits come first in each symbol, then the green and blue bits.
+
+        Parameters:
+        palette_id (int): The id stored in frame headers.
+        name (str): A short name for the palette.
+        red, green, blue (sequence): The levels of each channel, each a power of
+                                     two long.
+
+        Returns:
+        Palette: Every combination of the levels.
+        """
+        return cls(palette_id, name, list(itertools.product(red, green, blue)))
+
+    def symbols(self, bits):
+        """
+        Group bits into the symbols of this palette.
+
+        Parameters:
+        bits (np.ndarray): A uint8 array of 0s and 1s. The last symbol is padded
+                           with 0s.
+
+        Returns:
+        np.ndarray: One symbol per block.
+        """
+        padding = -len(bits) % self.bits_per_block
+        bits = np.concatenate((bits, np.zeros(padding, dtype=np.uint8)))
+        weights = 1 << np.arange(self.bits_per_block - 1, -1, -1, dtype=np.int64)
+        return bits.reshape(-1, self.bits_per_block) @ weights
+
+    def lookup_table(self, lut_bits=DEFAULT_LUT_BITS):
+        """
+        Precompute the closest symbol of every color.
+
+        The RGB cube is divided into (2 ** lut_bits) ** 3 cells and each cell is
+        classified by the color at its center, so decoding a block is a single
+        table lookup whatever the palette size. Tables are built once per
+        resolution and kept.
+
+        Parameters:
+        lut_bits (int, optional): Bits per channel of the table, from 1 to 8.
+
+        Returns:
+        tuple: A uint8 array of symbols and a boolean array marking the cells whose
+               color is unclear (see UNCLEAR_DISTANCE_RATIO), both indexed by
+               [red >> shift, green >> shift, blue >> shift] with shift = 8 - lut_bits.
+        """
+        if lut_bits not in self._lookup_tables:
+            size = 1 << lut_bits
+            shift = 8 - lut_bits
+            centers = (np.arange(size) << shift) + ((1 << shift) >> 1)
+            # Squared distance along each channel from every cell to every color
+            channels = [
+                (centers[:, np.newaxis] - self.colors[:, channel].astype(np.int32)) ** 2
+                for channel in range(3)
+            ]
+            symbols = np.empty((size, size, size), dtype=np.uint8)
+            unclear = np.empty((size, size, size), dtype=bool)
+            for red in range(size):
+                distances = (
+                    channels[0][red]
+                    + channels[1][:, np.newaxis, :]
+                    + channels[2][np.newaxis, :, :]
+                )
+                symbols[red] = distances.argmin(axis=-1)
+                nearest = np.partition(distances, 1, axis=-1)
+                unclear[red] = (
+                    nearest[..., 1] < UNCLEAR_DISTANCE_RATIO**2 * nearest[..., 0]
+                )
+            self._lookup_tables[lut_bits] = symbols, unclear
+        return self._lookup_tables[lut_bits]
+
+    def classify(self, colors, lut_bits=DEFAULT_LUT_BITS):
+        """
+        Find the symbol of each sampled block color through the lookup table.
+
+        Parameters:
+        colors (np.ndarray): An (..., 3) array of BGR colors, as read by OpenCV.
+        lut_bits (int, optional): Bits per channel of the lookup table.
+
+        Returns:
+        tuple: The symbol of each color and whether it was unclear, each with the
+               shape of colors minus its last axis.
+        """
+        symbols, unclear = self.lookup_table(lut_bits)
+        cells = np.asarray(colors, dtype=np.uint8) >> (8 - lut_bits)
+        cell = (cells[..., 2], cells[..., 1], cells[..., 0])
+        return symbols[cell], unclear[cell]
+
+    def __repr__(self):
+        return f"Palette({self.name!r}, {self.bits_per_block} bits per block)"
+
+
+# Green gets the most levels in the 4 bit palette because video codecs keep
+# the most detail in luma, which green dominates
+PALETTES = {
+    palette.palette_id: palette
+    for palette in (
+        Palette(PALETTE_BW, "bw", [(0, 0, 0), (255, 255, 255)]),
+        Palette.from_levels(PALETTE_RGB, "rgb", (0, 255), (0, 255), (0, 255)),
+        Palette(PALETTE_GREY, "grey", [(v, v, v) for v in (0, 85, 170, 255)]),
+        Palette.from_levels(PALETTE_16, "rgb16", (0, 255), (0, 85, 170, 255), (0, 255)),
+        Palette.from_levels(
+            PALETTE_64, "rgb64", (0, 85, 170, 255), (0, 85, 170, 255), (0, 85, 170, 255)
+        ),
+    )
+}
+
+
+def get_palette(palette):
+    """
+    Look up a palette in PALETTES.
+
+    Parameters:
+    palette (int, str or Palette): A palette id, a palette name or a Palette.
+
+    Returns:
+    Palette: The palette.
+
+    Raises:
+    ValueError: If there is no such palette.
+    """
+    if isinstance(palette, Palette):
+        return palette
+    for candidate in PALETTES.values():
+        if palette == candidate.palette_id or palette == candidate.name:
+            return candidate
+    raise ValueError(
+        f"Unknown palette {palette!r}. Choose one of "
+        + ", ".join(candidate.name for candidate in PALETTES.values())
+        + "."
+    )
@@ -0,0 +1,380 @@
+import contextlib
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pix_code_decoder import Decoder
+from pix_code_encoder import Encoder
+from pix_code_metrics import Metrics
+from pix_code_palette import DEFAULT_LUT_BITS
+
+# A manifest lists the shards a payload was split into: the video of each shard,
+# the byte range of the payload it holds and the SHA-256 of those bytes. Every
+# shard is an ordinary, self-contained video with its own headers, calibration
+# frame and index, so shards can be encoded, uploaded and decoded on different
+# machines and put back together from the manifest alone.
+MANIFEST_VERSION = 1
+
+
+def manifest_path(output_folder, results_directory="results"):
+    """
+    Path of the manifest of a sharded encode.
+
+    Parameters:
+    output_folder (str): What the shards are named after.
+    results_directory (str, optional): Where the 'vids' folder is.
+
+    Returns:
+    str: '<results_directory>/vids/<output_folder>.manifest.json'.
+    """
+    return f"{results_directory}/vids/{output_folder}.manifest.json"
+
+
+def is_manifest(path):
+    """
+    Whether a path names a manifest rather than a video.
+    """
+    return path.endswith(".manifest.json")
+
+
+def plan_shards(data_length, shards=None, shard_bytes=None):
+    """
+    Split a payload into consecutive byte ranges of about the same size.
+
+    Parameters:
+    data_length (int): Size of the payload in bytes.
+    shards (int, optional): Number of shards.
+    shard_bytes (int, optional): Largest size of a shard in bytes, used instead of
+                                 shards. Keeps each video under a length limit.
+
+    Returns:
+    list: (start, end) of each shard. An empty payload still gets one shard.
+
+    Raises:
+    ValueError: If neither or both of shards and shard_bytes are given, or one
+                is not positive.
+    """
+    if (shards is None) == (shard_bytes is None):
+        raise ValueError("Give either a number of shards or a shard size.")
+    if shard_bytes is not None:
+        if shard_bytes < 1:
+            raise ValueError("The shard size must be positive.")
+        shards = max(math.ceil(data_length / shard_bytes), 1)
+    if shards < 1:
+        raise ValueError("The number of shards must be positive.")
+    shards = min(shards, max(data_length, 1))
+    bounds = [data_length * index // shards for index in range(shards + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def write_manifest(path, manifest):
+    """
+    Save a manifest as JSON.
+
+    The manifest is written next to its final path and renamed into place, so
+    readers never see a partial manifest.
+
+    Parameters:
+    path (str): Where to write the manifest.
+    manifest (dict): The manifest, see encode_sharded.
+    """
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(temporary, path)
+
+
+def read_manifest(path):
+    """
+    Load a manifest saved by write_manifest.
+
+    Parameters:
+    path (str): The manifest to read.
+
+    Returns:
+    dict: The manifest.
+
+    Raises:
+    FileNotFoundError: If the manifest does not exist.
+    ValueError: If the manifest was written by an unsupported version.
+    """
+    with open(path) as file:
+        manifest = json.load(file)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version: {manifest.get('version')}")
+    return manifest
+
+
+def encode_shard(
+    input_path,
+    start,
+    end,
+    output_folder,
+    results_directory="results",
+    frame_rate=30,
+    block_size=5,
+    img_width=1920,
+    img_height=1080,
+    stats=False,
+    **options,
+):
+    """
+    Encode bytes start to end of a file into a video of their own.
+
+    Parameters:
+    input_path (str): The file the shard is taken from.
+    start (int): Offset of the shard's first byte.
+    end (int): Offset one past its last byte.
+    output_folder (str): What the video will be named.
+    results_directory, frame_rate, block_size, img_width, img_height, stats:
+        See encode_sharded.
+    **options: Further keyword arguments of Encoder.generate_video.
+
+    Returns:
+    dict: The shard's entry in the manifest: its 'video' (a file name in the
+          manifest's folder), 'start', 'end' and 'sha256'.
+    """
+    encoder = Encoder(
+        input_path,
+        img_width=img_width,
+        img_height=img_height,
+        metrics=Metrics(verbose=stats),
+    )
+    encoder.select_range(start, end)
+    digest = hashlib.sha256()
+    for chunk in encoder.payload_chunks(encoder.payload.size):
+        digest.update(chunk)
+    video_path = encoder.generate_video(
+        output_folder=output_folder,
+        frame_rate=frame_rate,
+        BLOCK_SIZE=block_size,
+        RESULTS_DIRECTORY=results_directory,
+        **options,
+    )
+    return {
+        "video": os.path.basename(video_path),
+        "start": start,
+        "end": end,
+        "sha256": digest.hexdigest(),
+    }
+
+
+def encode_sharded(
+    input_path,
+    output_folder=None,
+    results_directory="results",
+    frame_rate=30,
+    block_size=5,
+    img_width=1920,
+    img_height=1080,
+    shards=None,
+    shard_bytes=None,
+    workers=1,
+    stats=False,
+    **options,
+):
+    """
+    Encode a file into several independent videos and a manifest.
+
+    The file is split into consecutive byte ranges (see plan_shards), and each
+    range is encoded into its own video, '<output_folder>_<shard>' in
+    '<results_directory>/vids', by a pool of processes. The manifest,
+    '<output_folder>.manifest.json' next to the videos, is written once every
+    shard is done.
+
+    Parameters:
+    input_path (str): The file to encode.
+    output_folder (str, optional): What the shards are named after. Defaults to
+                                   the input file name without its extension.
+    results_directory (str, optional): Where the 'vids' folder is. Defaults to
+                                       'results'.
+    frame_rate (float, optional): Frames per second of the videos. Defaults to 30.
+    block_size (int, optional): The nxn size of each block in pixels. Defaults to 5.
+    img_width (int, optional): Width of the frames. Defaults to 1920.
+    img_height (int, optional): Height of the frames. Defaults to 1080.
+    shards (int, optional): Number of shards.
+    shard_bytes (int, optional): Largest size of a shard in bytes, used instead of
+                                 shards.
+    workers (int, optional): Shards encoded at once, each in its own process.
+                             Defaults to 1 (encode in this process). None uses
+                             every core.
+    stats (bool, optional): Print the time spent in each stage of every shard.
+    **options: Further keyword arguments of Encoder.generate_video, such as
+               PALETTE, FEC, COMPRESSION, CALIBRATION, FOURCC or BACKEND.
+
+    Returns:
+    str: The path of the manifest.
+
+    Raises:
+    ValueError: If the shards are not specified correctly.
+    """
+    if output_folder is None:
+        output_folder = os.path.splitext(os.path.basename(input_path))[0]
+    data_length = os.path.getsize(input_path)
+    ranges = plan_shards(data_length, shards, shard_bytes)
+    digits = max(len(str(len(ranges) - 1)), 4)
+    jobs = [
+        dict(
+            input_path=input_path,
+            start=start,
+            end=end,
+            output_folder=f"{output_folder}_{index:0{digits}d}",
+            results_directory=results_directory,
+            frame_rate=frame_rate,
+            block_size=block_size,
+            img_width=img_width,
+            img_height=img_height,
+            stats=stats,
+            **options,
+        )
+        for index, (start, end) in enumerate(ranges)
+    ]
+
+    if workers == 1:
+        entries = [encode_shard(**job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(encode_shard, **job) for job in jobs]
+            entries = [future.result() for future in futures]
+
+    path = manifest_path(output_folder, results_directory)
+    write_manifest(
+        path,
+        {
+            "version": MANIFEST_VERSION,
+            "name": output_folder,
+            "data_length": data_length,
+            "shards": entries,
+        },
+    )
+    print(f"Wrote {len(entries)} shards of {output_folder} and {path}.")
+    return path
+
+
+def decode_shard(
+    video_path,
+    shard,
+    sink_path=None,
+    pixel_size=None,
+    backend=None,
+    lut_bits=DEFAULT_LUT_BITS,
+):
+    """
+    Decode one shard and check it against its manifest entry.
+
+    Parameters:
+    video_path (str): The shard's video.
+    shard (dict): The shard's entry in the manifest.
+    sink_path (str, optional): A file to write the bytes into at the shard's
+                               offset. Defaults to None, returning them instead.
+    pixel_size (int, optional): The size of the block representing a pixel. Only
+                                needed for videos without a calibration frame.
+    backend (str, optional): Read with 'opencv' or 'ffmpeg'. See
+                             pix_code_video.open_reader.
+    lut_bits (int, optional): Resolution of the palette lookup tables.
+
+    Returns:
+    bytes or int: The shard's bytes, or their number if they were written to
+                  sink_path.
+
+    Raises:
+    ValueError: If the decoded bytes do not have the shard's length and checksum.
+    """
+    decoder = Decoder(video_path, lut_bits, backend=backend)
+    digest = hashlib.sha256()
+    data = bytearray()
+    num_bytes = 0
+    with open(sink_path, "r+b") if sink_path else contextlib.nullcontext() as sink:
+        if sink_path:
+            sink.seek(shard["start"])
+        for chunk in decoder.iter_bytes(pixel_size):
+            digest.update(chunk)
+            num_bytes += len(chunk)
+            if sink_path:
+                sink.write(chunk)
+            else:
+                data += chunk
+    if num_bytes != shard["end"] - shard["start"]:
+        raise ValueError(
+            f"Shard {shard['video']} decoded to {num_bytes} bytes instead of"
+            + f" {shard['end'] - shard['start']}."
+        )
+    if digest.hexdigest() != shard["sha256"]:
+        raise ValueError(f"Shard {shard['video']} does not match its checksum.")
+    return num_bytes if sink_path else bytes(data)
+
+
+def decode_sharded(
+    manifest_filepath,
+    output_path=None,
+    pixel_size=None,
+    workers=1,
+    backend=None,
+    lut_bits=DEFAULT_LUT_BITS,
+):
+    """
+    Put a sharded payload back together from its manifest.
+
+    The shard videos are looked up in the manifest's folder. With an output
+    path, shards are decoded by a pool of processes, each writing its bytes
+    straight into the output file at the shard's offset.
+
+    Parameters:
+    manifest_filepath (str): The manifest written by encode_sharded.
+    output_path (str, optional): Where to write the bytes. Defaults to None,
+                                 returning them instead.
+    pixel_size (int, optional): The size of the block representing a pixel. Only
+                                needed for videos without a calibration frame.
+    workers (int, optional): Shards decoded at once when writing to output_path.
+                             Defaults to 1. None uses every core.
+    backend (str, optional): Read with 'opencv' or 'ffmpeg'. See
+                             pix_code_video.open_reader.
+    lut_bits (int, optional): Resolution of the palette lookup tables.
+
+    Returns:
+    bytes or int: The payload, or the number of bytes written to output_path.
+
+    Raises:
+    FileNotFoundError: If the manifest or a shard video is missing.
+    ValueError: If a shard does not decode to its length and checksum, or the
+                shards do not cover the payload.
+    """
+    manifest = read_manifest(manifest_filepath)
+    folder = os.path.dirname(manifest_filepath)
+    shards = sorted(manifest["shards"], key=lambda shard: shard["start"])
+    position = 0
+    for shard in shards:
+        if shard["start"] != position:
+            raise ValueError(f"The shards leave a gap at byte {position}.")
+        position = shard["end"]
+        if not os.path.exists(os.path.join(folder, shard["video"])):
+            raise FileNotFoundError(f"Missing shard video: {shard['video']}")
+    if position != manifest["data_length"]:
+        raise ValueError(
+            f"The shards end at byte {position} of {manifest['data_length']}."
+        )
+
+    jobs = [
+        (os.path.join(folder, shard["video"]), shard, output_path, pixel_size)
+        for shard in shards
+    ]
+    if output_path is None:
+        return b"".join(
+            decode_shard(*job, backend=backend, lut_bits=lut_bits) for job in jobs
+        )
+
+    with open(output_path, "wb") as file:
+        file.truncate(manifest["data_length"])
+    if workers == 1:
+        for job in jobs:
+            decode_shard(*job, backend=backend, lut_bits=lut_bits)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(decode_shard, *job, backend=backend, lut_bits=lut_bits)
+                for job in jobs
+            ]
+            for future in futures:
+                future.result()
+    return manifest["data_length"]
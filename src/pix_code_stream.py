@@ -0,0 +1,430 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import io
+import os
+import threading
+import time
+import numpy as np
+from pix_code_decoder import Decoder
+from pix_code_video import find_ffmpeg, parse_stream_info
+
+# Items each queue between two stages holds, so a slow stage holds the others
+# back instead of letting memory grow
+QUEUE_SIZE = 8
+
+# Bytes read from a growing file at a time
+READ_SIZE = 1 << 20
+
+# Seconds between checks of a file that has not grown
+POLL_INTERVAL = 0.1
+
+# Seconds a growing file may stay the same size before it is taken to be
+# complete, when nothing signals the end of its download
+IDLE_TIMEOUT = 10.0
+
+
+class _Stopped(Exception):
+    # Raised in the decoding thread when another stage failed
+    pass
+
+
+class StreamDecoder:
+    """
+    Decode a video while it is still arriving, with asyncio.
+
+    Fetching the video, reading its frames, decoding them and writing the bytes
+    are stages that run at the same time, connected by queues of at most
+    queue_size items. The first bytes come out as soon as the first data frame
+    has arrived, and fetching and decoding together take about as long as the
+    slower of the two instead of their sum. Frames are decoded by
+    Decoder.iter_frame_bytes in a thread, so the event loop stays free to fetch.
+
+    There are two kinds of source:
+    - decode_file reads a video file that is still being written, such as a
+      download, and pipes it through ffmpeg. The mkv files of the ffmpeg backend
+      and streamable mp4 files are decoded as they grow. Containers that keep
+      their index at the end, like the mp4 files written by OpenCV, cannot be
+      read from a pipe at all: they are decoded from their path once the file
+      is complete, so they gain nothing from being followed.
+    - decode_raw reads a stream of raw BGR frames, such as the standard output
+      of 'ffmpeg -i video -f rawvideo -pix_fmt bgr24 -'.
+
+    Parameters:
+    pixel_size (int, optional): The size of the block representing a pixel. Only
+                                needed for videos without a calibration frame.
+    decoder (Decoder, optional): Decodes the frames, and keeps the metrics and
+                                integrity report. Defaults to a new Decoder.
+    queue_size (int, optional): Items each queue holds. Defaults to QUEUE_SIZE.
+
+    Attributes:
+    frames_read (int): Frames read from the source by the last decode.
+    first_byte_seconds (float): Seconds from the start of the last decode to its
+                                first decoded bytes, or None.
+    """
+
+    def __init__(self, pixel_size=None, decoder=None, queue_size=QUEUE_SIZE):
+        self.pixel_size = pixel_size
+        self.decoder = decoder if decoder is not None else Decoder(None)
+        self.queue_size = queue_size
+        self.frames_read = 0
+        self.first_byte_seconds = None
+
+    async def decode_file(
+        self, path, sink=None, done=None, idle_timeout=IDLE_TIMEOUT, ffmpeg="ffmpeg"
+    ):
+        """
+        Decode a video file while it is being written.
+
+        The file is read as it grows and piped into ffmpeg, whose raw frames are
+        decoded as they come out. Reading stops at the end of the file once done
+        is set or, without done, once the file has not grown for idle_timeout
+        seconds. If ffmpeg cannot read the container from a pipe, the complete
+        file is decoded from its path instead. Frames after the last data frame
+        are not read.
+
+        Parameters:
+        path (str): The video. It does not need to exist yet.
+        sink (str or file-like, optional): Where to write the bytes: a path, or a
+                                binary file-like object with a write method.
+                                Defaults to None, returning them.
+        done (asyncio.Event, optional): Set once the file is complete, such as
+                                when its download finished.
+        idle_timeout (float, optional): Seconds without growth that end the file
+                                when there is no done event. Defaults to
+                                IDLE_TIMEOUT.
+        ffmpeg (str, optional): The ffmpeg executable. Defaults to 'ffmpeg'.
+
+        Returns:
+        dict: The bytes decoded and the timings, see decode_raw.
+
+        Raises:
+        ValueError: If ffmpeg is not installed or cannot decode the video.
+        FileNotFoundError: If the file was never created.
+        """
+        chunks = asyncio.Queue(self.queue_size)
+        followed = asyncio.Event()
+        processes = [await _open_ffmpeg(ffmpeg, "pipe:0")]
+        try:
+            return await self._run(
+                sink,
+                self._follow(path, chunks, done, idle_timeout, followed),
+                self._feed(chunks, processes[0].stdin),
+                self._file_frames(path, followed, ffmpeg, processes),
+            )
+        finally:
+            for process in processes:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+
+    async def decode_raw(self, source, width, height, sink=None):
+        """
+        Decode a stream of raw frames as they arrive.
+
+        Parameters:
+        source (asyncio.StreamReader or file-like): The frames, each width *
+                                height * 3 bytes in BGR order. Blocking binary
+                                files, such as sys.stdin.buffer or a named pipe,
+                                are read in a thread.
+        width, height (int): Size of the frames in pixels.
+        sink (str or file-like, optional): Where to write the bytes: a path, or a
+                                binary file-like object with a write method.
+                                Defaults to None, returning them.
+
+        Returns:
+        dict: 'bytes' decoded, 'frames' read, 'skipped_frames' (repeats, see
+              Decoder.unique_frames), 'first_byte_seconds', 'seconds' in total,
+              and the decoded 'data' when there is no sink.
+        """
+        if not isinstance(source, asyncio.StreamReader):
+            source = _FileStream(source)
+        return await self._run(sink, self._read_frames(source, width, height))
+
+    async def _run(self, sink, *stages):
+        # Run the stages that fill the frame queue alongside the decoding and
+        # output stages, cancelling all of them as soon as one fails
+        self._loop = asyncio.get_running_loop()
+        self._frames = asyncio.Queue(self.queue_size)
+        self._output = asyncio.Queue(self.queue_size)
+        self._stopped = threading.Event()
+        self._start = time.perf_counter()
+        self.frames_read = 0
+        self.first_byte_seconds = None
+        self.decoder.metrics.start()
+
+        with contextlib.ExitStack() as stack:
+            if sink is None:
+                output = io.BytesIO()
+            elif isinstance(sink, str):
+                output = stack.enter_context(open(sink, "wb"))
+            else:
+                output = sink
+            stack.callback(self.decoder.metrics.finish)
+
+            producing = asyncio.ensure_future(self._produce(stages))
+            decoding = asyncio.ensure_future(asyncio.to_thread(self._decode))
+            writer = asyncio.ensure_future(self._write(output))
+            tasks = [producing, decoding, writer]
+            consuming = asyncio.gather(decoding, writer)
+            try:
+                # The output is complete once the decoder has seen the last data
+                # frame. Frames after it, such as the padding of a re-encoded
+                # video, are not waited for: the stages still reading them are
+                # cancelled below.
+                await asyncio.wait(
+                    (producing, consuming), return_when=asyncio.FIRST_COMPLETED
+                )
+                if producing.done():
+                    producing.result()
+                await consuming
+            finally:
+                self._stopped.set()
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(consuming, *tasks, return_exceptions=True)
+
+        result = {
+            "bytes": writer.result(),
+            "frames": self.frames_read,
+            "skipped_frames": self.decoder.skipped_frames,
+            "first_byte_seconds": self.first_byte_seconds,
+            "seconds": time.perf_counter() - self._start,
+        }
+        if sink is None:
+            result["data"] = output.getvalue()
+        return result
+
+    async def _produce(self, stages):
+        # Run the stages that fill the frame queue, then end it with None
+        await asyncio.gather(*stages)
+        await self._frames.put(None)
+
+    async def _follow(self, path, chunks, done, idle_timeout, followed):
+        # Put the contents of a file that is still being written on a queue as
+        # they arrive, ending it with None, then set followed
+        def finished(since):
+            if done is not None:
+                return done.is_set()
+            return time.monotonic() - since > idle_timeout
+
+        waiting = time.monotonic()
+        while not os.path.exists(path):
+            if finished(waiting):
+                raise FileNotFoundError(f"No such file: {path}")
+            await asyncio.sleep(POLL_INTERVAL)
+
+        with open(path, "rb") as file:
+            grown = time.monotonic()
+            while True:
+                # Checked before reading, so bytes written before done was set
+                # are not missed
+                complete = finished(grown)
+                data = file.read(READ_SIZE)
+                if data:
+                    grown = time.monotonic()
+                    await chunks.put(data)
+                elif complete:
+                    break
+                else:
+                    await asyncio.sleep(POLL_INTERVAL)
+        await chunks.put(None)
+        followed.set()
+
+    async def _feed(self, chunks, stdin):
+        # Write the queued chunks into ffmpeg. If ffmpeg stops reading, its exit
+        # status tells why, and the chunks are still taken so the file is
+        # followed to its end
+        writing = True
+        try:
+            while True:
+                data = await chunks.get()
+                if data is None:
+                    break
+                if writing:
+                    try:
+                        stdin.write(data)
+                        await stdin.drain()
+                    except (BrokenPipeError, ConnectionResetError):
+                        writing = False
+        finally:
+            stdin.close()
+
+    async def _file_frames(self, path, followed, ffmpeg, processes):
+        # Read the frames ffmpeg decodes from the piped file. Containers that
+        # keep their index at the end, like the mp4 files written by OpenCV,
+        # cannot be read from a pipe, so when ffmpeg fails or ends before the
+        # first frame the file is opened by its path once it is complete
+        try:
+            await self._ffmpeg_frames(processes[0])
+        except ValueError:
+            if self.frames_read:
+                raise
+        if not self.frames_read:
+            await followed.wait()
+            processes.append(await _open_ffmpeg(ffmpeg, path))
+            await self._ffmpeg_frames(processes[-1])
+
+    async def _ffmpeg_frames(self, process):
+        # Find the size of the video in ffmpeg's log, then read its raw frames
+        log = []
+        size = None
+        while size is None:
+            line = await process.stderr.readline()
+            if not line:
+                break
+            log.append(line.decode(errors="replace"))
+            size = parse_stream_info("".join(log))
+        # Keep reading the log so ffmpeg never blocks writing to it
+        drain = asyncio.ensure_future(_read_lines(process.stderr, log))
+        try:
+            if size is not None:
+                await self._read_frames(process.stdout, size[0], size[1])
+            returncode = await process.wait()
+        finally:
+            await asyncio.gather(drain, return_exceptions=True)
+        if size is None or returncode != 0:
+            errors = "".join(log[-5:]).strip()
+            raise ValueError(f"ffmpeg could not decode the video: {errors}")
+
+    async def _read_frames(self, stream, width, height):
+        # Put the raw BGR frames of a stream on the frame queue
+        size = width * height * 3
+        while True:
+            try:
+                with self.decoder.metrics.stage("read"):
+                    data = await stream.readexactly(size)
+            except asyncio.IncompleteReadError:
+                break
+            frame = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+            await self._frames.put(frame)
+            self.frames_read += 1
+            self.decoder.metrics.frame_done()
+
+    def _decode(self):
+        # Runs in a thread: decode the queued frames and queue their bytes,
+        # ending the output with None
+        try:
+            chunks = self.decoder.iter_frame_bytes(
+                self._queued_frames(), self.pixel_size
+            )
+            try:
+                for chunk in chunks:
+                    self.decoder.metrics.count("bytes", len(chunk))
+                    self._call(self._output.put(chunk))
+            finally:
+                chunks.close()
+            self._call(self._output.put(None))
+        except _Stopped:
+            pass
+
+    def _queued_frames(self):
+        # The frames of the frame queue, for the decoding thread
+        while True:
+            frame = self._call(self._frames.get())
+            if frame is None:
+                return
+            yield frame
+
+    def _call(self, coroutine):
+        # Run a queue operation on the event loop from the decoding thread,
+        # giving up if the other stages stopped
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        while True:
+            try:
+                return future.result(POLL_INTERVAL)
+            except concurrent.futures.TimeoutError:
+                if self._stopped.is_set():
+                    future.cancel()
+                    raise _Stopped()
+
+    async def _write(self, output):
+        # Write the decoded bytes as they come, returning how many there were
+        num_bytes = 0
+        while True:
+            chunk = await self._output.get()
+            if chunk is None:
+                return num_bytes
+            if self.first_byte_seconds is None:
+                self.first_byte_seconds = time.perf_counter() - self._start
+            output.write(chunk)
+            num_bytes += len(chunk)
+
+
+class _FileStream:
+    # Gives a blocking binary file the readexactly method of asyncio.StreamReader
+    def __init__(self, file):
+        self.file = file
+
+    async def readexactly(self, size):
+        data = await asyncio.to_thread(self.file.read, size)
+        if len(data) < size:
+            raise asyncio.IncompleteReadError(data, size)
+        return data
+
+
+async def _open_ffmpeg(ffmpeg, source):
+    # Start ffmpeg decoding source, a path or 'pipe:0' for its standard input,
+    # into raw BGR frames on its standard output
+    return await asyncio.create_subprocess_exec(
+        find_ffmpeg(ffmpeg),
+        "-hide_banner",
+        "-nostats",
+        "-i",
+        source,
+        "-map",
+        "0:v:0",
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "bgr24",
+        "pipe:1",
+        stdin=(
+            asyncio.subprocess.PIPE
+            if source == "pipe:0"
+            else asyncio.subprocess.DEVNULL
+        ),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+
+async def _read_lines(stream, lines):
+    while True:
+        line = await stream.readline()
+        if not line:
+            return
+        lines.append(line.decode(errors="replace"))
+
+
+def decode_stream(
+    source,
+    sink=None,
+    pixel_size=None,
+    size=None,
+    idle_timeout=IDLE_TIMEOUT,
+    decoder=None,
+):
+    """
+    Decode a growing video file or a stream of raw frames, see StreamDecoder.
+
+    Parameters:
+    source (str or file-like): A video file that may still be being written, or
+                               with size, a binary file of raw BGR frames.
+    sink (str or file-like, optional): Where to write the bytes. Defaults to
+                               None, returning them in the result.
+    pixel_size (int, optional): The size of the block representing a pixel.
+    size (tuple, optional): (width, height) of raw frames.
+    idle_timeout (float, optional): Seconds a growing file may stay the same size
+                               before it is taken to be complete.
+    decoder (Decoder, optional): Decodes the frames. Defaults to a new Decoder.
+
+    Returns:
+    dict: The bytes decoded and the timings, see StreamDecoder.decode_raw.
+    """
+    streamer = StreamDecoder(pixel_size, decoder)
+    if size is not None:
+        coroutine = streamer.decode_raw(source, size[0], size[1], sink)
+    else:
+        coroutine = streamer.decode_file(source, sink, idle_timeout=idle_timeout)
+    return asyncio.run(coroutine)
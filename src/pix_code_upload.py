@@ -0,0 +1,316 @@
+import http.client
+import json
+import os
+import random
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Bytes sent per request. Resumable upload endpoints expect multiples of 256 KiB
+CHUNK_SIZE = 32 * 256 * 1024
+
+# Failed requests in a row before an upload gives up
+MAX_RETRIES = 8
+
+# Longest wait between retries, in seconds
+MAX_BACKOFF = 64
+
+# Responses worth retrying, besides connection errors
+RETRIABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+# Errors of a request that never got a response
+ConnectionErrors = (OSError, http.client.HTTPException)
+
+
+class UploadError(Exception):
+    """
+    An upload was rejected by the server or ran out of retries.
+
+    Attributes:
+    status (int): The HTTP status of the response, or None.
+    """
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class _KeepStatus(urllib.request.HTTPRedirectHandler):
+    # A 308 means 'Resume Incomplete' to the upload protocol, not a redirect
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class ResumableUpload:
+    """
+    Upload a file in chunks with the resumable upload protocol of YouTube and
+    Google Cloud Storage.
+
+    A POST to upload_url starts a session, whose URI the server returns in the
+    Location header. The file is then sent in chunks, each a PUT to the session
+    URI with a Content-Range header. The server answers 308 with a Range header
+    of the bytes it has, and 200 or 201 with the result once it has them all.
+
+    The session URI and offset are saved to state_path after every chunk, so an
+    interrupted upload carries on from where it stopped, even in a new process.
+    Failed requests are retried with exponential backoff, after asking the
+    server how much of the file it received.
+
+    Parameters:
+    file_path (str): The file to upload.
+    upload_url (str): Where to start the session.
+    metadata (dict, optional): JSON sent when starting the session, such as the
+                               title of a video.
+    headers (dict or callable, optional): Extra headers of every request, such as
+                               an Authorization header, or a function returning
+                               them so that tokens can be refreshed.
+    chunk_size (int, optional): Bytes per request. Defaults to CHUNK_SIZE.
+    content_type (str, optional): Media type of the file. Defaults to 'video/*'.
+    state_path (str, optional): Where to save the progress. Defaults to the file
+                               path with '.upload.json' appended.
+    max_retries (int, optional): Failed requests in a row before giving up.
+    backoff (float, optional): Seconds to wait before the first retry, doubled
+                               after each failure. Defaults to 1.
+    timeout (float, optional): Seconds to wait for each response. Defaults to 60.
+    opener (urllib.request.OpenerDirector, optional): Sends the requests.
+                               Defaults to a urllib opener that does not follow
+                               redirects.
+
+    Attributes:
+    size (int): Size of the file in bytes.
+    offset (int): Bytes the server has confirmed.
+    session_uri (str): URI of the upload session, or None before it starts.
+    response (dict): The server's answer to the completed upload, or None.
+    """
+
+    def __init__(
+        self,
+        file_path,
+        upload_url,
+        metadata=None,
+        headers=None,
+        chunk_size=CHUNK_SIZE,
+        content_type="video/*",
+        state_path=None,
+        max_retries=MAX_RETRIES,
+        backoff=1.0,
+        timeout=60,
+        opener=None,
+    ):
+        self.file_path = file_path
+        self.upload_url = upload_url
+        self.metadata = metadata or {}
+        self.headers = headers or {}
+        self.chunk_size = chunk_size
+        self.content_type = content_type
+        self.state_path = state_path or f"{file_path}.upload.json"
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.opener = opener or urllib.request.build_opener(_KeepStatus)
+
+        self.size = os.path.getsize(file_path)
+        self.offset = 0
+        self.session_uri = None
+        self.response = None
+        self._needs_status = False  # Ask for the offset before sending more
+        self._load_state()
+
+    @property
+    def progress(self):
+        """
+        Fraction of the file the server has confirmed, from 0 to 1.
+        """
+        if self.response is not None:
+            return 1.0
+        return self.offset / self.size if self.size else 0.0
+
+    def execute(self, progress=None):
+        """
+        Upload the rest of the file, retrying failed requests.
+
+        Parameters:
+        progress (callable, optional): Called with this upload after every chunk.
+
+        Returns:
+        dict: The server's answer to the completed upload.
+
+        Raises:
+        UploadError: If the server rejects the upload, or requests keep failing
+                     after max_retries retries.
+        """
+        retries = 0
+        while self.response is None:
+            try:
+                self.next_chunk()
+            except (UploadError, *ConnectionErrors) as e:
+                status = getattr(e, "status", None)
+                if isinstance(e, UploadError) and status not in RETRIABLE_STATUS_CODES:
+                    raise
+                retries += 1
+                if retries > self.max_retries:
+                    raise UploadError(
+                        f"Gave up uploading {self.file_path} after"
+                        + f" {self.max_retries} retries: {e}",
+                        status,
+                    ) from e
+                delay = min(self.backoff * 2 ** (retries - 1), MAX_BACKOFF)
+                time.sleep(delay + random.uniform(0, self.backoff))
+                self._needs_status = True
+                continue
+            retries = 0
+            if progress is not None:
+                progress(self)
+        return self.response
+
+    def next_chunk(self):
+        """
+        Make the next request: start the session, ask the server how much it has
+        after a failure, or send the next chunk.
+
+        Returns:
+        tuple: The fraction uploaded so far, and the server's answer (a dict)
+               once the upload is complete, or None before that.
+
+        Raises:
+        UploadError: If the server rejects the request.
+        OSError: If the request failed without a response.
+        """
+        if self.response is not None:
+            return 1.0, self.response
+        if self.session_uri is None:
+            self._start()
+            return self.progress, None
+
+        if self._needs_status:
+            data = b""
+            content_range = f"bytes */{self.size}"
+        else:
+            end = min(self.offset + self.chunk_size, self.size)
+            with open(self.file_path, "rb") as file:
+                file.seek(self.offset)
+                data = file.read(end - self.offset)
+            content_range = (
+                f"bytes {self.offset}-{end - 1}/{self.size}"
+                if end > self.offset
+                else f"bytes */{self.size}"
+            )
+        status, headers, body = self._request(
+            "PUT", self.session_uri, data, {"Content-Range": content_range}
+        )
+        self._needs_status = False
+        self._handle(status, headers, body)
+        return self.progress, self.response
+
+    def _start(self):
+        status, headers, body = self._request(
+            "POST",
+            self.upload_url,
+            json.dumps(self.metadata).encode(),
+            {
+                "Content-Type": "application/json; charset=UTF-8",
+                "X-Upload-Content-Length": str(self.size),
+                "X-Upload-Content-Type": self.content_type,
+            },
+        )
+        if status not in (200, 201) or not headers.get("Location"):
+            raise UploadError(
+                f"Could not start uploading {self.file_path}: {status} {body[:200]!r}",
+                status,
+            )
+        self.session_uri = headers["Location"]
+        self.offset = 0
+        self._save_state()
+
+    def _handle(self, status, headers, body):
+        if status in (200, 201):
+            self.offset = self.size
+            self.response = json.loads(body) if body.strip() else {}
+            self._clear_state()
+        elif status == 308:
+            # 'bytes=0-N' means the first N + 1 bytes arrived
+            received = headers.get("Range")
+            self.offset = int(received.rsplit("-", 1)[1]) + 1 if received else 0
+            self._save_state()
+        elif status in (404, 410):
+            # The session expired, start over
+            print(f"Warning: the upload session of {self.file_path} expired.")
+            self.session_uri = None
+            self.offset = 0
+            self._clear_state()
+        else:
+            raise UploadError(
+                f"Uploading {self.file_path} failed: {status} {body[:200]!r}", status
+            )
+
+    def _request(self, method, url, data, headers):
+        extra = self.headers() if callable(self.headers) else self.headers
+        request = urllib.request.Request(
+            url, data=data, method=method, headers={**extra, **headers}
+        )
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            with e:
+                return e.code, e.headers, e.read()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return
+        # Only resume an upload of the same, unchanged file
+        if (
+            state.get("upload_url") == self.upload_url
+            and state.get("size") == self.size
+            and state.get("mtime") == os.path.getmtime(self.file_path)
+        ):
+            self.session_uri = state["session_uri"]
+            self.offset = state["offset"]
+            self._needs_status = True
+
+    def _save_state(self):
+        state = {
+            "file_path": self.file_path,
+            "upload_url": self.upload_url,
+            "size": self.size,
+            "mtime": os.path.getmtime(self.file_path),
+            "session_uri": self.session_uri,
+            "offset": self.offset,
+        }
+        # Written next to the final path and renamed, so a crash leaves either
+        # the old or the new state
+        temporary = f"{self.state_path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(state, file)
+        os.replace(temporary, self.state_path)
+
+    def _clear_state(self):
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+
+def upload_all(uploads, workers=4, progress=None):
+    """
+    Run several uploads concurrently, each in a thread of a pool.
+
+    Parameters:
+    uploads (iterable): ResumableUpload objects, such as one per video or shard.
+    workers (int, optional): Uploads running at once. Defaults to 4.
+    progress (callable, optional): Called with an upload after each of its chunks,
+                                   from the thread running it.
+
+    Yields:
+    tuple: Each upload and the server's answer, or the exception that stopped
+           it, in the order the uploads finish.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(upload.execute, progress): upload for upload in uploads}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
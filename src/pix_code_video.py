@@ -0,0 +1,428 @@
+import re
+import shutil
+import subprocess
+import cv2
+import numpy as np
+
+# Ways of writing and reading videos
+BACKEND_OPENCV = "opencv"
+BACKEND_FFMPEG = "ffmpeg"
+BACKENDS = (BACKEND_OPENCV, BACKEND_FFMPEG)
+
+# Codec of each backend when none is given. FFV1 is lossless in both
+DEFAULT_CODECS = {BACKEND_OPENCV: "mp4v", BACKEND_FFMPEG: "ffv1"}
+
+# OpenCV codecs that its mp4 container does not take (MJPG falls back to mp4v)
+AVI_FOURCCS = ("HFYU", "MJPG")
+
+
+def video_extension(backend=BACKEND_OPENCV, codec=None):
+    """
+    The file extension a video written with a backend and codec should have.
+
+    Parameters:
+    backend (str, optional): 'opencv' or 'ffmpeg'. Defaults to 'opencv'.
+    codec (str, optional): The codec. Defaults to the backend's default codec.
+
+    Returns:
+    str: '.mkv' for ffmpeg, '.avi' for OpenCV codecs that need it, else '.mp4'.
+    """
+    if backend == BACKEND_FFMPEG:
+        return ".mkv"
+    return ".avi" if codec in AVI_FOURCCS else ".mp4"
+
+
+def find_ffmpeg(ffmpeg="ffmpeg"):
+    """
+    Find the ffmpeg executable.
+
+    Parameters:
+    ffmpeg (str, optional): A name on the PATH or a path. Defaults to 'ffmpeg'.
+
+    Returns:
+    str: The path of the executable.
+
+    Raises:
+    ValueError: If ffmpeg is not installed.
+    """
+    path = shutil.which(ffmpeg)
+    if path is None:
+        raise ValueError(
+            f"Could not find {ffmpeg!r}. Install ffmpeg or use the OpenCV backend."
+        )
+    return path
+
+
+def parse_stream_info(info):
+    """
+    Find the size and frame rate of the first video stream in what ffmpeg prints
+    about its input.
+
+    Parameters:
+    info (str): ffmpeg's log output.
+
+    Returns:
+    tuple: The width, height and frames per second (None if not given), or None
+           if there is no video stream.
+    """
+    stream = re.search(r"Stream #.*?Video:.*", info)
+    size = stream and re.search(r"\b(\d{2,5})x(\d{2,5})\b", stream.group())
+    if size is None:
+        return None
+    rate = re.search(r"([\d.]+) fps", stream.group())
+    return (
+        int(size.group(1)),
+        int(size.group(2)),
+        float(rate.group(1)) if rate else None,
+    )
+
+
+class OpenCVWriter:
+    """
+    Write frames with cv2.VideoWriter.
+
+    Parameters:
+    path (str): The video to write.
+    frame_rate (float): Frames per second.
+    width, height (int): Size of the frames in pixels.
+    codec (str, optional): Four character code, such as 'mp4v' or 'MJPG' (lossy),
+                           or 'FFV1' and 'HFYU' (lossless). 'MJPG' and 'HFYU'
+                           need an .avi path.
+
+    Raises:
+    ValueError: If no writer is available for the codec and container.
+    """
+
+    def __init__(self, path, frame_rate, width, height, codec="mp4v"):
+        self.path = path
+        self.video = cv2.VideoWriter(
+            path, cv2.VideoWriter_fourcc(*codec), frame_rate, (width, height)
+        )
+        if not self.video.isOpened():
+            raise ValueError(f"Could not open a video writer for codec {codec!r}.")
+
+    def write(self, frame):
+        """
+        Append a frame.
+
+        Parameters:
+        frame (np.ndarray): A (height, width, 3) uint8 array in RGB order.
+        """
+        self.video.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+
+    def close(self):
+        self.video.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FFmpegWriter:
+    """
+    Write frames by piping raw RGB pixels into an ffmpeg process.
+
+    ffmpeg picks the pixel format of the codec closest to RGB, so lossless
+    codecs such as 'ffv1' keep every pixel exact.
+
+    Parameters:
+    path (str): The video to write.
+    frame_rate (float): Frames per second.
+    width, height (int): Size of the frames in pixels.
+    codec (str, optional): An ffmpeg encoder, such as 'ffv1', 'libx264rgb' or
+                           'png'. Defaults to 'ffv1'.
+    options (list, optional): Extra output options, such as ['-crf', '0'].
+    ffmpeg (str, optional): The ffmpeg executable. Defaults to 'ffmpeg'.
+
+    Raises:
+    ValueError: If ffmpeg is not installed.
+    """
+
+    def __init__(
+        self,
+        path,
+        frame_rate,
+        width,
+        height,
+        codec="ffv1",
+        options=(),
+        ffmpeg="ffmpeg",
+    ):
+        self.path = path
+        command = [
+            find_ffmpeg(ffmpeg),
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgb24",
+            "-s",
+            f"{width}x{height}",
+            "-r",
+            str(frame_rate),
+            "-i",
+            "-",
+            "-c:v",
+            codec,
+            *options,
+            path,
+        ]
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+    def write(self, frame):
+        """
+        Append a frame.
+
+        Parameters:
+        frame (np.ndarray): A (height, width, 3) uint8 array in RGB order.
+
+        Raises:
+        ValueError: If ffmpeg stopped, for example on an unknown codec.
+        """
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            self.close()
+            raise ValueError(f"ffmpeg stopped reading the frames of {self.path}.")
+
+    def close(self):
+        """
+        Finish the video and wait for ffmpeg to exit.
+
+        Raises:
+        ValueError: If ffmpeg failed.
+        """
+        if self.process.stdin.closed:
+            return
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        errors = self.process.stderr.read().decode(errors="replace").strip()
+        self.process.stderr.close()
+        if self.process.wait() != 0:
+            raise ValueError(f"ffmpeg could not write {self.path}: {errors}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class OpenCVReader:
+    """
+    Read frames with cv2.VideoCapture.
+
+    Parameters:
+    path (str): The video to read.
+
+    Raises:
+    ValueError: If the video file cannot be opened.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise ValueError("Error opening video file.")
+
+    @property
+    def frame_count(self):
+        # As stored in the container, which can be off for some formats
+        return int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def seek(self, frame_index):
+        """
+        Make the next read return frame frame_index.
+        """
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+
+    def read(self):
+        """
+        Read the next frame.
+
+        Returns:
+        np.ndarray: The (height, width, 3) BGR frame, or None at the end.
+        """
+        ret, frame = self.capture.read()
+        return frame if ret else None
+
+    def close(self):
+        self.capture.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FFmpegReader:
+    """
+    Read frames as raw BGR pixels piped out of an ffmpeg process.
+
+    Reads whatever ffmpeg can decode, with frames in the same layout as
+    OpenCVReader.
+
+    Parameters:
+    path (str): The video to read.
+    ffmpeg (str, optional): The ffmpeg executable. Defaults to 'ffmpeg'.
+
+    Raises:
+    ValueError: If ffmpeg is not installed or the video cannot be opened.
+    """
+
+    def __init__(self, path, ffmpeg="ffmpeg"):
+        self.path = path
+        self.ffmpeg = find_ffmpeg(ffmpeg)
+        self.width, self.height, self.frame_rate = self._probe()
+        self._frame_count = None
+        self.process = None
+        self.seek(0)
+
+    def _probe(self):
+        # ffmpeg prints the streams of its input, then fails for want of an output
+        info = subprocess.run(
+            [self.ffmpeg, "-hide_banner", "-i", self.path],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        ).stderr.decode(errors="replace")
+        video = parse_stream_info(info)
+        if video is None:
+            raise ValueError("Error opening video file.")
+        return video
+
+    @property
+    def frame_count(self):
+        # Counted from a checksum line per packet of the video stream, which
+        # reads the packets without decoding them
+        if self._frame_count is None:
+            packets = subprocess.run(
+                [
+                    self.ffmpeg,
+                    "-loglevel",
+                    "error",
+                    "-i",
+                    self.path,
+                    "-map",
+                    "0:v:0",
+                    "-c",
+                    "copy",
+                    "-f",
+                    "framecrc",
+                    "-",
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            ).stdout.splitlines()
+            self._frame_count = sum(not line.startswith(b"#") for line in packets)
+        return self._frame_count
+
+    def seek(self, frame_index):
+        """
+        Make the next read return frame frame_index.
+
+        ffmpeg is restarted at the frame's time, half a frame early so rounded
+        timestamps still land on it. Videos without a known frame rate are
+        decoded from the start, dropping the frames before it.
+        """
+        self.close()
+        command = [self.ffmpeg, "-loglevel", "error"]
+        if frame_index and self.frame_rate:
+            command += ["-ss", f"{(frame_index - 0.5) / self.frame_rate:.6f}"]
+        command += ["-i", self.path]
+        if frame_index and not self.frame_rate:
+            command += ["-vf", f"select=gte(n\\,{frame_index})", "-vsync", "0"]
+        command += ["-map", "0:v:0", "-f", "rawvideo", "-pix_fmt", "bgr24", "-"]
+        self.process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+
+    def read(self):
+        """
+        Read the next frame.
+
+        Returns:
+        np.ndarray: The (height, width, 3) BGR frame, or None at the end.
+        """
+        size = self.width * self.height * 3
+        data = self.process.stdout.read(size)
+        if len(data) < size:
+            return None
+        return np.frombuffer(data, dtype=np.uint8).reshape(self.height, self.width, 3)
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdout.close()
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_writer(path, frame_rate, width, height, backend=BACKEND_OPENCV, codec=None):
+    """
+    Open a video for writing.
+
+    Parameters:
+    path (str): The video to write.
+    frame_rate (float): Frames per second.
+    width, height (int): Size of the frames in pixels.
+    backend (str, optional): 'opencv' or 'ffmpeg'. Defaults to 'opencv'.
+    codec (str, optional): A fourcc for OpenCV or an encoder name for ffmpeg.
+                           Defaults to 'mp4v' and 'ffv1' respectively.
+
+    Returns:
+    OpenCVWriter or FFmpegWriter: The writer, whose write method takes RGB frames.
+
+    Raises:
+    ValueError: If the backend is unknown or cannot write the codec.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}. Choose 'opencv' or 'ffmpeg'.")
+    codec = codec or DEFAULT_CODECS[backend]
+    if backend == BACKEND_FFMPEG:
+        return FFmpegWriter(path, frame_rate, width, height, codec)
+    return OpenCVWriter(path, frame_rate, width, height, codec)
+
+
+def open_reader(path, backend=None):
+    """
+    Open a video for reading.
+
+    Parameters:
+    path (str): The video to read.
+    backend (str, optional): 'opencv' or 'ffmpeg'. Defaults to None, which uses
+                             OpenCV and falls back to ffmpeg for videos OpenCV
+                             cannot open.
+
+    Returns:
+    OpenCVReader or FFmpegReader: The reader, whose read method returns BGR frames.
+
+    Raises:
+    ValueError: If the backend is unknown or the video cannot be opened.
+    """
+    if backend is None:
+        try:
+            return OpenCVReader(path)
+        except ValueError:
+            if shutil.which("ffmpeg") is None:
+                raise
+            return FFmpegReader(path)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}. Choose 'opencv' or 'ffmpeg'.")
+    if backend == BACKEND_FFMPEG:
+        return FFmpegReader(path)
+    return OpenCVReader(path)
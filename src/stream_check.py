@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from benchmark import make_payload
+from pix_code_encoder import Encoder
+from pix_code_stream import QUEUE_SIZE, StreamDecoder
+from pix_code_video import BACKEND_FFMPEG, BACKEND_OPENCV
+
+# Bytes the simulated download writes at a time
+WRITE_SIZE = 64 << 10
+
+
+def write_slowly(source, destination, seconds, chunk_size=WRITE_SIZE):
+    """
+    Copy a file a chunk at a time over about the given time, like a download.
+
+    Every chunk is flushed as soon as it is written, so a reader following the
+    destination sees it grow.
+
+    Parameters:
+    source (str): The file to copy.
+    destination (str): Where to write it.
+    seconds (float): How long the copy should take.
+    chunk_size (int, optional): Bytes written at a time. Defaults to WRITE_SIZE.
+
+    Returns:
+    float: The seconds the copy took.
+    """
+    rate = max(os.path.getsize(source), 1) / seconds
+    start = time.perf_counter()
+    written = 0
+    with open(source, "rb") as reader, open(destination, "wb") as writer:
+        while True:
+            data = reader.read(chunk_size)
+            if not data:
+                break
+            writer.write(data)
+            writer.flush()
+            written += len(data)
+            # Wait until the bytes written so far are due
+            delay = start + written / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    return time.perf_counter() - start
+
+
+async def check_download(video_path, payload, seconds, workdir):
+    """
+    Decode a video with StreamDecoder.decode_file while it is being downloaded.
+
+    Parameters:
+    video_path (str): The encoded video.
+    payload (bytes): The bytes that were encoded into it.
+    seconds (float): How long the simulated download takes.
+    workdir (str): Where to write the download.
+
+    Returns:
+    dict: Whether the decoded bytes are 'exact', the 'download_seconds', the
+          'first_byte_seconds' and the 'seconds' of the whole decode.
+    """
+    destination = os.path.join(workdir, "download" + os.path.splitext(video_path)[1])
+    done = asyncio.Event()
+
+    async def download():
+        try:
+            return await asyncio.to_thread(
+                write_slowly, video_path, destination, seconds
+            )
+        finally:
+            done.set()
+
+    download_seconds, result = await asyncio.gather(
+        download(), StreamDecoder().decode_file(destination, done=done)
+    )
+    return {
+        "exact": result["data"] == payload,
+        "download_seconds": download_seconds,
+        "first_byte_seconds": result["first_byte_seconds"],
+        "seconds": result["seconds"],
+    }
+
+
+async def check_trailing_frames(encoder, payload, block_size, trailing):
+    """
+    Decode a stream of raw frames that goes on after its last data frame.
+
+    Re-encoded and downloaded videos often end in padding: copies of their last
+    frame. The stream decoder has to finish as soon as the last data frame is
+    decoded instead of waiting for its queues to take the rest.
+
+    Parameters:
+    encoder (Encoder): Holds the payload.
+    payload (bytes): The bytes that were encoded.
+    block_size (int): The nxn size of each block in pixels.
+    trailing (int): Copies of the last frame appended to the stream.
+
+    Returns:
+    dict: Whether the decoded bytes are 'exact', the 'first_byte_seconds' and
+          the 'seconds' of the decode.
+    """
+    frames = [
+        frame[..., ::-1].tobytes()
+        for frame in encoder.iter_frames(block_size, CALIBRATION=True)
+    ]
+    stream = io.BytesIO(b"".join(frames + frames[-1:] * trailing))
+    result = await StreamDecoder().decode_raw(
+        stream, encoder.img_width, encoder.img_height
+    )
+    return {
+        "exact": result["data"] == payload,
+        "first_byte_seconds": result["first_byte_seconds"],
+        "seconds": result["seconds"],
+    }
+
+
+def run_checks(size, seconds, block_size, width, height, timeout):
+    """
+    Run every check in a scratch directory.
+
+    Parameters:
+    size (int): Payload size in bytes.
+    seconds (float): How long each simulated download takes.
+    block_size (int): The nxn size of each block in pixels.
+    width, height (int): Size of the frames.
+    timeout (float): Seconds after which a check counts as hung.
+
+    Yields:
+    dict: The 'name' of each check and its results, with 'ok' telling whether
+          it passed, or its 'error'.
+    """
+    payload = make_payload(size)
+    workdir = tempfile.mkdtemp(prefix="pix-code-stream-check-")
+    previous_dir = os.getcwd()
+    os.chdir(workdir)
+    try:
+        encoder = Encoder(data=payload, img_width=width, img_height=height)
+        checks = []
+        # The mkv files of ffmpeg are read as they grow, so the first bytes have
+        # to come out during the download. The mp4 files of OpenCV keep their
+        # index at the end and are only read once complete. Both codecs are
+        # lossless, so small frames decode exactly.
+        for backend, codec, progressive in (
+            (BACKEND_FFMPEG, "ffv1", True),
+            (BACKEND_OPENCV, "FFV1", False),
+        ):
+            checks.append(
+                (
+                    f"{backend} download",
+                    progressive,
+                    lambda backend=backend, codec=codec: _encode_and_download(
+                        encoder, payload, backend, codec, block_size, seconds, workdir
+                    ),
+                )
+            )
+        trailing = QUEUE_SIZE + 4
+        checks.append(
+            (
+                f"{trailing} trailing frames",
+                False,
+                lambda: check_trailing_frames(encoder, payload, block_size, trailing),
+            )
+        )
+
+        for name, progressive, check in checks:
+            try:
+                result = asyncio.run(asyncio.wait_for(check(), timeout))
+            except asyncio.TimeoutError:
+                yield {"name": name, "ok": False, "error": f"hung for {timeout}s"}
+                continue
+            except Exception as e:
+                yield {"name": name, "ok": False, "error": f"{type(e).__name__}: {e}"}
+                continue
+            result["ok"] = result["exact"]
+            if progressive:
+                result["ok"] &= (
+                    result["first_byte_seconds"] is not None
+                    and result["first_byte_seconds"] < result["download_seconds"]
+                )
+            yield {"name": name, **result}
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def _encode_and_download(
+    encoder, payload, backend, codec, block_size, seconds, workdir
+):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        video_path = encoder.generate_video(
+            output_folder=backend,
+            frame_rate=30,
+            BLOCK_SIZE=block_size,
+            CALIBRATION=True,
+            FOURCC=codec,
+            BACKEND=backend,
+        )
+    return await check_download(video_path, payload, seconds, workdir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check that videos decode while a simulated slow download writes"
+        + " them, and that streams with frames after the last data frame finish."
+        + " Needs ffmpeg."
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=200_000,
+        help="Payload size in bytes (default: 200000).",
+    )
+    parser.add_argument(
+        "--seconds",
+        type=float,
+        default=3.0,
+        help="How long each simulated download takes (default: 3).",
+    )
+    parser.add_argument(
+        "--block-size", type=int, default=5, help="Block size in pixels (default: 5)."
+    )
+    parser.add_argument(
+        "--resolution",
+        default="640x360",
+        help="Frame size as WIDTHxHEIGHT (default: 640x360).",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60.0,
+        help="Seconds after which a check counts as hung (default: 60).",
+    )
+    args = parser.parse_args(argv)
+    width, height = (int(value) for value in args.resolution.lower().split("x"))
+
+    failures = 0
+    for result in run_checks(
+        args.size, args.seconds, args.block_size, width, height, args.timeout
+    ):
+        failures += not result["ok"]
+        status = "ok" if result["ok"] else "FAILED"
+        if "error" in result:
+            print(f"{result['name']}: {status}, {result['error']}")
+            continue
+        timings = f"first byte after {result['first_byte_seconds'] or 0:.2f}s"
+        if "download_seconds" in result:
+            timings += f", download {result['download_seconds']:.2f}s"
+        print(
+            f"{result['name']}: {status}, exact {result['exact']}, {timings},"
+            + f" done after {result['seconds']:.2f}s"
+        )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+import argparse
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import numpy as np
+from pix_code_upload import ResumableUpload, UploadError, upload_all
+
+# Bytes per request of the checked uploads, the smallest the protocol allows
+CHUNK_SIZE = 256 * 1024
+
+
+class FakeUploadServer(http.server.ThreadingHTTPServer):
+    """
+    A local endpoint speaking the resumable upload protocol, with faults.
+
+    A POST to /upload starts a session at /session/<id>. PUTs with a
+    Content-Range header add bytes to it, answered with 308 and a Range header
+    until the session has them all, then with 200 and a JSON body. A PUT of
+    'bytes */<size>' asks how many bytes arrived.
+
+    Every session follows the same plan of faults, one entry per chunk request:
+    'drop' keeps the first half of the chunk and closes the connection without
+    an answer, as when a connection is cut mid-upload; '503' answers 503
+    Service Unavailable without keeping anything; None accepts the chunk.
+
+    A session answers 400 once it has had max_requests requests, so a client
+    that never catches up fails instead of hanging.
+
+    Parameters:
+    faults (list, optional): The plan. Defaults to no faults.
+    max_requests (int, optional): Requests a session answers. Defaults to 200.
+
+    Attributes:
+    sessions (dict): The bytes received by each session id.
+    faults_hit (dict): How often each fault happened.
+    """
+
+    def __init__(self, faults=None, max_requests=200):
+        super().__init__(("127.0.0.1", 0), _UploadHandler)
+        self.faults = list(faults or [])
+        self.max_requests = max_requests
+        self.sessions = {}
+        self.faults_hit = {"drop": 0, "503": 0}
+        self._requests = {}  # Chunk requests of each session, for the plan
+        self._puts = {}  # All requests of each session
+        self._lock = threading.Lock()
+
+    @property
+    def upload_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/upload"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class _UploadHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        with server._lock:
+            session = str(len(server.sessions))
+            server.sessions[session] = bytearray()
+            server._requests[session] = 0
+            server._puts[session] = 0
+        host, port = server.server_address
+        self.send_response(200)
+        self.send_header("Location", f"http://{host}:{port}/session/{session}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_PUT(self):
+        server = self.server
+        session = self.path.rsplit("/", 1)[-1]
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if session not in server.sessions:
+            return self._answer(404)
+        with server._lock:
+            server._puts[session] += 1
+            if server._puts[session] > server.max_requests:
+                return self._answer(400, b"Too many requests")
+        received = server.sessions[session]
+        span, size = self.headers["Content-Range"].split(" ")[1].split("/")
+        size = int(size)
+
+        if span != "*":
+            with server._lock:
+                index = server._requests[session]
+                server._requests[session] += 1
+            fault = server.faults[index] if index < len(server.faults) else None
+            start = int(span.split("-")[0])
+            if fault is not None:
+                with server._lock:
+                    server.faults_hit[fault] += 1
+            if fault == "503":
+                return self._answer(503)
+            if start == len(received):
+                if fault == "drop":
+                    received += data[: len(data) // 2]
+                    self.close_connection = True
+                    return
+                received += data
+        if len(received) >= size:
+            body = json.dumps({"id": session, "size": len(received)}).encode()
+            return self._answer(200, body)
+        headers = {"Range": f"bytes=0-{len(received) - 1}"} if received else {}
+        self._answer(308, headers=headers)
+
+    def _answer(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _upload(path, server, **options):
+    return ResumableUpload(
+        path,
+        server.upload_url,
+        metadata={"title": os.path.basename(path)},
+        chunk_size=CHUNK_SIZE,
+        backoff=0.01,
+        timeout=10,
+        **options,
+    )
+
+
+def check_retries(path, data):
+    """
+    Upload through cut connections and 503s, checking the bytes that arrived.
+
+    Returns:
+    dict: Whether the server got the 'exact' bytes, and the faults hit.
+    """
+    with FakeUploadServer([None, "drop", None, "503", "drop", "503"]) as server:
+        response = _upload(path, server).execute()
+        received = bytes(server.sessions[response["id"]])
+    return {
+        "exact": received == data,
+        "faults": dict(server.faults_hit),
+        "sessions": len(server.sessions),
+    }
+
+
+def check_resume(path, data):
+    """
+    Stop an upload at a fault, then finish it with a new ResumableUpload that
+    picks the session up from the saved state, as after a crash.
+
+    Returns:
+    dict: Whether the server got the 'exact' bytes in one session, and whether
+          the first attempt 'stopped' at the fault.
+    """
+    with FakeUploadServer([None, None, "drop"]) as server:
+        try:
+            _upload(path, server, max_retries=0).execute()
+            stopped = False
+        except UploadError:
+            stopped = True
+        state_saved = os.path.exists(f"{path}.upload.json")
+        resumed = _upload(path, server)
+        offset = resumed.offset
+        response = resumed.execute()
+        received = bytes(server.sessions[response["id"]])
+    return {
+        "exact": received == data and len(server.sessions) == 1,
+        "stopped": stopped and state_saved and offset > 0,
+        "resumed_from": offset,
+        "faults": dict(server.faults_hit),
+    }
+
+
+def check_upload_all(paths, payloads, workers):
+    """
+    Upload several files at once with upload_all, through faults.
+
+    Returns:
+    dict: Whether every file arrived 'exact', and the faults hit.
+    """
+    with FakeUploadServer(["drop", None, "503", None, "drop"]) as server:
+        results = dict(
+            (upload.file_path, response)
+            for upload, response in upload_all(
+                [_upload(path, server) for path in paths], workers
+            )
+        )
+        exact = all(
+            not isinstance(results[path], Exception)
+            and bytes(server.sessions[results[path]["id"]]) == data
+            for path, data in zip(paths, payloads)
+        )
+    return {"exact": exact, "faults": dict(server.faults_hit)}
+
+
+def run_checks(size, files, workers):
+    """
+    Run every check on random files in a scratch directory.
+
+    Parameters:
+    size (int): Size of each file in bytes.
+    files (int): Files uploaded at once by upload_all.
+    workers (int): Threads of upload_all.
+
+    Yields:
+    dict: The 'name' of each check and its results, with 'ok' telling whether
+          it passed, or its 'error'.
+    """
+    workdir = tempfile.mkdtemp(prefix="pix-code-upload-check-")
+    try:
+        rng = np.random.default_rng(0)
+        payloads = [rng.bytes(size) for _ in range(files)]
+        paths = [os.path.join(workdir, f"video_{index}.mp4") for index in range(files)]
+        for path, data in zip(paths, payloads):
+            with open(path, "wb") as file:
+                file.write(data)
+
+        checks = (
+            ("retries", lambda: check_retries(paths[0], payloads[0])),
+            ("resume", lambda: check_resume(paths[1 % files], payloads[1 % files])),
+            ("upload_all", lambda: check_upload_all(paths, payloads, workers)),
+        )
+        for name, check in checks:
+            try:
+                result = check()
+            except Exception as e:
+                yield {"name": name, "ok": False, "error": f"{type(e).__name__}: {e}"}
+                continue
+            result["ok"] = result["exact"] and result.get("stopped", True)
+            yield {"name": name, **result}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check resumable uploads against a local fake endpoint that cuts"
+        + " connections and answers 503."
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=6 * CHUNK_SIZE + 1000,
+        help="Size of each uploaded file in bytes (default: 6 chunks and a bit).",
+    )
+    parser.add_argument(
+        "--files", type=int, default=4, help="Files for upload_all (default: 4)."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=3, help="Threads of upload_all (default: 3)."
+    )
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for result in run_checks(args.size, args.files, args.workers):
+        failures += not result["ok"]
+        status = "ok" if result["ok"] else "FAILED"
+        details = result.get("error") or ", ".join(
+            f"{key} {value}"
+            for key, value in result.items()
+            if key not in ("name", "ok")
+        )
+        print(f"{result['name']}: {status}, {details}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,31 @@
+import asyncio
+import os
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
 from oauth2client.file import Storage
 from oauth2client.client import flow_from_clientsecrets
 from oauth2client.tools import run_flow
 from pytube import YouTube
+from pix_code_stream import StreamDecoder
+from pix_code_upload import CHUNK_SIZE, ResumableUpload, upload_all
 
 CLIENT_SECRETS_FILE = "credentials/pix-code.json"
 SCOPES = ["https://www.googleapis.com/auth/youtube.upload"]
 API_SERVICE_NAME = "youtube"
 API_VERSION = "v3"
+UPLOAD_URL = (
+    "https://www.googleapis.com/upload/youtube/v3/videos"
+    + "?uploadType=resumable&part=snippet,status"
+)
+DOWNLOAD_DIRECTORY = "results/downloads/"
 
-def get_authenticated_service():
+def get_credentials():
     """
-    Create an authenticated YouTube service object by obtaining user credentials or
-    refreshing existing ones. This function facilitates the OAuth2 flow using
-    the client secrets file and stores the credentials for future use.
+    Obtain user credentials or refresh existing ones. This function facilitates
+    the OAuth2 flow using the client secrets file and stores the credentials for
+    future use.
 
     Returns:
-        googleapiclient.discovery.Resource: Authenticated YouTube API service object.
+        oauth2client.client.OAuth2Credentials: The user's credentials.
     """
     flow = flow_from_clientsecrets(CLIENT_SECRETS_FILE, scope=SCOPES)
     storage = Storage(f"{API_SERVICE_NAME}-{API_VERSION}.oauth2.json")
@@ -26,24 +34,47 @@ def get_authenticated_service():
     if credentials is None or credentials.invalid:
         credentials = run_flow(flow, storage)
 
-    return build(API_SERVICE_NAME, API_VERSION, credentials=credentials)
+    return credentials
+
+def get_authenticated_service():
+    """
+    Create an authenticated YouTube service object, see get_credentials.
+
+    Returns:
+        googleapiclient.discovery.Resource: Authenticated YouTube API service object.
+    """
+    return build(API_SERVICE_NAME, API_VERSION, credentials=get_credentials())
 
-def upload_video(youtube, file_path, title, description, category_id, keywords, privacy_status):
+def video_upload(credentials, file_path, title, description, category_id, keywords, privacy_status, chunk_size=CHUNK_SIZE, upload_url=UPLOAD_URL, **options):
     """
-    Uploads a video file to YouTube using the provided YouTube service object.
+    Prepares a chunked, resumable upload of a video file to YouTube.
 
     Args:
-        youtube (Resource): Authenticated YouTube API service object.
+        credentials (OAuth2Credentials): The user's credentials, see get_credentials.
+            The access token is refreshed when it expires during the upload.
         file_path (str): Path to the video file to be uploaded.
         title (str): Title of the video.
         description (str): Description of the video.
         category_id (str): YouTube category ID for the video.
         keywords (list[str]): List of tags for the video.
         privacy_status (str): Privacy status of the video (e.g., 'public', 'private', 'unlisted').
+        chunk_size (int, optional): Bytes sent per request, a multiple of 256 KiB.
+        upload_url (str, optional): Where the upload session is started.
+        **options: Further arguments of pix_code_upload.ResumableUpload, such as
+            state_path or max_retries.
 
     Returns:
-        dict: The API response containing information about the uploaded video.
+        ResumableUpload: The upload, ready to execute.
+
+    Raises:
+        TypeError: If given the YouTube service object of get_authenticated_service,
+            which upload_video took before it uploaded in chunks itself.
     """
+    if hasattr(credentials, "videos"):
+        raise TypeError(
+            "Pass the credentials of get_credentials, not a YouTube service object:"
+            + " uploads no longer go through the API client."
+        )
     body = {
         "snippet": {
             "title": title,
@@ -54,23 +85,126 @@ def upload_video(youtube, file_path, title, description, category_id, keywords,
         "status": {"privacyStatus": privacy_status},
     }
 
-    insert_request = youtube.videos().insert(
-        part=",".join(body.keys()),
-        body=body,
-        media_body=MediaFileUpload(file_path, chunksize=-1, resumable=True),
+    def headers():
+        return {"Authorization": f"Bearer {credentials.get_access_token().access_token}"}
+
+    return ResumableUpload(
+        file_path,
+        upload_url,
+        metadata=body,
+        headers=headers,
+        chunk_size=chunk_size,
+        **options,
     )
 
-    response = insert_request.execute()
-    return response
+def upload_video(credentials, file_path, title, description, category_id, keywords, privacy_status, progress=None, **options):
+    """
+    Uploads a video file to YouTube in chunks.
+
+    Failed requests are retried with backoff, and the progress is saved next to
+    the video ('<file_path>.upload.json'), so calling this again after an
+    interruption continues the upload instead of starting over.
+
+    Args:
+        credentials (OAuth2Credentials): The user's credentials, see get_credentials.
+            This used to be the service object of get_authenticated_service, which
+            is now rejected with a TypeError.
+        file_path, title, description, category_id, keywords, privacy_status:
+            See video_upload.
+        progress (callable, optional): Called with the upload after every chunk,
+            whose progress attribute is the fraction sent.
+        **options: Further arguments of video_upload.
 
-def download_video(url):
+    Returns:
+        dict: The API response containing information about the uploaded video.
+    """
+    upload = video_upload(credentials, file_path, title, description, category_id, keywords, privacy_status, **options)
+    return upload.execute(progress)
+
+def upload_videos(credentials, videos, workers=4, progress=None):
+    """
+    Uploads several videos, or the shards of one, to YouTube concurrently.
+
+    Args:
+        credentials (OAuth2Credentials): The user's credentials, see get_credentials.
+        videos (list[dict]): The arguments of video_upload for each video, without
+            the credentials.
+        workers (int, optional): Uploads running at once. Defaults to 4.
+        progress (callable, optional): Called with an upload after each of its chunks.
+
+    Yields:
+        tuple: The file path of each video and the API response, or the exception
+            that stopped its upload, in the order the uploads finish.
+    """
+    uploads = [video_upload(credentials, **video) for video in videos]
+    for upload, response in upload_all(uploads, workers, progress):
+        yield upload.file_path, response
+
+def download_video(url, output_path=DOWNLOAD_DIRECTORY):
     """
     Downloads the highest resolution video available from the specified YouTube URL
     and saves it locally.
 
     Args:
         url (str): The URL of the YouTube video to be downloaded.
+        output_path (str, optional): The folder to save it in.
+
+    Returns:
+        str: The path of the downloaded video.
     """
     yt = YouTube(url)
-    yt.streams.get_highest_resolution().download("results/downloads/")
-    print("Downloaded video from YouTube")
\ No newline at end of file
+    file_path = yt.streams.get_highest_resolution().download(output_path)
+    print("Downloaded video from YouTube")
+    return file_path
+
+async def fetch_and_decode_async(url, sink=None, pixel_size=None, output_path=DOWNLOAD_DIRECTORY, decoder=None):
+    """
+    Downloads a video from YouTube and decodes it at the same time.
+
+    The download runs in a thread and writes the video to disk as it arrives,
+    while a pix_code_stream.StreamDecoder follows the growing file and decodes
+    each frame as soon as it lands, so the decoded bytes start coming out
+    during the download. An mp4 that keeps its index at the end cannot be read
+    while it grows, and is decoded once the download has finished instead.
+
+    Args:
+        url (str): The URL of the YouTube video.
+        sink (str or file-like, optional): Where to write the decoded bytes.
+            Defaults to None, returning them in the result.
+        pixel_size (int, optional): The block size, for videos without a
+            calibration frame.
+        output_path (str, optional): The folder the video is saved in.
+        decoder (Decoder, optional): Decodes the frames. Defaults to a new Decoder.
+
+    Returns:
+        dict: The bytes decoded and the timings, see StreamDecoder.decode_raw.
+    """
+    stream = YouTube(url).streams.get_highest_resolution()
+    file_path = os.path.join(output_path, stream.default_filename)
+    # Never follow a stale copy of the video
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    done = asyncio.Event()
+
+    async def download():
+        try:
+            await asyncio.to_thread(stream.download, output_path)
+        finally:
+            done.set()
+
+    streamer = StreamDecoder(pixel_size, decoder)
+    _, result = await asyncio.gather(download(), streamer.decode_file(file_path, sink, done=done))
+    print("Downloaded and decoded video from YouTube")
+    return result
+
+def fetch_and_decode(url, sink=None, pixel_size=None, output_path=DOWNLOAD_DIRECTORY, decoder=None):
+    """
+    Downloads a video from YouTube and decodes it while it downloads.
+
+    Args:
+        See fetch_and_decode_async.
+
+    Returns:
+        dict: The bytes decoded and the timings, see StreamDecoder.decode_raw.
+    """
+    return asyncio.run(fetch_and_decode_async(url, sink, pixel_size, output_path, decoder))
\ No newline at end of file